@@ -1,13 +1,56 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, simpledialog, ttk
+import tkinter.font as tkfont
 import pandas as pd
 import os
+import threading
+from collections import OrderedDict
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 import numpy as np # For calculations
+try:
+    from numpy.lib.array_utils import byte_bounds # For detecting buffers shared between frames and variables
+except ImportError:
+    byte_bounds = np.byte_bounds # numpy < 2.0
 import matplotlib.pyplot as plt # For plotting
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk # For embedding plot
 from matplotlib.colors import Normalize # For colormaps
 from matplotlib import cm # For colormaps
 import scipy.interpolate as interp # For griddata (e.g., contour, streamplot)
+import hashlib # For disk cache file names
+import re # For extracting column names from filter expressions
+import weakref # For tying cached filter masks to their DataFrame
+import time # For timing file index updates
+import queue # For passing file change events to the Tk thread
+import fnmatch # For glob search of file names
+from pandas.tseries.api import guess_datetime_format # For fixing the date format in dtype compaction
+import json # For the persistent column catalog
+import tempfile # For the session scratch directory of spilled variables
+import shutil # For removing the scratch directory
+import atexit # For cleaning up the scratch directory on exit
+try:
+    import pyarrow as pa # For the on-disk Feather cache (optional)
+    import pyarrow.feather as pa_feather
+except ImportError:
+    pa = None
+    pa_feather = None
+try:
+    import python_calamine # Faster Excel engine for pandas (optional)
+except ImportError:
+    python_calamine = None
+try:
+    import psutil # For measuring process memory (optional)
+except ImportError:
+    psutil = None
+try:
+    import numexpr # Fast backend for pandas eval (optional)
+except ImportError:
+    numexpr = None
+try:
+    import inotify_simple # For watching directories with inotify on Linux (optional)
+except ImportError:
+    inotify_simple = None
 
 # ASCIIアートの生成
 # 'HALLAL' をかっこいいフォントで表示
@@ -19,16 +62,1178 @@ ASCII_ART_HALLAL = """
  |_| |_/_/   \_\_____/_/_/   \_\_|
 """
 
+# --- データフレームキャッシュ ---
+# キャッシュのメモリ予算 (バイト)。「キャッシュ設定」ボタンから変更できる。
+DATAFRAME_CACHE_BUDGET_BYTES = 2 * 1024 ** 3
+
+def format_bytes(num_bytes):
+    """バイト数を人間が読みやすい文字列 (KB, MB, GB...) に変換する。"""
+    size = float(num_bytes)
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{int(size)} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+def get_dataframe_nbytes(df):
+    """DataFrame/Seriesが使用するメモリ量をmemory_usage(deep=True)で測定する。"""
+    try:
+        usage = df.memory_usage(deep=True)
+        return int(usage.sum()) if hasattr(usage, 'sum') else int(usage)
+    except Exception:
+        return 0
+
+class DataFrameCache:
+    """
+    ロード済みDataFrameを保持する、メモリ予算付きのLRUキャッシュ。
+    合計サイズが予算を超えると、最も長く参照されていないエントリから追い出す。
+    変数は値をコピーして持ち、レシピから作り直せる (LazyVariable) ので、どのエントリも追い出せる。
+    各エントリは読み込み時のファイルシグネチャ (mtime_ns, size, inode) を持ち、
+    シグネチャが一致しない取得はミスとして扱う。
+    """
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self._entries = OrderedDict() # df_key -> {'df': DataFrame, 'nbytes': int, 'signature': tuple, 'last_access': float}
+        self._lock = threading.RLock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, df_key):
+        with self._lock:
+            return df_key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __getitem__(self, df_key):
+        df = self.get(df_key)
+        if df is None:
+            raise KeyError(df_key)
+        return df
+
+    def __setitem__(self, df_key, df):
+        self.put(df_key, df)
+
+    def __delitem__(self, df_key):
+        with self._lock:
+            if df_key not in self._entries:
+                raise KeyError(df_key)
+            self.pop(df_key)
+
+    def __iter__(self):
+        # 演算ページのコードからdictと同じように使えるよう、その時点のキーの一覧を順に返す
+        return iter(self.keys())
+
+    def get(self, df_key, default=None, signature=None):
+        """
+        キャッシュからDataFrameを取得する。取得したエントリは最新として扱う。
+        signatureを指定した場合、読み込み時のシグネチャと異なればミスとなる。
+        """
+        with self._lock:
+            entry = self._entries.get(df_key)
+            if entry is None or (signature is not None and entry['signature'] != signature):
+                self.misses += 1
+                return default
+            self._entries.move_to_end(df_key)
+            entry['last_access'] = time.time()
+            self.hits += 1
+            return entry['df']
+
+    def put(self, df_key, df, signature=None):
+        """DataFrameをキャッシュに追加し、予算を超えた分を追い出す。"""
+        nbytes = get_dataframe_nbytes(df)
+        with self._lock:
+            if df_key in self._entries:
+                self.total_bytes -= self._entries.pop(df_key)['nbytes']
+            self._entries[df_key] = {'df': df, 'nbytes': nbytes, 'signature': signature, 'last_access': time.time()}
+            self.total_bytes += nbytes
+            self._evict_if_needed(keep_key=df_key)
+
+    def pop(self, df_key, default=None):
+        """エントリをキャッシュから削除する。"""
+        with self._lock:
+            entry = self._entries.pop(df_key, None)
+            if entry is None:
+                return default
+            self.total_bytes -= entry['nbytes']
+            return entry['df']
+
+    def get_signature(self, df_key):
+        """エントリの読み込み時のファイルシグネチャを返す。"""
+        with self._lock:
+            entry = self._entries.get(df_key)
+            return entry['signature'] if entry else None
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def values(self):
+        """DataFrameのリストを返す。LRUの順序は変更しない。"""
+        with self._lock:
+            return [entry['df'] for entry in self._entries.values()]
+
+    def items(self):
+        """(df_key, DataFrame) のリストを返す。LRUの順序は変更しない。"""
+        with self._lock:
+            return [(df_key, entry['df']) for df_key, entry in self._entries.items()]
+
+    def snapshot(self):
+        """メモリの内訳の表示用に、各エントリの (df_key, DataFrame, nbytes, 最終アクセス時刻) を返す。"""
+        with self._lock:
+            return [(df_key, entry['df'], entry['nbytes'], entry['last_access'])
+                    for df_key, entry in self._entries.items()]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def set_budget(self, budget_bytes):
+        """メモリ予算を変更し、超過分を追い出す。"""
+        with self._lock:
+            self.budget_bytes = budget_bytes
+            self._evict_if_needed()
+
+    def _evict_if_needed(self, keep_key=None):
+        # 古い順に、予算内に収まるまで追い出す
+        for df_key in list(self._entries.keys()):
+            if self.total_bytes <= self.budget_bytes:
+                break
+            if df_key == keep_key:
+                continue
+            self.total_bytes -= self._entries.pop(df_key)['nbytes']
+            self.evictions += 1
+
+    def stats(self):
+        """UI表示用の統計情報を返す。"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'total_bytes': self.total_bytes,
+                'budget_bytes': self.budget_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+# --- フィルタのマスクのキャッシュ ---
+# フィルタ式の評価に使うエンジン (numexprがあれば高速なnumexpr、なければpython)
+FILTER_ENGINE = 'numexpr' if numexpr is not None else 'python'
+# キャッシュするマスクの合計サイズの上限 (バイト)。マスクは1行あたり1バイト。
+FILTER_MASK_CACHE_BUDGET_BYTES = 256 * 1024 ** 2
+
+class FilterMaskCache:
+    """
+    フィルタ式を評価した行のマスク (numpyの真偽値配列) を保持するLRUキャッシュ。
+    キーは (df_key, データのバージョン, フィルタ式) で、各エントリは評価したDataFrameへの
+    弱参照を持ち、同じDataFrameに対してだけ再利用する (再読み込みされたデータには使わない)。
+    範囲だけを変えて表示し直す場合などに、フィルタ式を評価し直さずに済む。
+    """
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self._entries = OrderedDict() # (df_key, version, expr) -> {'ref': weakref, 'mask': ndarray}
+        self._lock = threading.RLock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, df):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['ref']() is not df:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry['mask']
+
+    def put(self, key, df, mask):
+        with self._lock:
+            self.pop(key)
+            self._entries[key] = {'ref': weakref.ref(df), 'mask': mask}
+            self.total_bytes += mask.nbytes
+            while self.total_bytes > self.budget_bytes and len(self._entries) > 1:
+                oldest_key = next(iter(self._entries))
+                self.pop(oldest_key)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.total_bytes -= entry['mask'].nbytes
+            return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+# --- ファイルシステムの索引 ---
+# 索引に含めるファイルの拡張子と、検索用の種類コード (0はディレクトリ)
+INDEX_EXTENSION_CODES = {'.csv': 1, '.h5': 2, '.hdf': 3, '.xlsx': 4, '.xls': 5}
+# 曖昧検索で一致とみなす、検索語のトライグラムのうち共通するものの割合
+FUZZY_MIN_SIMILARITY = 0.6
+# ディレクトリを並列に読むスレッドの数 (ネットワークドライブでは往復の待ち時間を重ねて隠す)
+SCAN_CONCURRENCY = 16
+# 入力中の検索で表示する結果の最大件数
+SEARCH_RESULT_LIMIT = 200
+# 入力が止まってから検索するまでの待ち時間 (ミリ秒)
+SEARCH_DEBOUNCE_MS = 250
+
+def get_trigram_keys(strings):
+    """
+    文字列のリストの各文字列に含まれるトライグラムを、(キー, 文字列の番号) の配列として返す。
+    キーは3文字のコードポイントを1つのint64に詰めたもので、同じ文字列内の重複は除く。
+    """
+    if not strings:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32)
+    joined = "\n".join(strings)
+    # UTF-8として不正なファイル名 (Shift_JISの名前など) はサロゲートで表されるので、そのままコードにする
+    codes = np.frombuffer(joined.encode("utf-32-le", errors="surrogatepass"), dtype=np.uint32).astype(np.int64)
+    if len(codes) < 3:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32)
+    lengths = np.fromiter((len(text) + 1 for text in strings), dtype=np.int64, count=len(strings))
+    owners = np.repeat(np.arange(len(strings), dtype=np.int32), lengths)[:len(codes) - 2]
+    keys = (codes[:-2] << 42) | (codes[1:-1] << 21) | codes[2:]
+    newline = codes == 10
+    valid = ~(newline[:-2] | newline[1:-1] | newline[2:])
+    keys, owners = keys[valid], owners[valid]
+    order = np.lexsort((owners, keys))
+    keys, owners = keys[order], owners[order]
+    distinct = np.ones(len(keys), dtype=bool)
+    distinct[1:] = (keys[1:] != keys[:-1]) | (owners[1:] != owners[:-1])
+    return keys[distinct], owners[distinct]
+
+def build_trigram_postings(strings):
+    """トライグラムの転置索引 (キーの配列、各キーの開始位置、文字列の番号) を作る。"""
+    keys, owners = get_trigram_keys(strings)
+    unique_keys, starts = np.unique(keys, return_index=True)
+    return {'keys': unique_keys, 'starts': np.append(starts, len(keys)), 'owners': owners}
+
+def count_trigram_hits(postings, query_keys, size):
+    """検索語のトライグラムのうち、各文字列に含まれるものの数を返す。"""
+    positions = np.searchsorted(postings['keys'], query_keys)
+    hits = []
+    for key, pos in zip(query_keys, positions):
+        if pos < len(postings['keys']) and postings['keys'][pos] == key:
+            hits.append(postings['owners'][postings['starts'][pos]:postings['starts'][pos + 1]])
+    if not hits:
+        return np.zeros(size, dtype=np.int64)
+    return np.bincount(np.concatenate(hits), minlength=size)
+
+def compile_search_pattern(term, search_type):
+    """
+    glob ("glob") または正規表現 ("regex") の検索語を、大文字小文字を区別しないパターンにする。
+    '/'を含むglobは相対パスの途中の階層からでも一致する ('/'で始まる場合はルートから)。
+    """
+    if search_type == "glob":
+        if "/" in term and not term.startswith("/"):
+            return re.compile("(?:.*/)?" + fnmatch.translate(term), re.IGNORECASE)
+        return re.compile(fnmatch.translate(term.lstrip("/")), re.IGNORECASE)
+    return re.compile(term, re.IGNORECASE)
+
+def make_name_matcher(term, search_type="partial"):
+    """
+    名前 (ファイル名や列名) が検索語に一致するかどうかを返す関数を作る。
+    search_typeは "partial"/"full"/"fuzzy"/"glob"/"regex"。不正な正規表現はre.errorを送出する。
+    """
+    if search_type != "regex":
+        term = term.lower()
+    if not term:
+        return lambda name: True
+    if search_type == "full":
+        return lambda name: name.lower() == term
+    if search_type in ("glob", "regex"):
+        pattern = compile_search_pattern(term, search_type)
+        matcher = pattern.match if search_type == "glob" else pattern.search
+        return lambda name: bool(matcher(name.lower()))
+    if search_type == "fuzzy" and len(term) >= 3:
+        query_keys = np.unique(get_trigram_keys([term])[0])
+
+        def fuzzy_match(name):
+            name = name.lower()
+            if term in name:
+                return True
+            return np.isin(query_keys, get_trigram_keys([name])[0]).mean() >= FUZZY_MIN_SIMILARITY
+        return fuzzy_match
+    return lambda name: term in name.lower()
+
+def match_entry_name(name, term, search_type="partial"):
+    """名前が検索語に一致するかどうか (索引を使わない場合の判定)。"""
+    return make_name_matcher(term, search_type)(name)
+
+class FileSystemIndex:
+    """
+    ルートディレクトリ以下のディレクトリとサポートされているファイルの、メモリ上の索引。
+    os.scandirとDirEntryのstat情報でバックグラウンドで一度だけ作成し、ファイルツリーの展開、
+    名前の検索、拡張子と範囲 (ディレクトリ/ファイル) の絞り込みはディスクを読まずに行う。
+    名前とディレクトリの相対パスのトライグラムの転置索引で、曖昧検索の候補を絞り込む。
+    refresh()はmtimeが変わったディレクトリだけを読み直す。
+    ディレクトリの読み込みとstatはSCAN_CONCURRENCY個のスレッドで並列に行い、最初の作成中も
+    読み終えたディレクトリからlist_directoryで参照できる。
+    """
+    def __init__(self):
+        self._lock = threading.RLock() # 索引の参照と差し替え用
+        self._update_lock = threading.Lock() # build/refreshを直列化する
+        self._roots = []
+        self._dirs = {} # ディレクトリのパス -> {'mtime_ns', 'dev_ino', 'subdirs': [名前], 'files': [(名前, サイズ, mtime_ns)]}
+        self._search = None # 検索用の平坦な配列 (build_search_arrays)
+        self.ready = False
+        self.last_update_seconds = 0.0
+        self.scanned_count = 0 # 作成/更新中に読んだディレクトリの数 (進捗表示用)
+
+    @staticmethod
+    def scan_directory(path):
+        """1つのディレクトリを読み、サブディレクトリとサポートされているファイルの一覧を返す。"""
+        st = os.stat(path)
+        subdirs, files = [], []
+        with os.scandir(path) as scanned:
+            for entry in scanned:
+                try:
+                    if entry.is_dir():
+                        subdirs.append(entry.name)
+                    elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in INDEX_EXTENSION_CODES:
+                        entry_stat = entry.stat()
+                        files.append((entry.name, entry_stat.st_size, entry_stat.st_mtime_ns))
+                except OSError:
+                    continue
+        subdirs.sort(key=str.lower)
+        files.sort(key=lambda f: f[0].lower())
+        return {'mtime_ns': st.st_mtime_ns, 'dev_ino': (st.st_dev, st.st_ino), 'subdirs': subdirs, 'files': files}
+
+    def _walk(self, roots, dirs, visited, task=None):
+        """
+        rootsの各ディレクトリより下をすべて読み、dirsに追加する (シンボリックリンクのループは1回だけ辿る)。
+        同時に読むディレクトリはSCAN_CONCURRENCY個までで、読み終えたものから順にdirsに追加する。
+        """
+        waiting = list(roots)
+        in_flight = {} # Future -> パス
+        in_flight_paths = set()
+        with ThreadPoolExecutor(max_workers=SCAN_CONCURRENCY, thread_name_prefix="hallal-scan") as pool:
+            while waiting or in_flight:
+                while waiting and len(in_flight) < SCAN_CONCURRENCY:
+                    path = waiting.pop()
+                    if path in dirs or path in in_flight_paths:
+                        continue
+                    in_flight[pool.submit(self.scan_directory, path)] = path
+                    in_flight_paths.add(path)
+                if not in_flight:
+                    continue
+                done, _ = wait(in_flight, timeout=0.2, return_when=FIRST_COMPLETED)
+                if task is not None and task.is_cancelled():
+                    for future in in_flight:
+                        future.cancel()
+                    task.check_cancelled()
+                for future in done:
+                    path = in_flight.pop(future)
+                    in_flight_paths.discard(path)
+                    try:
+                        info = future.result()
+                    except OSError:
+                        continue
+                    if info['dev_ino'] in visited:
+                        continue
+                    visited.add(info['dev_ino'])
+                    dirs[path] = info
+                    self.scanned_count += 1
+                    waiting.extend(os.path.join(path, name) for name in reversed(info['subdirs']))
+
+    @staticmethod
+    def _parallel_map(func, items):
+        """funcをitemsの各要素にSCAN_CONCURRENCY個のスレッドで並列に適用し、結果のリストを返す。"""
+        if len(items) < 2:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=SCAN_CONCURRENCY, thread_name_prefix="hallal-scan") as pool:
+            return list(pool.map(func, items))
+
+    @staticmethod
+    def _stat_mtime_ns(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    @classmethod
+    def _try_scan_directory(cls, path):
+        try:
+            return cls.scan_directory(path)
+        except OSError:
+            return None
+
+    def build(self, roots, task=None):
+        """
+        ルートディレクトリ以下をすべて読み、索引を作り直す。
+        最初の作成では、読み終えたディレクトリから順にlist_directoryで参照できるようにする。
+        """
+        with self._update_lock:
+            start_time = time.perf_counter()
+            dirs = {}
+            visited = set()
+            self.scanned_count = 0
+            if not self.ready:
+                with self._lock:
+                    self._dirs = dirs # 作成中のdictを公開する (追加するのは走査するスレッドだけ)
+            self._walk(roots, dirs, visited, task)
+            search = self.build_search_arrays(roots, dirs)
+            with self._lock:
+                self._roots = list(roots)
+                self._dirs = dirs
+                self._search = search
+                self.ready = True
+            self.last_update_seconds = time.perf_counter() - start_time
+            return len(dirs)
+
+    def refresh(self, roots, task=None, only_dirs=None):
+        """
+        mtimeが変わったディレクトリだけを読み直して索引を更新する。新しいルートは読み込み、
+        消えたディレクトリは取り除く。only_dirsを指定すると、そのディレクトリだけをmtimeによらず読み直す。
+        変更のイベント ('added'/'removed'/'modified', パス, ディレクトリならTrue) のリストを返す。
+        """
+        with self._update_lock:
+            start_time = time.perf_counter()
+            with self._lock:
+                dirs = dict(self._dirs)
+            events = []
+            new_subdirs = []
+            self.scanned_count = 0
+            targets = list(dirs.items()) if only_dirs is None else [(path, dirs[path]) for path in only_dirs if path in dirs]
+            # statと変わったディレクトリの読み直しは並列に行い、結果は元の順に反映する
+            mtimes = self._parallel_map(self._stat_mtime_ns, [path for path, _ in targets])
+            if task is not None:
+                task.check_cancelled()
+            changed_paths = [path for (path, info), mtime_ns in zip(targets, mtimes)
+                             if mtime_ns is not None and (mtime_ns != info['mtime_ns'] or only_dirs is not None)]
+            new_infos = dict(zip(changed_paths, self._parallel_map(self._try_scan_directory, changed_paths)))
+            for (path, info), mtime_ns in zip(targets, mtimes):
+                if task is not None:
+                    task.check_cancelled()
+                if path not in dirs:
+                    continue # 親ディレクトリと一緒に取り除かれた
+                if mtime_ns is None:
+                    self._remove_tree(dirs, path)
+                    events.append(('removed', path, True))
+                    continue
+                new_info = new_infos.get(path)
+                if new_info is None:
+                    continue
+                self.scanned_count += 1
+                dirs[path] = new_info
+                events.extend(self.diff_directory(path, info, new_info))
+                for name in set(info['subdirs']) - set(new_info['subdirs']):
+                    self._remove_tree(dirs, os.path.join(path, name))
+                new_subdirs.extend(os.path.join(path, name) for name in new_info['subdirs'])
+            # 名前の変更 (同じinode) を辿れるよう、取り除き終えてから新しいサブディレクトリを読む
+            visited = {info['dev_ino'] for info in dirs.values()}
+            self._walk(new_subdirs, dirs, visited, task)
+            new_roots = [root for root in roots if root not in dirs]
+            self._walk(new_roots, dirs, visited, task)
+            events.extend(('added', root, True) for root in new_roots if root in dirs)
+            if events or list(roots) != self._roots:
+                search = self.build_search_arrays(roots, dirs)
+                with self._lock:
+                    self._roots = list(roots)
+                    self._dirs = dirs
+                    self._search = search
+            self.ready = True
+            self.last_update_seconds = time.perf_counter() - start_time
+            return events
+
+    @staticmethod
+    def diff_directory(path, old_info, new_info):
+        """ディレクトリを読み直す前後の一覧を比べ、追加/削除/変更のイベントを返す。"""
+        events = []
+        old_subdirs, new_subdirs = set(old_info['subdirs']), set(new_info['subdirs'])
+        events.extend(('added', os.path.join(path, name), True) for name in new_subdirs - old_subdirs)
+        events.extend(('removed', os.path.join(path, name), True) for name in old_subdirs - new_subdirs)
+        old_files = {name: (size, mtime_ns) for name, size, mtime_ns in old_info['files']}
+        new_files = {name: (size, mtime_ns) for name, size, mtime_ns in new_info['files']}
+        for name, stat_info in new_files.items():
+            if name not in old_files:
+                events.append(('added', os.path.join(path, name), False))
+            elif old_files[name] != stat_info:
+                events.append(('modified', os.path.join(path, name), False))
+        events.extend(('removed', os.path.join(path, name), False) for name in old_files.keys() - new_files.keys())
+        return events
+
+    def files(self):
+        """索引にあるファイルの (パス, サイズ, mtime_ns) のリストを返す。"""
+        with self._lock:
+            return [(os.path.join(path, name), size, mtime_ns)
+                    for path, info in self._dirs.items() for name, size, mtime_ns in info['files']]
+
+    def directories(self):
+        """索引にあるディレクトリのパスのリストを返す。"""
+        with self._lock:
+            return list(self._dirs)
+
+    @staticmethod
+    def _remove_tree(dirs, path):
+        """ディレクトリとその下のディレクトリを索引から取り除く。"""
+        prefix = os.path.join(path, "")
+        for dir_path in [p for p in dirs if p == path or p.startswith(prefix)]:
+            del dirs[dir_path]
+
+    @staticmethod
+    def build_search_arrays(roots, dirs):
+        """
+        検索用に、各ルートから辿れるエントリの名前 (小文字) を改行で連結した文字列と、
+        各エントリの開始位置、パス、種類コード、ルート番号の配列を作る。
+        """
+        names, paths, kinds, root_ids, parent_ids = [], [], [], [], []
+        dir_rel_paths = [] # ディレクトリのルートからの相対パス (小文字、区切りは'/')
+        for root_id, root in enumerate(roots):
+            stack = [(root, len(dir_rel_paths))]
+            dir_rel_paths.append("")
+            while stack:
+                dir_path, dir_id = stack.pop()
+                info = dirs.get(dir_path)
+                if info is None:
+                    continue
+                prefix = dir_rel_paths[dir_id] + "/" if dir_rel_paths[dir_id] else ""
+                for name in info['subdirs']:
+                    sub_path = os.path.join(dir_path, name)
+                    names.append(name.lower())
+                    paths.append(sub_path)
+                    kinds.append(0)
+                    root_ids.append(root_id)
+                    parent_ids.append(dir_id)
+                    stack.append((sub_path, len(dir_rel_paths)))
+                    dir_rel_paths.append(prefix + name.lower())
+                for name, _, _ in info['files']:
+                    names.append(name.lower())
+                    paths.append(os.path.join(dir_path, name))
+                    kinds.append(INDEX_EXTENSION_CODES[os.path.splitext(name)[1].lower()])
+                    root_ids.append(root_id)
+                    parent_ids.append(dir_id)
+        lengths = np.fromiter((len(name) + 1 for name in names), dtype=np.int64, count=len(names))
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1])) if len(names) else np.zeros(0, dtype=np.int64)
+        parent_ids = np.array(parent_ids, dtype=np.int32)
+        dir_lengths = np.fromiter((len(rel) + 1 for rel in dir_rel_paths), dtype=np.int64, count=len(dir_rel_paths))
+        return {'joined': "\n".join(names), 'offsets': offsets, 'paths': paths, 'names': names,
+                'kinds': np.array(kinds, dtype=np.int8), 'root_ids': np.array(root_ids, dtype=np.int32),
+                'roots': list(roots), 'parent_ids': parent_ids, 'dir_rel_paths': dir_rel_paths,
+                'rel_lengths': (dir_lengths[parent_ids] + lengths - 1) if len(names) else np.zeros(0, dtype=np.int64),
+                'name_trigrams': build_trigram_postings(names),
+                'dir_trigrams': build_trigram_postings(dir_rel_paths)}
+
+    def list_directory(self, path):
+        """索引にあるディレクトリの (サブディレクトリ名のリスト, ファイルのリスト) を返す。なければNone。"""
+        with self._lock:
+            info = self._dirs.get(path)
+            if info is None:
+                return None
+            return list(info['subdirs']), list(info['files'])
+
+    def search(self, term, extensions=None, scope="all", search_type="partial", root=None):
+        """
+        名前で検索し、一致したエントリのパスと種類 (ディレクトリならTrue) のリストを返す。
+        search_typeは "partial" (部分一致)、"full" (完全一致)、"fuzzy" (トライグラムによる曖昧一致)、
+        "glob"、"regex" のいずれか。scopeは "all"/"directories"/"files"。
+        extensionsを指定するとファイルをその拡張子に絞り、rootを指定するとそのルートの下だけを返す。
+        """
+        results, _ = self.search_ranked(term, extensions, scope, search_type, root, limit=None)
+        return results
+
+    def search_ranked(self, term, extensions=None, scope="all", search_type="partial", root=None, limit=SEARCH_RESULT_LIMIT):
+        """
+        searchと同じ条件で検索し、一致度の高い順 (同じなら相対パスの短い順) に上位limit件を返す。
+        (結果のリスト, 一致した総数) を返す。検索語が'/'を含む場合、glob/regex/fuzzyは相対パスを対象にする。
+        正規表現が不正な場合はre.errorを送出する。
+        """
+        with self._lock:
+            search = self._search
+        if search is None:
+            return [], 0
+        indices, scores = self._match_entries(search, term if search_type == "regex" else term.lower(), search_type)
+        indices, scores = self._filter_entries(search, indices, scores, extensions, scope, root)
+        total = len(indices)
+        if limit is not None and total:
+            order = np.lexsort((search['rel_lengths'][indices], -scores))[:limit]
+            indices = indices[order]
+        return [(search['paths'][i], bool(search['kinds'][i] == 0)) for i in indices], total
+
+    @staticmethod
+    def _match_entries(search, term, search_type):
+        """検索語に一致するエントリの番号と一致度 (大きいほど良い) の配列を返す。"""
+        num_entries = len(search['paths'])
+        if not term:
+            return np.arange(num_entries), np.zeros(num_entries)
+        if search_type == "partial" and "/" in term:
+            term, search_type = re.escape(term), "regex" # 相対パスの部分一致
+        if search_type in ("glob", "regex"):
+            pattern = compile_search_pattern(term, search_type)
+            matcher = pattern.match if search_type == "glob" else pattern.search
+            if "/" in term:
+                rel_paths, parent_ids = search['dir_rel_paths'], search['parent_ids']
+                targets = ((rel_paths[parent_ids[i]] + "/" if rel_paths[parent_ids[i]] else "") + name
+                           for i, name in enumerate(search['names']))
+            else:
+                targets = search['names']
+            indices = np.fromiter((i for i, text in enumerate(targets) if matcher(text)), dtype=np.int64)
+            return indices, np.zeros(len(indices))
+        if search_type == "fuzzy" and len(term.replace("/", "")) >= 3:
+            query_keys = np.unique(get_trigram_keys([term])[0])
+            if len(query_keys):
+                name_hits = count_trigram_hits(search['name_trigrams'], query_keys, num_entries)
+                dir_hits = count_trigram_hits(search['dir_trigrams'], query_keys, len(search['dir_rel_paths']))
+                # 名前と親ディレクトリの相対パスのどちらかに含まれるトライグラムの割合 (名前の一致を優先する)
+                similarity = np.minimum(name_hits + dir_hits[search['parent_ids']], len(query_keys)) / len(query_keys)
+                indices = np.flatnonzero(similarity >= FUZZY_MIN_SIMILARITY)
+                scores = similarity[indices] + name_hits[indices] / len(query_keys)
+                substring = FileSystemIndex._match_entries(search, term, "partial")[0]
+                scores[np.isin(indices, substring)] += 2 # 名前に検索語をそのまま含むものを先頭にする
+                return indices, scores
+        if search_type == "full":
+            pattern = f"(?m)^{re.escape(term)}$"
+        else:
+            pattern = re.escape(term)
+        starts = np.fromiter((match.start() for match in re.finditer(pattern, search['joined'])), dtype=np.int64)
+        entry_ids = np.searchsorted(search['offsets'], starts, side='right') - 1
+        indices, first = np.unique(entry_ids, return_index=True)
+        # 完全一致 > 前方一致 > 部分一致 の順に並べる
+        is_prefix = starts[first] == search['offsets'][indices]
+        is_exact = is_prefix & (np.fromiter((len(search['names'][i]) for i in indices), dtype=np.int64,
+                                            count=len(indices)) == len(term))
+        return indices, is_prefix.astype(float) + is_exact
+
+    @staticmethod
+    def _filter_entries(search, indices, scores, extensions, scope, root):
+        """種類 (ディレクトリ/拡張子) とルートで検索結果を絞り込む。"""
+        allowed_kinds = []
+        if scope in ("all", "directories"):
+            allowed_kinds.append(0)
+        if scope in ("all", "files"):
+            allowed_kinds.extend(code for ext, code in INDEX_EXTENSION_CODES.items()
+                                 if extensions is None or ext in extensions)
+        keep = np.isin(search['kinds'][indices], allowed_kinds)
+        if root is not None:
+            if root not in search['roots']:
+                return indices[:0], scores[:0]
+            keep &= search['root_ids'][indices] == search['roots'].index(root)
+        return indices[keep], scores[keep]
+
+    def stats(self):
+        """索引のディレクトリ数とファイル数を返す。"""
+        with self._lock:
+            search = self._search
+            num_dirs = len(self._dirs)
+        num_entries = len(search['paths']) if search is not None else 0
+        num_subdirs = int((search['kinds'] == 0).sum()) if search is not None else 0
+        return {'directories': num_dirs, 'files': num_entries - num_subdirs}
+
+# --- ディレクトリの変更の監視 ---
+# stat のポーリングの最短間隔 (秒)。索引の更新にかかった時間に応じて長くする
+WATCH_POLL_INTERVAL_SECONDS = 2.0
+# Tkスレッドで1回に処理する変更イベントの数
+FILE_EVENT_BATCH_SIZE = 200
+
+class DirectoryWatcher:
+    """
+    ルートディレクトリの変更を監視するスレッド。inotify_simpleがあればinotifyで、なければ
+    ディレクトリのmtimeのstatのポーリングで変更を検出し、ファイルシステムの索引を更新して
+    変更イベント ('added'/'removed'/'modified', パス, ディレクトリならTrue) をキューに入れる。
+    読み込み済みのファイル (get_watched_files) は内容の変更も検出する。
+    イベントはTkスレッドがafter()でキューから少しずつ取り出して、ツリーとキャッシュに反映する。
+    """
+    def __init__(self, index, roots, watched_files=None):
+        self.index = index
+        self.roots = roots # global_root_directoriesを共有する (毎回コピーして使う)
+        self.watched_files = watched_files
+        self.events = queue.Queue()
+        self._stop_event = threading.Event()
+        self._file_signatures = {}
+        self._thread = threading.Thread(target=self._run, name="hallal-watcher", daemon=True)
+        self.backend = None
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def _run(self):
+        while not self.index.ready: # 索引の作成が終わるまで待つ
+            if self._stop_event.wait(0.5):
+                return
+        if inotify_simple is not None:
+            try:
+                self._run_inotify()
+                return
+            except OSError:
+                pass # 監視できるディレクトリ数の上限などでinotifyを使えない場合はポーリングする
+        self._run_polling()
+
+    def _emit(self, events):
+        for event in events:
+            self.events.put(event)
+
+    def _check_watched_files(self):
+        """読み込み済みのファイルのシグネチャを比べ、内容の変更と削除を検出する。"""
+        if self.watched_files is None:
+            return []
+        events = []
+        current = {}
+        for path in self.watched_files():
+            signature = get_file_signature(path)
+            previous = self._file_signatures.get(path)
+            if path in self._file_signatures and signature != previous:
+                events.append(('modified' if signature is not None else 'removed', path, False))
+            current[path] = signature
+        self._file_signatures = current
+        return events
+
+    def _poll_watched_files(self, events):
+        """
+        読み込み済みのファイルの変更イベントのうち、eventsで報告していないものをeventsに追加する。
+        例外で監視スレッドが止まらないよう、失敗した場合は次の確認に回す。
+        """
+        reported = {event[1] for event in events}
+        try:
+            file_events = self._check_watched_files()
+        except Exception as e:
+            print(f"Error checking watched files: {e}")
+            return
+        events.extend(event for event in file_events if event[1] not in reported)
+
+    def _run_polling(self):
+        self.backend = "polling"
+        while not self._stop_event.is_set():
+            try:
+                events = self.index.refresh(list(self.roots))
+            except Exception as e:
+                print(f"Error refreshing file index: {e}")
+                events = []
+            self._poll_watched_files(events)
+            self._emit(events)
+            interval = max(WATCH_POLL_INTERVAL_SECONDS, 10 * self.index.last_update_seconds)
+            self._stop_event.wait(interval)
+
+    def _run_inotify(self):
+        watch_flags = (inotify_simple.flags.CREATE | inotify_simple.flags.DELETE | inotify_simple.flags.MOVED_FROM |
+                       inotify_simple.flags.MOVED_TO | inotify_simple.flags.CLOSE_WRITE | inotify_simple.flags.DELETE_SELF)
+        inotify = inotify_simple.INotify()
+        watch_paths = {} # wd -> ディレクトリのパス
+        watched_dirs = set()
+
+        def add_watch(path):
+            if path not in watched_dirs:
+                watch_paths[inotify.add_watch(path, watch_flags)] = path
+                watched_dirs.add(path)
+
+        try:
+            for path in self.index.directories():
+                add_watch(path)
+            self.backend = "inotify"
+            last_file_check = 0.0
+            while not self._stop_event.is_set():
+                dirty_dirs = set()
+                modified = set()
+                for event in inotify.read(timeout=1000, read_delay=200):
+                    dir_path = watch_paths.get(event.wd)
+                    if dir_path is None:
+                        continue
+                    if event.mask & inotify_simple.flags.IGNORED:
+                        watch_paths.pop(event.wd, None)
+                        watched_dirs.discard(dir_path)
+                    elif event.mask & inotify_simple.flags.CLOSE_WRITE:
+                        modified.add(os.path.join(dir_path, event.name))
+                    else:
+                        dirty_dirs.add(dir_path)
+                events = self.index.refresh(list(self.roots), only_dirs=dirty_dirs) if dirty_dirs else []
+                reported = {event[1] for event in events}
+                for path in modified - reported:
+                    if os.path.splitext(path)[1].lower() in INDEX_EXTENSION_CODES:
+                        events.append(('modified', path, False))
+                for event in events:
+                    if event[1] in self._file_signatures: # 同じ変更をシグネチャの確認でもう一度報告しない
+                        self._file_signatures[event[1]] = get_file_signature(event[1])
+                # 索引の外のファイルや、閉じずに書き換えられたファイルはinotifyで検出できないため、
+                # ポーリングと同じ間隔でシグネチャも確認する
+                if time.monotonic() - last_file_check >= WATCH_POLL_INTERVAL_SECONDS:
+                    self._poll_watched_files(events)
+                    last_file_check = time.monotonic()
+                for kind, path, is_dir in events:
+                    if kind == 'added' and is_dir:
+                        # 新しいディレクトリ (とその下のディレクトリ) も監視する
+                        prefix = os.path.join(path, "")
+                        for sub_path in self.index.directories():
+                            if sub_path == path or sub_path.startswith(prefix):
+                                add_watch(sub_path)
+                self._emit(events)
+        finally:
+            inotify.close()
+
+# --- 列名のカタログ ---
+# カタログを保存するファイル
+COLUMN_CATALOG_PATH = os.path.join(os.path.expanduser("~"), ".hallal_column_catalog.json")
+# カタログの更新中に途中経過を保存する間隔 (ファイル数)
+COLUMN_CATALOG_SAVE_INTERVAL = 200
+
+class ColumnCatalog:
+    """
+    ファイルに含まれる列名のカタログ。CSVのヘッダー、HDF5のノードのメタデータ、Excelの各シートの
+    先頭行だけを読んで (read_file_headers)、パス -> {'size', 'mtime_ns', 'datasets': [[シート/キー, [列名]]]}
+    をJSONファイルに保存する。サイズとmtimeが変わらないファイルは読み直さない。
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock() # updateを直列化する
+        self._entries = {}
+        self._dirty = False
+        self.loaded = False
+        self.progress = {'done': 0, 'total': 0} # 更新中の進捗 (Tkスレッドから読む)
+
+    def load(self):
+        """保存されたカタログを読み込む。読めない場合は空のカタログから始める。"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f).get('files', {})
+        except (OSError, ValueError, AttributeError):
+            entries = {}
+        with self._lock:
+            self._entries = entries
+            self._dirty = False
+            self.loaded = True
+
+    def save(self):
+        """変更があればカタログを一時ファイルに書き、置き換えて保存する。"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {'version': 1, 'files': dict(self._entries)}
+            self._dirty = False
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Error saving column catalog {self.path}: {e}")
+
+    def is_current(self, file_path, size, mtime_ns):
+        with self._lock:
+            entry = self._entries.get(file_path)
+        return entry is not None and entry['size'] == size and entry['mtime_ns'] == mtime_ns
+
+    def prune(self, existing_paths, roots):
+        """ルートの下にあって、もう存在しないファイルのエントリを取り除く。"""
+        prefixes = tuple(os.path.join(root, "") for root in roots)
+        with self._lock:
+            removed = [path for path in self._entries if path.startswith(prefixes) and path not in existing_paths]
+            for path in removed:
+                del self._entries[path]
+            if removed:
+                self._dirty = True
+        return len(removed)
+
+    def update(self, files, task=None):
+        """
+        (パス, サイズ, mtime_ns) のリストのうち、カタログにないか変更されたファイルの列名を読む。
+        読めなかったファイルもエラーとして記録し、変更されるまで読み直さない。読んだファイル数を返す。
+        """
+        with self._update_lock:
+            if not self.loaded:
+                self.load()
+            stale = [(path, size, mtime_ns) for path, size, mtime_ns in files if not self.is_current(path, size, mtime_ns)]
+            self.progress = {'done': 0, 'total': len(stale)}
+            for count, (path, size, mtime_ns) in enumerate(stale, 1):
+                if task is not None:
+                    task.check_cancelled()
+                entry = {'size': size, 'mtime_ns': mtime_ns, 'datasets': []}
+                try:
+                    entry['datasets'] = read_file_headers(path)
+                except Exception as e:
+                    entry['error'] = str(e)
+                with self._lock:
+                    self._entries[path] = entry
+                    self._dirty = True
+                self.progress = {'done': count, 'total': len(stale)}
+                if count % COLUMN_CATALOG_SAVE_INTERVAL == 0:
+                    self.save()
+            self.save()
+            return len(stale)
+
+    def search(self, term, search_type="partial", extensions=None, root=None, limit=None):
+        """
+        列名で検索し、一致した (パス, シート/キー, 一致した列名のリスト) をパス順に返す。
+        (結果のリスト, 一致した総数) を返す。extensionsとrootでファイルを絞り込む。
+        """
+        matcher = make_name_matcher(term, search_type)
+        prefix = os.path.join(root, "") if root is not None else None
+        with self._lock:
+            entries = list(self._entries.items())
+        matched_names = {} # 同じ列名を何度も判定しない
+        results = []
+        for path, entry in sorted(entries):
+            if prefix is not None and not path.startswith(prefix):
+                continue
+            if extensions is not None and os.path.splitext(path)[1].lower() not in extensions:
+                continue
+            for dataset, columns in entry['datasets']:
+                hits = []
+                for column in columns:
+                    if column not in matched_names:
+                        matched_names[column] = matcher(column)
+                    if matched_names[column]:
+                        hits.append(column)
+                if hits:
+                    results.append((path, dataset, hits))
+        total = len(results)
+        return (results[:limit] if limit is not None else results), total
+
+    def stats(self):
+        """カタログのファイル数とデータセット (シート/キー) の数を返す。"""
+        with self._lock:
+            return {'files': len(self._entries),
+                    'datasets': sum(len(entry['datasets']) for entry in self._entries.values())}
+
+# --- 変数の値の退避 ---
+class VariableStore:
+    """
+    変数の値を退避するセッションごとの一時ディレクトリと、メモリの閾値を管理する。
+    数値・真偽値・日時の配列 (Series/ndarray) は.npyファイルに書き出し、アクセス時には
+    np.load(mmap_mode='r')でメモリマップして読む (ページの読み込みと解放はOSに任せる)。
+    """
+    def __init__(self, memory_budget_bytes, min_available_bytes):
+        self.memory_budget_bytes = memory_budget_bytes # 常駐させる変数の値の合計の上限
+        self.min_available_bytes = min_available_bytes # システムの空きメモリがこれを下回ったら退避する (psutilがある場合)
+        self.directory = None
+        self._lock = threading.Lock()
+        self._counter = 0
+
+    def scratch_directory(self):
+        """一時ディレクトリを (初回に) 作って返す。終了時に削除する。"""
+        with self._lock:
+            if self.directory is None:
+                self.directory = tempfile.mkdtemp(prefix="hallal_variables_")
+                atexit.register(shutil.rmtree, self.directory, True)
+            return self.directory
+
+    @staticmethod
+    def can_spill(value):
+        """値を.npyに書き出してメモリマップで読み戻せるか (オブジェクト型や拡張型の配列は不可)。"""
+        if isinstance(value, pd.Series):
+            dtype = value.dtype
+        elif isinstance(value, np.ndarray):
+            dtype = value.dtype
+        else:
+            return False
+        return isinstance(dtype, np.dtype) and dtype.kind in "biufcmM"
+
+    def spill(self, value, base_path=None):
+        """
+        値を.npyファイルに書き出し、読み戻すための記録を返す。Seriesのインデックスは、RangeIndexなら
+        範囲だけを、数値・日時なら別の.npyに書き、それ以外はメモリに残す。
+        base_pathを指定した場合 (ワークスペースの保存) はそこに書き出し、残りのインデックスもpickleで書き出す。
+        """
+        persistent = base_path is not None
+        if base_path is None:
+            directory = self.scratch_directory()
+            with self._lock:
+                self._counter += 1
+                base_path = os.path.join(directory, f"var_{self._counter}")
+        record = {'paths': [], 'series': isinstance(value, pd.Series), 'name': None, 'index': None}
+        values = value.to_numpy() if record['series'] else value
+        np.save(base_path + ".npy", values, allow_pickle=False)
+        record['paths'].append(base_path + ".npy")
+        if record['series']:
+            record['name'] = value.name
+            index = value.index
+            if isinstance(index, pd.RangeIndex):
+                record['index'] = index
+            elif isinstance(index.dtype, np.dtype) and index.dtype.kind in "biufmM" and index.nlevels == 1:
+                np.save(base_path + "_index.npy", index.to_numpy(), allow_pickle=False)
+                record['paths'].append(base_path + "_index.npy")
+                record['index'] = ('npy', base_path + "_index.npy", index.name)
+            elif persistent:
+                pd.to_pickle(index, base_path + "_index.pkl")
+                record['paths'].append(base_path + "_index.pkl")
+                record['index'] = ('pickle', base_path + "_index.pkl", None)
+            else:
+                record['index'] = index
+        return record
+
+    @staticmethod
+    def write_pickle(value, base_path):
+        """.npyに書き出せない値 (オブジェクト型のSeriesなど) をpickleで書き出し、記録を返す。"""
+        pd.to_pickle(value, base_path + ".pkl")
+        return {'format': 'pickle', 'paths': [base_path + ".pkl"], 'series': False, 'name': None, 'index': None}
+
+    @staticmethod
+    def copy_record(record, base_path):
+        """退避済みのファイルをbase_pathで始まるファイルにコピーし、コピーの記録を返す。"""
+        copied = dict(record, paths=[])
+        for path, suffix in zip(record['paths'], ("", "_index")):
+            new_path = base_path + suffix + os.path.splitext(path)[1]
+            shutil.copyfile(path, new_path)
+            copied['paths'].append(new_path)
+        index = record.get('index')
+        if isinstance(index, tuple):
+            copied['index'] = (index[0], copied['paths'][1], index[2])
+        elif index is not None and not isinstance(index, pd.RangeIndex):
+            pd.to_pickle(index, base_path + "_index.pkl")
+            copied['paths'].append(base_path + "_index.pkl")
+            copied['index'] = ('pickle', base_path + "_index.pkl", None)
+        return copied
+
+    @staticmethod
+    def load(record, mmap_mode='c'):
+        """
+        退避した値をメモリマップで読み戻す。pickleで書き出した値は読み込む。既定のmmap_mode='c'では、
+        その場での書き換えはプロセス内のページにだけ反映され、ファイルは変わらない。
+        """
+        if record.get('format') == 'pickle':
+            return pd.read_pickle(record['paths'][0])
+        values = np.load(record['paths'][0], mmap_mode=mmap_mode)
+        if not record['series']:
+            return values
+        index = record['index']
+        if isinstance(index, tuple):
+            kind, path, name = index
+            if kind == 'pickle':
+                index = pd.read_pickle(path)
+            else:
+                index = pd.Index(np.load(path, mmap_mode='r'), name=name, copy=False)
+        return pd.Series(values, index=index, name=record['name'], copy=False)
+
+    @staticmethod
+    def matches_record(record, value):
+        """値が書き出し済みのファイルの内容と同じか (読み戻した後にその場で書き換えられていないか)。"""
+        try:
+            stored = VariableStore.load(record, mmap_mode='r')
+        except (OSError, ValueError):
+            return False
+        if isinstance(value, pd.Series):
+            return isinstance(stored, pd.Series) and value.equals(stored)
+        if not isinstance(value, np.ndarray) or not isinstance(stored, np.ndarray):
+            return False
+        if value.shape != stored.shape or value.dtype != stored.dtype:
+            return False
+        try:
+            return np.array_equal(value, stored, equal_nan=True)
+        except TypeError: # NaNを持たないdtype
+            return np.array_equal(value, stored)
+
+    @staticmethod
+    def record_to_manifest(record, directory):
+        """記録をワークスペースのマニフェスト (JSON) に書ける形にする。パスはdirectoryからの相対パスにする。"""
+        data = {'format': record.get('format', 'npy'), 'paths': [os.path.relpath(path, directory) for path in record['paths']],
+                'series': record['series'], 'name': record['name']}
+        index = record.get('index')
+        if isinstance(index, pd.RangeIndex):
+            data['index'] = {'range': [index.start, index.stop, index.step], 'name': index.name}
+        elif isinstance(index, tuple):
+            data['index'] = {index[0]: os.path.relpath(index[1], directory), 'name': index[2]}
+        return data
+
+    @staticmethod
+    def record_from_manifest(data, directory):
+        """record_to_manifestの逆。ファイルは開かない。"""
+        record = {'format': data.get('format', 'npy'), 'paths': [os.path.join(directory, path) for path in data['paths']],
+                  'series': data.get('series', False), 'name': data.get('name'), 'index': None}
+        index = data.get('index')
+        if index is not None:
+            if 'range' in index:
+                record['index'] = pd.RangeIndex(*index['range'], name=index.get('name'))
+            else:
+                kind = 'npy' if 'npy' in index else 'pickle'
+                record['index'] = (kind, os.path.join(directory, index[kind]), index.get('name'))
+        return record
+
+    @staticmethod
+    def remove_files(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+# ディスクキャッシュ (Feather形式) のディレクトリ。Noneの場合は無効 (オプトイン)。
+disk_cache_directory = None
+# ディスクキャッシュの最大サイズ (バイト)。超過すると最も古く使われたファイルから削除する。
+DISK_CACHE_MAX_BYTES = 20 * 1024 ** 3
+disk_cache_max_bytes = DISK_CACHE_MAX_BYTES
+
+# 読み込み時の型の最適化の設定。Noneの場合は無効 (オプトイン)。
+# 'float_tolerance': float64をfloat32にする際に許す相対誤差 (0なら値が変わらない列だけ)
+# 'category_max_ratio': 種類数が行数のこの割合以下の文字列の列をcategoryにする
+# 'parse_dates': 日付の形をした文字列の列をdatetime64にする
+dtype_compaction_settings = None
+DTYPE_COMPACTION_DEFAULTS = {'float_tolerance': 0.0, 'category_max_ratio': 0.5, 'parse_dates': True}
+
 # --- グローバル変数 ---
-# ロードされたDataFrameを保存するためのグローバル辞書
-loaded_dataframes = {}
+# ロードされたDataFrameを保持するLRUキャッシュ
+loaded_dataframes = DataFrameCache(DATAFRAME_CACHE_BUDGET_BYTES)
+# フィルタ式の評価結果 (行のマスク) のキャッシュ
+filter_masks = FilterMaskCache(FILTER_MASK_CACHE_BUDGET_BYTES)
+# ルートディレクトリ以下のファイルシステムの索引 (バックグラウンドで作成する)
+file_system_index = FileSystemIndex()
+# ルートディレクトリの変更を監視するスレッド (DirectoryWatcher、ファイル処理ページで開始する)
+directory_watcher = None
+# ファイルに含まれる列名のカタログ (バックグラウンドで更新し、ファイルに保存する)
+column_catalog = ColumnCatalog(COLUMN_CATALOG_PATH)
+# 行ラベルの検索用の構造 (RowLabelIndex) のキャッシュ。(df_key, version) -> {'ref': weakref, 'label_index': RowLabelIndex}
+row_label_indexes = OrderedDict()
+row_label_indexes_lock = threading.Lock()
+ROW_LABEL_INDEX_CACHE_SIZE = 16
+# ファイル読み込みなどのバックグラウンド処理を実行するスレッドプール
+background_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hallal-loader")
+# ファイルツリーで展開されたディレクトリを読むスレッドプール (同時にSCAN_CONCURRENCY個まで)
+directory_scan_executor = ThreadPoolExecutor(max_workers=SCAN_CONCURRENCY, thread_name_prefix="hallal-tree-scan")
+# バックグラウンドで再読み込み中のdf_keyの集合 (二重の再読み込みを防ぐ)
+pending_reloads = set()
+# ツリーで選択されたファイルの読み込みタスク (別のファイルが選択されたらキャンセルする)
+current_load_task = None
+# 複数ファイルの組み込みで使うプロセスプール (最初に必要になった時点で作成する)
+embed_process_pool = None
 # 現在表示されているDataFrameのファイルパスとシート名を追跡するための変数
 current_dataframe_path = None
 current_dataframe_sheet = None
+# 現在の表示が先頭行だけのプレビューかどうか (Falseなら全データがロード済み)
+current_dataframe_is_preview = False
+# 直近の「表示」でのメモリの増加量 (MemoryDeltaMeter)。キャッシュ状態のラベルに表示する
+last_display_memory = None
+# プレビュー (先頭PREVIEW_ROWS行) のキャッシュ。df_key -> {'df': DataFrame, 'signature': tuple}
+# ワーカースレッド (プレビューの読み込み、メモリの集計、監視) からも使うので、preview_dataframes_lockを取って操作する
+preview_dataframes = OrderedDict()
+preview_dataframes_lock = threading.Lock()
+PREVIEW_ROWS = 20
+PREVIEW_CACHE_SIZE = 64
+# 開いたままにしておくExcelブックのハンドル。絶対パス -> {'book': pd.ExcelFile, 'signature': tuple, 'lock': Lock}
+excel_workbooks = OrderedDict()
+excel_workbooks_lock = threading.Lock()
+EXCEL_WORKBOOK_CACHE_SIZE = 8
+# Excelの読み込みエンジン。python-calamineがあれば高速なcalamineを使う (なければpandasの既定)
+EXCEL_ENGINE = 'calamine' if python_calamine is not None else None
 
 # ユーザーが作成した変数を保存するためのグローバル辞書
-# 例: {'var_name': {'value': pandas.Series/ndarray, 'source_file': 'filename', 'source_column': 'col_name', 'source_sheet': 'sheet_name'}}
+# 例: {'var_name': {'value': pandas.Series/ndarray/StoredVariable, 'source_file': 'filename', 'source_column': 'col_name', 'source_sheet': 'sheet_name',
+#                   'source_key': 'df_key', 'source_version': (mtime_ns, size, inode), 'stale': False}}
+# ファイルから組み込んだ変数の値はLazyVariable、演算結果の配列はStoredVariableで、値の取得にはget_variable_valueを使う
 global_variables = {}
+# メモリ上に常駐させる変数の値の合計の上限 (超えたら最後に使われたのが古いものから.npyに退避する)
+VARIABLE_MEMORY_BUDGET_BYTES = 1024 ** 3
+# システムの空きメモリがこれを下回ったら、上限に達していなくても変数を退避する (psutilがある場合)
+VARIABLE_MIN_AVAILABLE_BYTES = 512 * 1024 ** 2
+# 変数の値の退避先 (セッションの一時ディレクトリ) とメモリの閾値
+variable_store = VariableStore(VARIABLE_MEMORY_BUDGET_BYTES, VARIABLE_MIN_AVAILABLE_BYTES)
+# ワークスペース (変数、ルートディレクトリ、プロット) のディレクトリ内のマニフェストと、値のファイルを置くサブディレクトリ
+WORKSPACE_MANIFEST_NAME = "hallal_workspace.json"
+WORKSPACE_DATA_DIRECTORY = "variables"
+WORKSPACE_FORMAT_VERSION = 1
 
 # Treeviewのルートとなるディレクトリのパスを保持するグローバルリスト
 global_root_directories = []
@@ -138,7 +1343,7 @@ def generate_variable_name(column_name, file_path, sheet_name=None, depth=3):
     filename_without_ext = os.path.splitext(os.path.basename(file_path))[0]
     parts.append(filename_without_ext)
 
-    # 3. シート名 (Excelの場合のみ)
+    # 3. シート名 (Excel) またはHDF5のキー
     if sheet_name:
         parts.append(sheet_name)
 
@@ -165,24 +1370,1172 @@ def generate_variable_name(column_name, file_path, sheet_name=None, depth=3):
 
 # --- データ処理ヘルパー関数 ---
 def get_supported_files_in_directory(directory):
-    """指定されたディレクトリ内のサポートされているファイルをリストアップする。"""
+    """
+    指定されたディレクトリ内のサポートされているファイルをリストアップする。
+    os.scandirの種類の情報を使い、エントリごとのstatの往復を省く。
+    """
     files = []
     try:
-        for item in os.listdir(directory):
-            path = os.path.join(directory, item)
-            if os.path.isfile(path):
-                if item.lower().endswith(('.csv', '.h5', '.hdf', '.xlsx', '.xls')):
-                    files.append(path)
+        with os.scandir(directory) as scanned:
+            for entry in scanned:
+                if entry.name.lower().endswith(('.csv', '.h5', '.hdf', '.xlsx', '.xls')) and entry.is_file():
+                    files.append(entry.path)
     except PermissionError:
         messagebox.showwarning("アクセス拒否", f"ディレクトリ '{directory}' へのアクセスが拒否されました。")
     except Exception as e:
         messagebox.showerror("エラー", f"ディレクトリ '{directory}' の読み込み中にエラーが発生しました: {e}")
     return files
 
-def prompt_for_excel_sheet(parent_window, file_path):
-    """Excelファイルの場合、シート名を選択するダイアログを表示する。"""
+# loaded_dataframes/preview_dataframesのキー -> 元のファイルパス。キーを作るときに記録する
+# (ディレクトリ名に "run.h5_old" のような部分があると、キーの文字列からはパスを正しく取り出せないため)
+dataframe_key_paths = {}
+
+def get_dataframe_key(file_path, sheet_name=None):
+    """ファイルパスとシート名から、loaded_dataframesのキーを生成する。"""
+    df_key = file_path
+    if sheet_name:
+        df_key += f"_{sheet_name}"
+    dataframe_key_paths[df_key] = file_path
+    return df_key
+
+def get_file_path_from_key(df_key):
+    """loaded_dataframesのキーの元のファイルパスを返す。記録がなければNoneを返す。"""
+    return dataframe_key_paths.get(df_key)
+
+class LoadCancelled(Exception):
+    """バックグラウンドでのファイル読み込みがキャンセルされたことを示す例外。"""
+    pass
+
+class LoadTask:
+    """
+    バックグラウンドで実行されるファイル読み込みの状態 (進捗とキャンセル) を保持する。
+    進捗はワーカースレッドが書き込み、Tkスレッドがafter()のポーリングで読み取る。
+    """
+    def __init__(self, file_path, sheet_name=None):
+        self.file_path = file_path
+        self.sheet_name = sheet_name
+        self.bytes_read = 0
+        self.total_bytes = 0
+        self.rows_read = 0
+        self._cancel_event = threading.Event()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def is_cancelled(self):
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self):
+        """キャンセルされていればLoadCancelledを送出する。"""
+        if self._cancel_event.is_set():
+            raise LoadCancelled(self.file_path)
+
+    def progress_text(self):
+        """現在の進捗を表示用の文字列で返す。"""
+        if self.total_bytes:
+            percent = 100 * self.bytes_read / self.total_bytes
+            return f"{format_bytes(self.bytes_read)} / {format_bytes(self.total_bytes)} ({percent:.0f}%)"
+        if self.rows_read:
+            return f"{self.rows_read:,}行"
+        return ""
+
+class ProgressFileReader:
+    """
+    読み込んだバイト数をLoadTaskに記録するファイルラッパー。
+    read()のたびにキャンセルを確認するため、pd.read_csvの解析途中でも中断できる。
+    """
+    def __init__(self, file_obj, task):
+        self._file_obj = file_obj
+        self._task = task
+
+    def read(self, size=-1):
+        self._task.check_cancelled()
+        data = self._file_obj.read(size)
+        self._task.bytes_read += len(data)
+        return data
+
+    def __iter__(self):
+        return iter(self._file_obj)
+
+# HDF5 (table形式) をチャンクで読み込む際の1チャンクあたりの行数
+HDF_CHUNK_ROWS = 500_000
+
+def read_dataframe_file(file_path, sheet_name=None, task=None, columns=None):
+    """
+    ファイルの拡張子に応じてDataFrameを読み込む。
+    ディスクキャッシュが有効な場合、CSV/Excelはキャッシュ済みのFeatherファイルを
+    メモリマップで読み込み、なければ解析結果をキャッシュに書き出す。
+    taskを指定すると、進捗の記録とキャンセルの確認を行う。
+    columnsを指定すると、その列だけを読み込む (列の絞り込み)。
+    """
+    if not is_disk_cache_target(file_path):
+        return parse_dataframe_file(file_path, sheet_name, task, columns)
+
+    signature = get_file_signature(file_path)
+    df = read_disk_cache(file_path, sheet_name, signature, columns)
+    if df is None:
+        df = parse_dataframe_file(file_path, sheet_name, task, columns)
+        if columns is None: # 一部の列だけの結果はキャッシュしない
+            write_disk_cache(file_path, sheet_name, signature, df)
+    return df
+
+def parse_dataframe_file(file_path, sheet_name=None, task=None, columns=None):
+    """
+    ファイルの拡張子に応じて、pandasでファイルを解析してDataFrameを読み込む。
+    columnsを指定すると、usecols/columns=で該当する列だけを解析する。
+    """
+    if file_path.lower().endswith('.csv'):
+        if task is None:
+            return compact_loaded_dataframe(pd.read_csv(file_path, usecols=columns))
+        task.total_bytes = os.path.getsize(file_path)
+        with open(file_path, 'rb') as f:
+            df = pd.read_csv(ProgressFileReader(f, task), usecols=columns)
+        return compact_loaded_dataframe(df)
+    elif file_path.lower().endswith(('.h5', '.hdf')):
+        return parse_hdf_file_in_chunks(file_path, sheet_name, task, columns)
+    elif file_path.lower().endswith(('.xlsx', '.xls')):
+        if not sheet_name:
+            raise ValueError("Excelファイルにはシート名の指定が必要です。")
+        if task is not None:
+            task.check_cancelled()
+        return compact_loaded_dataframe(read_excel_sheet(file_path, sheet_name, usecols=columns))
+    raise ValueError(f"サポートされていないファイル形式です: {os.path.basename(file_path)}")
+
+# --- 型の最適化 (dtypeの縮小) ---
+# 日付の形をした文字列 (YYYY-MM-DD / YYYY/MM/DD と、任意の時刻)
+DATE_LIKE_PATTERN = re.compile(r"^\s*\d{4}[-/]\d{1,2}[-/]\d{1,2}(?:[ T]\d{1,2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?\s*$")
+# 日付の列かどうかを判定するために調べる先頭の値の数
+DATE_DETECTION_SAMPLE_SIZE = 100
+# 64ビットの整数の列は、値がint32に収まる場合だけint32にする (int8/int16までは縮めない)。
+# フィルタ式や演算ページの計算はint32のまま行われるため、計算結果がint32の範囲 (約±21億) を超えると
+# 黙って桁あふれする。変数に組み込む列はwiden_integer_valuesでint64に戻す。
+# float64は、float_toleranceが0なら値が変わらない列だけをfloat32にし、0より大きければ
+# 相対誤差がその値以内で変わることを許す (フィルタ式の境界付近の比較結果が変わりうる)。
+COMPACTION_INT_DTYPE = np.int32
+
+def float_column_fits(column, tolerance):
+    """float64の列がfloat32で値が変わらない (または相対誤差がtolerance以内に収まる) かを返す。"""
+    values = column.to_numpy()
+    with np.errstate(over='ignore', invalid='ignore'):
+        restored = values.astype(np.float32).astype(np.float64)
+        finite = np.isfinite(values)
+        if not np.array_equal(np.isfinite(restored), finite): # float32の範囲を超える値がある
+            return False
+        if tolerance > 0:
+            return bool(np.all(np.abs(restored[finite] - values[finite]) <= tolerance * np.abs(values[finite])))
+        return np.array_equal(restored, values, equal_nan=True)
+
+def get_compaction_kinds(column, settings):
+    """
+    列を縮小する型の候補を優先順に返す。('int',) はint32、('float',) はfloat32、
+    ('datetime', 書式) はdatetime64、('category',) はcategoryを表す。
+    文字列の列は、先頭の値が日付の形をしていればdatetime64を、次にcategoryを候補にする
+    (文字列以外の値が混ざった列は縮小しない)。
+    """
+    dtype = column.dtype
+    if isinstance(dtype, pd.CategoricalDtype) or pd.api.types.is_bool_dtype(dtype):
+        return []
+    if isinstance(dtype, np.dtype) and dtype.kind in "iu":
+        return [('int',)] if dtype.itemsize > np.dtype(COMPACTION_INT_DTYPE).itemsize else []
+    if dtype == np.float64:
+        return [('float',)]
+    if not (pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype)):
+        return []
+    sample = column.dropna().iloc[:DATE_DETECTION_SAMPLE_SIZE]
+    if not len(sample) or not all(isinstance(value, str) for value in sample):
+        return []
+    kinds = []
+    if settings.get('parse_dates') and all(DATE_LIKE_PATTERN.match(value) for value in sample):
+        # 書式を先頭の値で決めて明示するので、チャンクごとに読み込んでも同じ値は同じ日時になる
+        date_format = guess_datetime_format(sample.iloc[0].strip())
+        if date_format:
+            kinds.append(('datetime', date_format))
+    kinds.append(('category',))
+    return kinds
+
+def narrow_column(column, kind, settings):
+    """
+    列をkindの型に縮小して返す。値がその型に収まらない (categoryは種類が多すぎる) 場合と、
+    列の型がkindの元の型と異なる場合 (チャンクごとに推定された型が違う場合) はNoneを返す。
+    """
+    dtype = column.dtype
+    if kind[0] == 'int' and not (isinstance(dtype, np.dtype) and dtype.kind in "iu") \
+            or kind[0] == 'float' and dtype != np.float64 \
+            or kind[0] in ('datetime', 'category') and not (pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype)):
+        return None
+    if kind[0] == 'int':
+        limits = np.iinfo(COMPACTION_INT_DTYPE)
+        if len(column) and (column.min() < limits.min or column.max() > limits.max):
+            return None
+        return column.astype(COMPACTION_INT_DTYPE)
+    if kind[0] == 'float':
+        if not float_column_fits(column, settings.get('float_tolerance', 0.0)):
+            return None
+        return column.astype(np.float32)
+    if kind[0] == 'datetime':
+        parsed = pd.to_datetime(column, format=kind[1], errors='coerce')
+        if parsed.notna().sum() != column.notna().sum(): # 解釈できない値が1つでもあれば文字列のまま
+            return None
+        return parsed
+    if column.nunique() > settings.get('category_max_ratio', 0) * len(column):
+        return None
+    return column.astype('category')
+
+def apply_compaction(df, settings, plan=None):
+    """
+    データフレームの列を縮小する。planを省略すると列ごとに候補の型を順に試し、
+    指定すると ({列の位置: kind}) その型だけを試す (categoryは値が変わらないので判定せずに変換する)。
+    縮小したデータフレーム、縮小した列の計画 ({列の位置: kind})、planの型に収まらなかった列の位置を返す。
+    """
+    compacted = df.copy(deep=False)
+    applied, failed = {}, set()
+    for i in range(df.shape[1]):
+        column = df.iloc[:, i]
+        kinds = get_compaction_kinds(column, settings) if plan is None else [plan[i]] if i in plan else []
+        for kind in kinds:
+            if plan is not None and kind == ('category',) and get_compaction_kinds(column, settings):
+                new_column = column.astype('category')
+            else:
+                new_column = narrow_column(column, kind, settings)
+            if new_column is not None:
+                compacted.isetitem(i, new_column)
+                applied[i] = kind
+                break
+        else:
+            if plan is not None and kinds:
+                failed.add(i)
+    return compacted, applied, failed
+
+def compact_dataframe(df, settings):
+    """
+    データフレームの列の型を小さくする。64ビットの整数は値が収まればint32に、float64は
+    float_column_fitsの条件でfloat32に、文字列はget_compaction_kindsの条件でdatetime64/categoryにする。
+    結果のattrs['compaction']に最適化の前後のメモリ量と、int32に縮小した列 (widen_integer_valuesで戻す列) を記録する。
+    """
+    compacted, applied, _ = apply_compaction(df, settings)
+    set_compaction_attrs(compacted, get_dataframe_nbytes(df), applied)
+    return compacted
+
+def set_compaction_attrs(df, before_bytes, applied):
+    """型の最適化の記録 (前後のメモリ量、int32に縮小した列名) をdf.attrs['compaction']に設定する。"""
+    df.attrs['compaction'] = {'before_bytes': before_bytes, 'after_bytes': get_dataframe_nbytes(df),
+                              'narrowed_ints': [df.columns[i] for i, kind in sorted(applied.items()) if kind == ('int',)]}
+
+def widen_integer_values(value):
+    """
+    型の最適化でint32に縮小された列 (attrs['compaction']['narrowed_ints']に記録) を、変数にする際にint64に戻す
+    (演算ページの計算が、最適化しない場合と同じ結果になるように)。元からint32の列 (HDF5など) はそのままにする。
+    """
+    compaction = getattr(value, 'attrs', {}).get('compaction') or {}
+    if getattr(value, 'dtype', None) == COMPACTION_INT_DTYPE and getattr(value, 'name', None) in compaction.get('narrowed_ints', ()):
+        return value.astype(np.int64)
+    return value
+
+def compact_loaded_dataframe(df):
+    """型の最適化が有効なら、読み込んだデータフレームに適用する (CSV/Excelの読み込みから呼ぶ)。"""
+    if not dtype_compaction_settings:
+        return df
+    return compact_dataframe(df, dtype_compaction_settings)
+
+def format_compaction_note(df):
+    """型の最適化で減ったメモリ量の表示用の文字列を返す (最適化していなければ空文字列)。"""
+    compaction = df.attrs.get('compaction') if df is not None else None
+    if not compaction:
+        return ""
+    return (f" 型の最適化: {format_bytes(compaction['before_bytes'])} → {format_bytes(compaction['after_bytes'])}")
+
+# --- Excelブックのハンドル ---
+def open_excel_workbook(file_path):
+    """Excelブックを開く。calamineエンジンが使えなければpandasの既定のエンジンで開く。"""
+    if EXCEL_ENGINE is not None:
+        try:
+            return pd.ExcelFile(file_path, engine=EXCEL_ENGINE)
+        except ValueError:
+            pass # calamineに対応していないpandasでは既定のエンジンを使う
+    return pd.ExcelFile(file_path)
+
+def get_excel_workbook(file_path):
+    """
+    開いたままのExcelブックのエントリを返す。ファイルが更新されていれば開き直す。
+    シート一覧の取得と各シートの解析で、同じファイルを何度も開かないようにする。
+    """
+    path = os.path.abspath(file_path)
+    signature = get_file_signature(path)
+    with excel_workbooks_lock:
+        entry = excel_workbooks.get(path)
+        if entry is not None and entry['signature'] == signature:
+            excel_workbooks.move_to_end(path)
+            return entry
+    entry = {'book': open_excel_workbook(path), 'signature': signature, 'lock': threading.Lock()}
+    entry['sheet_names'] = list(entry['book'].sheet_names)
+    closed = []
+    with excel_workbooks_lock:
+        old_entry = excel_workbooks.pop(path, None)
+        if old_entry is not None:
+            closed.append(old_entry)
+        excel_workbooks[path] = entry
+        while len(excel_workbooks) > EXCEL_WORKBOOK_CACHE_SIZE:
+            closed.append(excel_workbooks.popitem(last=False)[1])
+    for old_entry in closed:
+        with old_entry['lock']:
+            old_entry['book'].close()
+    return entry
+
+def get_excel_sheet_names(file_path):
+    """Excelブックのシート名の一覧を返す (開いたハンドルのものを使う)。"""
+    return get_excel_workbook(file_path)['sheet_names']
+
+def read_excel_sheet(file_path, sheet_name, **kwargs):
+    """開いたままのExcelブックからシートを解析する。kwargsはExcelFile.parseに渡す (nrows, usecolsなど)。"""
+    entry = get_excel_workbook(file_path)
+    with entry['lock']: # 同じブックを複数のスレッドから同時に解析しない
+        return entry['book'].parse(sheet_name, **kwargs)
+
+def read_excel_sheets(file_path, sheet_names, task=None):
+    """
+    同じExcelブックの複数のシートを、1つのハンドルから続けて読み込む。
+    ディスクキャッシュにあるシートはそちらから読み込む。シート名 -> DataFrameの辞書を返す。
+    """
+    signature = get_file_signature(file_path)
+    dataframes = {}
+    for sheet_name in sheet_names:
+        if task is not None:
+            task.check_cancelled()
+        df = read_disk_cache(file_path, sheet_name, signature) if is_disk_cache_target(file_path) else None
+        if df is None:
+            df = compact_loaded_dataframe(read_excel_sheet(file_path, sheet_name))
+            if is_disk_cache_target(file_path):
+                write_disk_cache(file_path, sheet_name, signature, df)
+        dataframes[sheet_name] = df
+    return dataframes
+
+# --- 列の絞り込み (projection) ---
+def get_file_columns(file_path, sheet_name=None):
+    """ファイルのヘッダーだけを読み込んで列名を返す。プレビューがあればそれを使う。"""
+    preview_df = get_cached_preview(file_path, sheet_name)
+    if preview_df is not None:
+        return preview_df.columns
+    return read_dataframe_preview(file_path, sheet_name, nrows=0).columns
+
+def extract_filter_columns(filter_expr, all_columns):
+    """
+    フィルタ式が参照している列を返す。バッククォートで囲まれた列名と、
+    識別子のうち実在する列名に一致するものを集める。
+    """
+    if not filter_expr:
+        return []
+    names = set(re.findall(r"`([^`]+)`", filter_expr))
+    names.update(re.findall(r"[A-Za-z_][A-Za-z0-9_]*", re.sub(r"`[^`]*`", " ", filter_expr)))
+    return [col for col in all_columns if str(col) in names]
+
+def resolve_column_projection(file_path, sheet_name, col_selection, filter_expr):
+    """
+    列の指定 (ラベル文字列、ラベルのリスト、または位置のslice) とフィルタ式から、読み込む必要のある列を求める。
+    返り値は {'load_columns': 読み込む列, 'display_columns': 選択された列} の辞書。
+    全列が必要な場合や判断できない場合はNoneを返す (全列を読み込む)。
+    """
+    if col_selection is None or (isinstance(col_selection, slice)
+                                 and col_selection.start is None and col_selection.stop is None):
+        return None
+    try:
+        all_columns = get_file_columns(file_path, sheet_name)
+    except Exception:
+        return None
+    # Excelの数値の列名はusecolsで位置と解釈されるため、文字列の列名だけを対象にする
+    if not all(isinstance(col, str) for col in all_columns) or all_columns.has_duplicates:
+        return None
+    if isinstance(col_selection, str):
+        if col_selection not in all_columns:
+            return None # ラベルが見つからないことは表示処理側で報告する
+        display_columns = [col_selection]
+    elif isinstance(col_selection, list):
+        if not all(col in all_columns for col in col_selection):
+            return None
+        display_columns = list(col_selection)
+    else:
+        display_columns = list(all_columns[col_selection])
+    needed = set(display_columns) | set(extract_filter_columns(filter_expr, all_columns))
+    load_columns = [col for col in all_columns if col in needed]
+    if not load_columns or len(load_columns) == len(all_columns):
+        return None
+    return {'load_columns': load_columns, 'display_columns': display_columns}
+
+def get_projected_dataframe_key(df_key, columns):
+    """一部の列だけを読み込んだDataFrameをloaded_dataframesに格納する際のキーを生成する。"""
+    projected_key = f"{df_key}|cols:" + "\x1f".join(map(str, columns))
+    dataframe_key_paths[projected_key] = dataframe_key_paths.get(df_key)
+    return projected_key
+
+# ストリーミングフィルタで1チャンクあたりに読み込む行数
+STREAMING_CHUNK_ROWS = 200_000
+
+def get_filtered_dataframe_key(df_key, filter_expr):
+    """ストリーミングフィルタの結果をloaded_dataframesに格納する際のキーを生成する。"""
+    filtered_key = f"{df_key}|query:{filter_expr}"
+    dataframe_key_paths[filtered_key] = dataframe_key_paths.get(df_key)
+    return filtered_key
+
+def read_filtered_dataframe(file_path, sheet_name, filter_expr, task=None, chunk_rows=STREAMING_CHUNK_ROWS, columns=None):
+    """
+    ファイルをチャンクごとに読み込みながらフィルタ式を適用し、一致した行だけを返す。
+    メモリ使用量はチャンクサイズと結果の大きさで抑えられるため、メモリに載らない
+    大きなファイルでも選択性の高いフィルタなら処理できる。
+    CSVはread_csv(chunksize=...)、HDF5はHDFStore.select(where=...) (失敗時はチャンク読み込み)、
+    Excelはチャンク読み込みができないため全体を読み込んでからフィルタする。
+    columnsを指定すると、その列だけを読み込む (フィルタが参照する列を含める必要がある)。
+    """
+    if file_path.lower().endswith('.csv'):
+        return read_filtered_csv_file(file_path, filter_expr, task, chunk_rows, columns)
+    elif file_path.lower().endswith(('.h5', '.hdf')):
+        return read_filtered_hdf_file(file_path, sheet_name, filter_expr, task, chunk_rows, columns)
+    df = parse_dataframe_file(file_path, sheet_name, task, columns)
+    return df.query(filter_expr)
+
+def read_filtered_csv_file(file_path, filter_expr, task=None, chunk_rows=STREAMING_CHUNK_ROWS, columns=None):
+    """
+    CSVファイルをチャンクごとに読み込んでフィルタ式を適用する (read_filtered_dataframeから呼ぶ)。
+    型の最適化が有効なら、全体を読み込む場合と同じ型でフィルタ式を評価するよう、各チャンクをフィルタの前に縮小する。
+    縮小する型は最初のチャンクで決め、後のチャンクの値が収まらなければその列を縮小の対象から外して読み直す
+    (全体で収まる列は、どのチャンクでも収まるので、最後は全体を読み込む場合と同じ型になる)。
+    """
+    settings = dtype_compaction_settings
+    plan = None
+    while True:
+        if task is not None:
+            task.total_bytes = os.path.getsize(file_path)
+            task.rows_read = 0
+        matched, before_bytes, failed = [], 0, set()
+        with open(file_path, 'rb') as f:
+            source = ProgressFileReader(f, task) if task is not None else f
+            for chunk in pd.read_csv(source, chunksize=chunk_rows, usecols=columns):
+                if settings:
+                    compacted, applied, failed = apply_compaction(chunk, settings, plan)
+                    if failed:
+                        break
+                    if plan is None:
+                        plan = applied
+                    result = compacted.query(filter_expr)
+                    before_bytes += get_dataframe_nbytes(chunk.loc[result.index])
+                else:
+                    result = chunk.query(filter_expr)
+                matched.append(result)
+                if task is not None:
+                    task.rows_read += len(chunk)
+        if not failed:
+            break
+        plan = {i: kind for i, kind in plan.items() if i not in failed}
+    if not matched:
+        return pd.read_csv(file_path, nrows=0, usecols=columns)
+    df = pd.concat(matched)
+    if settings:
+        # チャンクごとのcategoryは値の種類が異なり結合するとobjectに戻るので、結合した結果で揃える
+        df, _, _ = apply_compaction(df, settings, {i: kind for i, kind in plan.items() if kind == ('category',)})
+        set_compaction_attrs(df, before_bytes, plan)
+    return df
+
+def get_hdf_key(store, key=None):
+    """
+    HDF5ストア内の読み込むキーを返す。HDF5のキーはシート名と同じ位置 (sheet_name) で受け渡す。
+    キーが省略された場合は、データセットが1つだけのときにそのキーを使う。
+    """
+    keys = store.keys()
+    if key:
+        if not key.startswith('/'):
+            key = '/' + key
+        if key not in keys:
+            raise KeyError(f"HDF5ファイルにキー '{key}' が見つかりません。")
+        return key
+    if len(keys) != 1:
+        raise ValueError("複数のデータセットを含むHDF5ファイルです。ファイルツリーでファイルを展開してキーを選択してください。")
+    return keys[0]
+
+def select_hdf_frame(store, key, columns=None, **kwargs):
+    """
+    HDF5ストアからキーのデータをDataFrameとして読み込む。start/stop/whereはkwargsで渡す。
+    table形式はcolumns=で列を絞って読み込み、fixed形式は読み込み後に列を選択する。
+    """
+    storer = store.get_storer(key)
+    if storer.is_table:
+        df = store.select(key, columns=columns, **kwargs)
+    else:
+        df = store.select(key, **kwargs)
+    if isinstance(df, pd.Series):
+        df = df.to_frame()
+    if columns is not None and not storer.is_table:
+        df = df[columns]
+    return df
+
+def get_hdf_nrows(storer):
+    """HDF5のノードのメタデータから行数を返す (データは読み込まない)。"""
+    if storer.is_table:
+        return storer.nrows
+    shape = storer.shape
+    return int(shape[0]) if shape is not None else 0
+
+def list_hdf_datasets(file_path):
+    """
+    HDF5ファイル内のデータセットの一覧を返す。キーとノードのメタデータ (形式、行数、列数) だけを読み、
+    データ本体は読み込まない。
+    """
+    datasets = []
+    with pd.HDFStore(file_path, mode='r') as store:
+        for key in store.keys():
+            info = {'key': key, 'format': None, 'nrows': None, 'ncols': None}
+            try:
+                storer = store.get_storer(key)
+                info['format'] = 'table' if storer.is_table else 'fixed'
+                info['nrows'] = get_hdf_nrows(storer)
+                if storer.is_table:
+                    info['ncols'] = sum(len(axis[1]) for axis in storer.non_index_axes)
+                elif storer.shape is not None and len(storer.shape) > 1:
+                    info['ncols'] = int(storer.shape[1])
+                else:
+                    info['ncols'] = 1
+            except Exception:
+                pass # メタデータを読めないノードもキーだけは表示する
+            datasets.append(info)
+    return datasets
+
+def read_file_headers(file_path):
+    """
+    ファイルの列名だけを読み、[[シート名/キー (CSVはNone), [列名]], ...] を返す。
+    CSVはヘッダー行、HDF5は各ノードのメタデータ、Excelは各シートの先頭行だけを読む。
+    """
+    if file_path.lower().endswith('.csv'):
+        return [[None, [str(c) for c in pd.read_csv(file_path, nrows=0).columns]]]
+    if file_path.lower().endswith(('.h5', '.hdf')):
+        datasets = []
+        with pd.HDFStore(file_path, mode='r') as store:
+            for key in store.keys():
+                storer = store.get_storer(key)
+                if storer.is_table:
+                    columns = [c for axis in storer.non_index_axes for c in axis[1]]
+                elif type(storer).__name__ == 'SeriesFixed':
+                    columns = [storer.name if storer.name is not None else 0]
+                else:
+                    columns = list(storer.read_index('axis0'))
+                datasets.append([key, [str(c) for c in columns]])
+        return datasets
+    if file_path.lower().endswith(('.xlsx', '.xls')):
+        return [[sheet_name, [str(c) for c in read_excel_sheet(file_path, sheet_name, nrows=0).columns]]
+                for sheet_name in get_excel_sheet_names(file_path)]
+    raise ValueError(f"サポートされていないファイル形式です: {os.path.basename(file_path)}")
+
+def format_hdf_dataset_label(info):
+    """ファイルツリーに表示するHDF5データセットのラベルを作る。"""
+    details = []
+    if info['format']:
+        details.append(info['format'])
+    if info['nrows'] is not None:
+        details.append(f"{info['nrows']:,}行")
+    if info['ncols'] is not None:
+        details.append(f"{info['ncols']}列")
+    return f"{info['key']}  [{', '.join(details)}]" if details else info['key']
+
+def read_filtered_hdf_file(file_path, key, filter_expr, task=None, chunk_rows=STREAMING_CHUNK_ROWS, columns=None):
+    """
+    HDF5ファイルにフィルタ式を適用して読み込む。table形式ではまずwhere条件として
+    HDF5側で絞り込み、式がwhere構文として解釈できなければチャンクごとにqueryを適用する。
+    """
+    with pd.HDFStore(file_path, mode='r') as store:
+        key = get_hdf_key(store, key)
+        storer = store.get_storer(key)
+        if storer.is_table:
+            try:
+                return select_hdf_frame(store, key, columns, where=filter_expr)
+            except Exception:
+                pass # where構文で解釈できない式は、チャンクごとのqueryで処理する
+        nrows = get_hdf_nrows(storer)
+        matched = []
+        for start in range(0, nrows, chunk_rows):
+            if task is not None:
+                task.check_cancelled()
+            chunk = select_hdf_frame(store, key, columns, start=start, stop=start + chunk_rows)
+            matched.append(chunk.query(filter_expr))
+            if task is not None:
+                task.rows_read += len(chunk)
+        if not matched:
+            return select_hdf_frame(store, key, columns, start=0, stop=0)
+        return pd.concat(matched)
+
+def parse_hdf_file_in_chunks(file_path, key=None, task=None, columns=None):
+    """
+    HDF5ファイルのキーを読み込む。table形式であればチャンクごとに読み込んで行数を記録し、
+    チャンクの間でキャンセルを確認する。columnsを指定するとその列だけを読み込む
+    (fixed形式は列を指定して読めないため、読み込み後に列を選択する)。
+    """
+    with pd.HDFStore(file_path, mode='r') as store:
+        key = get_hdf_key(store, key)
+        storer = store.get_storer(key)
+        if task is None or not storer.is_table:
+            if task is not None:
+                task.check_cancelled()
+            return select_hdf_frame(store, key, columns)
+        chunks = []
+        for start in range(0, storer.nrows, HDF_CHUNK_ROWS):
+            task.check_cancelled()
+            chunk = select_hdf_frame(store, key, columns, start=start, stop=start + HDF_CHUNK_ROWS)
+            chunks.append(chunk)
+            task.rows_read += len(chunk)
+        if not chunks:
+            return select_hdf_frame(store, key, columns, start=0, stop=0)
+        return pd.concat(chunks)
+
+def read_dataframe_preview(file_path, sheet_name=None, nrows=PREVIEW_ROWS):
+    """ファイル全体を解析せず、先頭のnrows行だけを読み込む。"""
+    if file_path.lower().endswith('.csv'):
+        return pd.read_csv(file_path, nrows=nrows)
+    elif file_path.lower().endswith(('.h5', '.hdf')):
+        with pd.HDFStore(file_path, mode='r') as store:
+            return select_hdf_frame(store, get_hdf_key(store, sheet_name), start=0, stop=nrows)
+    elif file_path.lower().endswith(('.xlsx', '.xls')):
+        if not sheet_name:
+            raise ValueError("Excelファイルにはシート名の指定が必要です。")
+        return read_excel_sheet(file_path, sheet_name, nrows=nrows)
+    raise ValueError(f"サポートされていないファイル形式です: {os.path.basename(file_path)}")
+
+def get_cached_preview(file_path, sheet_name=None):
+    """キャッシュにあるプレビューを返す。ないか、ファイルが更新されていればNoneを返す。"""
+    df_key = get_dataframe_key(file_path, sheet_name)
+    signature = get_file_signature(file_path)
+    with preview_dataframes_lock:
+        entry = preview_dataframes.get(df_key)
+        if entry is None or entry['signature'] != signature:
+            return None
+        preview_dataframes.move_to_end(df_key)
+        return entry['df']
+
+def get_or_load_preview(file_path, sheet_name=None):
+    """
+    プレビューをキャッシュから取得するか、先頭行だけを読み込む。
+    ファイルの行数がプレビュー行数に満たない場合、それが全データなので
+    全データとしてloaded_dataframesにも格納する。ワーカースレッドから呼んでもよい。
+    """
+    cached_df = get_cached_preview(file_path, sheet_name)
+    if cached_df is not None:
+        return cached_df
+    df_key = get_dataframe_key(file_path, sheet_name)
+    signature = get_file_signature(file_path)
+    preview_df = read_dataframe_preview(file_path, sheet_name)
+    is_full = len(preview_df) < PREVIEW_ROWS
+    if is_full and file_path.lower().endswith(('.csv', '.xlsx', '.xls')):
+        # 全データなので、全体の読み込み (parse_dataframe_file) と同じく型を最適化し、ディスクキャッシュに書き出す
+        preview_df = compact_loaded_dataframe(preview_df)
+        if is_disk_cache_target(file_path):
+            write_disk_cache(file_path, sheet_name, signature, preview_df)
+    with preview_dataframes_lock:
+        preview_dataframes[df_key] = {'df': preview_df, 'signature': signature}
+        while len(preview_dataframes) > PREVIEW_CACHE_SIZE:
+            preview_dataframes.popitem(last=False)
+    if is_full:
+        store_loaded_dataframe(df_key, preview_df, signature)
+    return preview_df
+
+def get_file_signature(file_path):
+    """
+    os.statでファイルのシグネチャ (mtime_ns, size, inode) を取得する。
+    ファイルが存在しない場合などはNoneを返す。
+    """
     try:
-        excel_sheets = pd.ExcelFile(file_path).sheet_names
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def get_dataframe_version(file_path, sheet_name=None):
+    """キャッシュのバージョンキー (path, sheet, mtime_ns, size, inode) を返す。"""
+    signature = get_file_signature(file_path)
+    if signature is None:
+        return None
+    return (file_path, sheet_name) + signature
+
+# --- ディスクキャッシュ ---
+# キャッシュファイルのスキーマのメタデータに、型の最適化の記録 (attrs['compaction']) を保存するキー
+DISK_CACHE_COMPACTION_METADATA_KEY = b"hallal_compaction"
+
+def is_disk_cache_target(file_path):
+    """ディスクキャッシュが有効で、かつキャッシュ対象 (CSV/Excel) のファイルかどうか。"""
+    return (disk_cache_directory is not None and pa_feather is not None
+            and file_path.lower().endswith(('.csv', '.xlsx', '.xls')))
+
+def get_disk_cache_path(file_path, sheet_name, signature):
+    """パス、シート名、mtime、サイズ (と型の最適化の設定) から、キャッシュファイルのパスを生成する。"""
+    mtime_ns, size = signature[0], signature[1]
+    key = f"{os.path.abspath(file_path)}|{sheet_name or ''}|{mtime_ns}|{size}"
+    if dtype_compaction_settings:
+        key += f"|compact:{json.dumps(dtype_compaction_settings, sort_keys=True)}" # 最適化の有無・設定ごとに別のファイル
+    digest = hashlib.sha1(key.encode("utf-8", errors="surrogatepass")).hexdigest()
+    return os.path.join(disk_cache_directory, f"{digest}.feather")
+
+def read_disk_cache(file_path, sheet_name, signature, columns=None):
+    """
+    キャッシュファイルがあればメモリマップで読み込む。なければNoneを返す。
+    columnsを指定すると、その列だけを読み込む。
+    """
+    if signature is None:
+        return None
+    cache_path = get_disk_cache_path(file_path, sheet_name, signature)
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        table = pa_feather.read_table(cache_path, columns=columns, memory_map=True)
+        df = table.to_pandas()
+        compaction = (table.schema.metadata or {}).get(DISK_CACHE_COMPACTION_METADATA_KEY)
+        if compaction is not None:
+            df.attrs['compaction'] = json.loads(compaction)
+        os.utime(cache_path) # 最終使用時刻として更新 (追い出し順序に使う)
+        return df
+    except Exception as e:
+        print(f"Error reading disk cache {cache_path}: {e}")
+        return None
+
+def write_disk_cache(file_path, sheet_name, signature, df):
+    """解析したDataFrameをFeather形式でキャッシュディレクトリに書き出す。"""
+    if signature is None:
+        return
+    # Featherは文字列以外の列名を往復できないため、その場合はキャッシュしない
+    if not all(isinstance(col, str) for col in df.columns):
+        return
+    cache_path = get_disk_cache_path(file_path, sheet_name, signature)
+    temp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(disk_cache_directory, exist_ok=True)
+        # メモリマップで読めるよう無圧縮で書き出し、一時ファイルから置き換える
+        table = pa.Table.from_pandas(df)
+        if df.attrs.get('compaction'): # int32に縮小した列の記録をキャッシュと一緒に残す (widen_integer_valuesが使う)
+            metadata = dict(table.schema.metadata or {})
+            metadata[DISK_CACHE_COMPACTION_METADATA_KEY] = json.dumps(df.attrs['compaction'])
+            table = table.replace_schema_metadata(metadata)
+        pa_feather.write_feather(table, temp_path, compression='uncompressed')
+        os.replace(temp_path, cache_path)
+    except Exception as e:
+        print(f"Error writing disk cache {cache_path}: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return
+    evict_disk_cache()
+
+def list_disk_cache_files():
+    """キャッシュファイルの (パス, サイズ, 最終使用時刻) のリストを返す。"""
+    entries = []
+    if disk_cache_directory is None or not os.path.isdir(disk_cache_directory):
+        return entries
+    with os.scandir(disk_cache_directory) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith('.feather'):
+                st = entry.stat()
+                entries.append((entry.path, st.st_size, st.st_mtime))
+    return entries
+
+def evict_disk_cache():
+    """キャッシュの合計サイズが上限を超えた場合、最も古く使われたファイルから削除する。"""
+    entries = sorted(list_disk_cache_files(), key=lambda entry: entry[2])
+    total_bytes = sum(entry[1] for entry in entries)
+    for path, size, _ in entries:
+        if total_bytes <= disk_cache_max_bytes:
+            break
+        try:
+            os.remove(path)
+            total_bytes -= size
+        except OSError as e:
+            print(f"Error removing disk cache {path}: {e}")
+
+def clear_disk_cache():
+    """キャッシュファイルをすべて削除し、削除したファイル数と解放したバイト数を返す。"""
+    removed_count = 0
+    removed_bytes = 0
+    for path, size, _ in list_disk_cache_files():
+        try:
+            os.remove(path)
+            removed_count += 1
+            removed_bytes += size
+        except OSError as e:
+            print(f"Error removing disk cache {path}: {e}")
+    return removed_count, removed_bytes
+
+def store_loaded_dataframe(df_key, df, signature):
+    """
+    読み込んだDataFrameをキャッシュに格納する。
+    古いバージョンから組み込まれた変数には 'stale' の印を付ける。
+    """
+    loaded_dataframes.put(df_key, df, signature=signature)
+    for var_info in global_variables.values():
+        if var_info.get('source_key') == df_key and var_info.get('source_version') != signature:
+            var_info['stale'] = True
+
+def get_watched_files():
+    """変更を監視する読み込み済みのファイル (表示中のファイル、キャッシュと変数の元ファイル) のパスを返す。"""
+    paths = set()
+    if current_dataframe_path is not None:
+        paths.add(current_dataframe_path)
+    with preview_dataframes_lock:
+        keys = list(loaded_dataframes.keys()) + list(preview_dataframes.keys())
+    keys += [var_info.get('source_key') or "" for var_info in list(global_variables.values())]
+    for df_key in keys:
+        file_path = get_file_path_from_key(df_key)
+        if file_path is not None:
+            paths.add(file_path)
+    return paths
+
+def invalidate_file_caches(file_path):
+    """
+    ファイルの変更・削除を受けて、そのファイルのキャッシュ (DataFrame、プレビュー、
+    開いたままのExcelブック) を破棄し、そのファイルから組み込まれた変数に 'stale' の印を付ける。
+    新たに印を付けた変数があればTrueを返す。
+    """
+    for df_key in list(loaded_dataframes.keys()):
+        if get_file_path_from_key(df_key) == file_path:
+            loaded_dataframes.pop(df_key)
+    with preview_dataframes_lock:
+        for df_key in list(preview_dataframes.keys()):
+            if get_file_path_from_key(df_key) == file_path:
+                preview_dataframes.pop(df_key, None)
+    with excel_workbooks_lock:
+        entry = excel_workbooks.pop(os.path.abspath(file_path), None)
+    if entry is not None:
+        with entry['lock']:
+            entry['book'].close() # ファイルのハンドルを放す
+    signature = get_file_signature(file_path)
+    marked = False
+    for var_info in global_variables.values():
+        source_key = var_info.get('source_key')
+        if (source_key and get_file_path_from_key(source_key) == file_path and not var_info.get('stale')
+                and var_info.get('source_version') != signature):
+            var_info['stale'] = True
+            marked = True
+    return marked
+
+def get_or_load_dataframe(file_path, sheet_name=None):
+    """
+    キャッシュにあればそれを返し、なければファイルを読み込んでキャッシュに追加する。
+    キャッシュ後にファイルが更新されていた場合は読み込み直す。
+    """
+    df_key = get_dataframe_key(file_path, sheet_name)
+    signature = get_file_signature(file_path)
+    df = loaded_dataframes.get(df_key, signature=signature)
+    if df is None:
+        df = read_dataframe_file(file_path, sheet_name)
+        store_loaded_dataframe(df_key, df, signature)
+    return df
+
+def poll_future(widget, future, on_done, interval_ms=100, on_poll=None):
+    """
+    Futureの完了をafter()でポーリングし、完了したらTkスレッド上でon_done(future)を呼び出す。
+    on_pollを指定すると、未完了の間はポーリングのたびに呼び出す (進捗表示用)。
+    ウィジェットが破棄された場合はポーリングを止める。
+    """
+    def check():
+        try:
+            if not widget.winfo_exists():
+                return
+        except tk.TclError:
+            return
+        if future.done():
+            on_done(future)
+        else:
+            if on_poll:
+                on_poll()
+            widget.after(interval_ms, check)
+    widget.after(interval_ms, check)
+
+def start_background_load(widget, file_path, sheet_name=None, on_loaded=None, on_error=None, on_progress=None,
+                          filter_expr=None, columns=None):
+    """
+    ファイルをワーカースレッドで読み込み、キャッシュに格納する。
+    filter_exprを指定すると、チャンクごとにフィルタを適用した結果だけを読み込む (ストリーミングフィルタ)。
+    columnsを指定すると、その列だけを読み込む (列の絞り込み)。
+    on_loaded(df)、on_error(e)、on_progress(task) はいずれもTkスレッドで呼び出される。
+    キャンセルされた読み込みの結果は破棄され、コールバックも呼ばれない。
+    返り値のLoadTaskでキャンセルできる。
+    """
+    df_key = get_dataframe_key(file_path, sheet_name)
+    task = LoadTask(file_path, sheet_name)
+    signature = get_file_signature(file_path)
+    if columns is not None:
+        df_key = get_projected_dataframe_key(df_key, columns)
+    if filter_expr:
+        df_key = get_filtered_dataframe_key(df_key, filter_expr)
+        future = background_executor.submit(read_filtered_dataframe, file_path, sheet_name, filter_expr, task,
+                                            columns=columns)
+    else:
+        future = background_executor.submit(read_dataframe_file, file_path, sheet_name, task, columns)
+
+    def on_done(done_future):
+        if task.is_cancelled():
+            return
+        try:
+            df = done_future.result()
+        except LoadCancelled:
+            return
+        except Exception as e:
+            if on_error:
+                on_error(e)
+            else:
+                print(f"Error loading {file_path}: {e}")
+            return
+        store_loaded_dataframe(df_key, df, signature)
+        if on_loaded:
+            on_loaded(df)
+
+    poll_future(widget, future, on_done, on_poll=(lambda: on_progress(task)) if on_progress else None)
+    return task
+
+def get_dataframe_display_name(file_path, sheet_name=None):
+    """ラベル表示用のファイル名 (シート名またはHDF5のキー付き) を返す。"""
+    display_name = os.path.basename(file_path)
+    if sheet_name and file_path.lower().endswith(('.h5', '.hdf')):
+        display_name += f" (キー: {sheet_name})"
+    elif sheet_name:
+        display_name += f" (シート: {sheet_name})"
+    return display_name
+
+def request_full_dataframe(widget, file_path, sheet_name, on_ready, current_file_label_widget=None, columns=None):
+    """
+    全データが必要な操作 (範囲外の表示、フィルタ、組み込みなど) のためにデータフレーム全体を用意し、
+    Tkスレッドでon_ready(df)を呼び出す。キャッシュになければワーカースレッドで読み込み、
+    読み込み中は進捗をラベルに表示する。別のファイルが選択されると読み込みはキャンセルされる。
+    columnsを指定すると、全列のデータがキャッシュになければその列だけを読み込む。
+    """
+    global current_load_task
+    df_key = get_dataframe_key(file_path, sheet_name)
+    signature = get_file_signature(file_path)
+    df = loaded_dataframes.get(df_key, signature=signature)
+    if df is not None:
+        mark_current_dataframe_full(file_path, sheet_name, df, current_file_label_widget)
+        on_ready(df)
+        return
+    if columns is not None:
+        df = loaded_dataframes.get(get_projected_dataframe_key(df_key, columns), signature=signature)
+        if df is not None:
+            on_ready(df)
+            return
+
+    if current_load_task is not None:
+        current_load_task.cancel()
+    display_name = get_dataframe_display_name(file_path, sheet_name)
+    target_text = "全データ" if columns is None else f"{len(columns)}列"
+    if current_file_label_widget:
+        current_file_label_widget.config(text=f"{target_text}を読み込み中…: {display_name}")
+
+    def on_progress(task):
+        if current_file_label_widget:
+            current_file_label_widget.config(text=f"{target_text}を読み込み中…: {display_name}  {task.progress_text()}")
+
+    def on_loaded(df):
+        global current_load_task
+        current_load_task = None
+        if columns is None:
+            mark_current_dataframe_full(file_path, sheet_name, df, current_file_label_widget)
+        elif current_file_label_widget:
+            current_file_label_widget.config(text=f"現在のファイル: {display_name} [列の絞り込み: {len(columns)}列, {len(df):,}行]"
+                                                 f"{format_compaction_note(df)}")
+        on_ready(df)
+
+    def on_error(e):
+        global current_load_task
+        current_load_task = None
+        if current_file_label_widget:
+            current_file_label_widget.config(text=f"現在のファイル: {display_name} (全データの読み込みに失敗)")
+        messagebox.showerror("エラー", f"ファイルの読み込み中にエラーが発生しました: {e}")
+
+    current_load_task = start_background_load(widget, file_path, sheet_name, on_loaded, on_error, on_progress,
+                                              columns=columns)
+
+def request_filtered_dataframe(widget, file_path, sheet_name, filter_expr, on_ready, current_file_label_widget=None,
+                               columns=None):
+    """
+    ストリーミングフィルタの結果を用意し、Tkスレッドでon_ready(filtered_df)を呼び出す。
+    結果はloaded_dataframesにキャッシュされ、同じファイルと式 (と列) なら再利用される。
+    """
+    global current_load_task
+    base_key = get_dataframe_key(file_path, sheet_name)
+    if columns is not None:
+        base_key = get_projected_dataframe_key(base_key, columns)
+    filtered_key = get_filtered_dataframe_key(base_key, filter_expr)
+    filtered_df = loaded_dataframes.get(filtered_key, signature=get_file_signature(file_path))
+    if filtered_df is not None:
+        on_ready(filtered_df)
+        return
+
+    if current_load_task is not None:
+        current_load_task.cancel()
+    display_name = get_dataframe_display_name(file_path, sheet_name)
+    if current_file_label_widget:
+        current_file_label_widget.config(text=f"ストリーミングフィルタ中…: {display_name}")
+
+    def on_progress(task):
+        if current_file_label_widget:
+            current_file_label_widget.config(text=f"ストリーミングフィルタ中…: {display_name}  {task.progress_text()}")
+
+    def on_loaded(df):
+        global current_load_task
+        current_load_task = None
+        if current_file_label_widget:
+            current_file_label_widget.config(text=f"現在のファイル: {display_name} [フィルタ結果: {len(df):,}行]")
+        on_ready(df)
+
+    def on_error(e):
+        global current_load_task
+        current_load_task = None
+        if current_file_label_widget:
+            current_file_label_widget.config(text=f"現在のファイル: {display_name}")
+        messagebox.showerror("フィルタエラー", f"フィルタ式の適用中にエラーが発生しました: {e}\n式を確認してください。")
+
+    current_load_task = start_background_load(widget, file_path, sheet_name, on_loaded, on_error, on_progress,
+                                              filter_expr=filter_expr, columns=columns)
+
+def mark_current_dataframe_full(file_path, sheet_name, df, current_file_label_widget=None):
+    """表示中のファイルの全データがロードされたことを記録し、ラベルを更新する。"""
+    global current_dataframe_is_preview
+    if current_dataframe_path != file_path or current_dataframe_sheet != sheet_name:
+        return
+    current_dataframe_is_preview = False
+    if current_file_label_widget:
+        current_file_label_widget.config(
+            text=f"現在のファイル: {get_dataframe_display_name(file_path, sheet_name)} [全データ: {len(df):,}行]"
+                 f"{format_compaction_note(df)}")
+
+def reload_dataframe_in_background(widget, file_path, sheet_name=None, on_reloaded=None):
+    """
+    更新されたファイルをバックグラウンドで読み込み直し、完了後にキャッシュを差し替える。
+    on_reloaded(df) はTkスレッドで呼び出される。
+    """
+    df_key = get_dataframe_key(file_path, sheet_name)
+    if df_key in pending_reloads:
+        return
+    pending_reloads.add(df_key)
+
+    def on_loaded(df):
+        pending_reloads.discard(df_key)
+        if on_reloaded:
+            on_reloaded(df)
+
+    def on_error(e):
+        pending_reloads.discard(df_key)
+        print(f"Error reloading {file_path}: {e}")
+
+    start_background_load(widget, file_path, sheet_name, on_loaded, on_error)
+
+def update_cache_status_label(cache_status_label_widget):
+    """キャッシュのヒット/ミス/追い出し数と使用量、プロセスのメモリをラベルに表示する。"""
+    if cache_status_label_widget is None:
+        return
+    stats = loaded_dataframes.stats()
+    text = (f"キャッシュ: {stats['entries']}件 "
+            f"{format_bytes(stats['total_bytes'])} / {format_bytes(stats['budget_bytes'])}  "
+            f"ヒット {stats['hits']} / ミス {stats['misses']} / 追い出し {stats['evictions']}")
+    compactions = [df.attrs['compaction'] for _, df, _, _ in loaded_dataframes.snapshot() if df.attrs.get('compaction')]
+    if compactions:
+        saved_bytes = sum(c['before_bytes'] - c['after_bytes'] for c in compactions)
+        text += f"  型の最適化: {len(compactions)}件で {format_bytes(saved_bytes)} 削減"
+    rss = get_process_rss_bytes()
+    if rss is not None:
+        text += f"\nメモリ (RSS): {format_bytes(rss)}"
+        if last_display_memory is not None:
+            text += f"  直近の表示: {last_display_memory.summary()}"
+    cache_status_label_widget.config(text=text)
+
+def ask_cache_budget(parent_window):
+    """キャッシュのメモリ予算 (GB) をユーザーに入力してもらい、反映する。変更したらTrueを返す。"""
+    current_gb = loaded_dataframes.budget_bytes / 1024 ** 3
+    new_gb = simpledialog.askfloat("キャッシュ設定", "キャッシュのメモリ予算 (GB) を入力してください。",
+                                   initialvalue=round(current_gb, 2), minvalue=0.01, parent=parent_window)
+    if not new_gb:
+        return False
+    loaded_dataframes.set_budget(int(new_gb * 1024 ** 3))
+    return True
+
+def ask_variable_memory_settings(parent_window):
+    """
+    変数の値をメモリに常駐させる上限と、ディスクに退避し始める空きメモリの閾値 (GB) を
+    ユーザーに入力してもらい、反映する。変更したらTrueを返す。
+    """
+    budget_gb = simpledialog.askfloat("変数のメモリ設定", "変数をメモリに常駐させる上限 (GB) を入力してください。\n"
+                                      "超えた分は一時ディレクトリの.npyファイルに退避します。",
+                                      initialvalue=round(variable_store.memory_budget_bytes / 1024 ** 3, 2),
+                                      minvalue=0.0, parent=parent_window)
+    if budget_gb is None:
+        return False
+    variable_store.memory_budget_bytes = int(budget_gb * 1024 ** 3)
+    if psutil is not None:
+        min_available_gb = simpledialog.askfloat("変数のメモリ設定", "システムの空きメモリがこの値 (GB) を下回ったら、変数を退避します。",
+                                                 initialvalue=round(variable_store.min_available_bytes / 1024 ** 3, 2),
+                                                 minvalue=0.0, parent=parent_window)
+        if min_available_gb is not None:
+            variable_store.min_available_bytes = int(min_available_gb * 1024 ** 3)
+    enforce_variable_memory_budget()
+    return True
+
+# --- メモリ使用量の計測 ---
+def get_process_rss_bytes():
+    """現在のプロセスの常駐メモリ (RSS) をバイトで返す。取得できない環境ではNoneを返す。"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def get_process_peak_rss_bytes():
+    """現在のプロセスのRSSのピーク (Linux の VmHWM) をバイトで返す。取得できない環境ではNoneを返す。"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def reset_process_peak_rss():
+    """RSSのピークを現在の値に戻す (Linuxのみ)。成功すればTrueを返す。"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+class MemoryDeltaMeter:
+    """
+    start()からstop()までのRSSの増加量と、ピークRSSの増加量を測る。
+    ピークはLinuxでのみ測れる (他の環境では開始時と終了時の差だけ)。
+    """
+    def __init__(self):
+        self.rss_before = None
+        self.rss_after = None
+        self.peak_delta = None
+
+    def start(self):
+        self.peak_reset = reset_process_peak_rss()
+        self.rss_before = get_process_rss_bytes()
+        return self
+
+    def stop(self):
+        self.rss_after = get_process_rss_bytes()
+        peak = get_process_peak_rss_bytes() if self.peak_reset else None
+        if peak is not None and self.rss_before is not None:
+            self.peak_delta = max(0, peak - self.rss_before)
+        return self
+
+    def summary(self):
+        """増加量を表す文字列 (例: "+12.0 MB (ピーク +40.0 MB)")。"""
+        if self.rss_before is None or self.rss_after is None:
+            return "計測できません"
+        delta = self.rss_after - self.rss_before
+        text = f"{'+' if delta >= 0 else '-'}{format_bytes(abs(delta))}"
+        if self.peak_delta is not None:
+            text += f" (ピーク +{format_bytes(self.peak_delta)})"
+        return text
+
+def prompt_for_excel_sheet(parent_window, file_path, multiple=False):
+    """
+    Excelファイルの場合、シート名を選択するダイアログを表示する。
+    multipleがTrueの場合は複数のシートを選択でき、シート名のリストを返す。
+    """
+    try:
+        excel_sheets = get_excel_sheet_names(file_path)
     except Exception as e:
         messagebox.showerror("エラー", f"Excelシートの読み込み中にエラーが発生しました: {e}")
         return None
@@ -200,7 +2553,8 @@ def prompt_for_excel_sheet(parent_window, file_path):
 
     ttk.Label(sheet_dialog, text="シートを選択してください:", style='SubHeader.TLabel', background="#F0F2F5").pack(pady=10)
 
-    sheet_listbox = tk.Listbox(sheet_dialog, bg="#FFFFFF", fg="#333333", selectbackground="#3498DB", selectforeground="#FFFFFF", font=("Courier", 10), height=5, relief="flat", bd=1)
+    sheet_listbox = tk.Listbox(sheet_dialog, bg="#FFFFFF", fg="#333333", selectbackground="#3498DB", selectforeground="#FFFFFF", font=("Courier", 10), height=5, relief="flat", bd=1,
+                               selectmode=tk.EXTENDED if multiple else tk.BROWSE)
     for sheet in excel_sheets:
         sheet_listbox.insert(tk.END, sheet)
     sheet_listbox.pack(padx=10, pady=5, fill="both", expand=True)
@@ -209,11 +2563,24 @@ def prompt_for_excel_sheet(parent_window, file_path):
     def on_sheet_select_dialog():
         nonlocal selected_sheet
         if sheet_listbox.curselection():
-            selected_sheet = sheet_listbox.get(sheet_listbox.curselection())
+            if multiple:
+                selected_sheet = [sheet_listbox.get(index) for index in sheet_listbox.curselection()]
+            else:
+                selected_sheet = sheet_listbox.get(sheet_listbox.curselection())
             sheet_dialog.destroy()
         else:
             messagebox.showwarning("警告", "シートを選択してください。")
 
+    if multiple:
+        sheet_dialog.geometry("300x240")
+        ttk.Button(
+            sheet_dialog,
+            text="すべてのシート",
+            command=lambda: [sheet_listbox.select_set(0, tk.END), on_sheet_select_dialog()],
+            style='Gray.TButton',
+            cursor="hand2"
+        ).pack(pady=(5, 0))
+
     select_button = ttk.Button(
         sheet_dialog,
         text="選択",
@@ -226,100 +2593,653 @@ def prompt_for_excel_sheet(parent_window, file_path):
     parent_window.wait_window(sheet_dialog)
     return selected_sheet
 
-def load_and_display_dataframe(file_path, sheet_name=None, dataframe_text_widget=None, current_file_label_widget=None, 
+def load_and_display_dataframe(file_path, sheet_name=None, dataframe_view_widget=None, current_file_label_widget=None, 
                                start_row_entry=None, end_row_entry=None, start_col_entry=None, end_col_entry=None,
-                               row_label_entry=None, col_label_entry=None, filter_expression_entry=None):
+                               row_label_entry=None, col_label_entry=None, filter_expression_entry=None,
+                               variable_listbox_widget=None):
     """
     指定されたファイルをデータフレームとしてロードし、右パネルに表示する。
+    全データがキャッシュにない場合は先頭の行だけを読み込んでプレビューとして即座に表示し、
+    全データは必要になった時点 (request_full_dataframe) でバックグラウンドで読み込む。
+    読み込み中に別のファイルが選択された場合、前の読み込みはキャンセルされる。
+    キャッシュ済みのファイルが更新されていた場合は、古いデータを表示したまま
+    バックグラウンドで読み込み直し、完了後に表示を更新する。
     """
-    global current_dataframe_path, current_dataframe_sheet, loaded_dataframes
-    df_key = file_path
-    if sheet_name:
-        df_key += f"_{sheet_name}"
+    global current_dataframe_path, current_dataframe_sheet, current_load_task
+    if file_path.lower().endswith(('.xlsx', '.xls')) and not sheet_name:
+        messagebox.showerror("エラー", "Excelファイルにはシート名の指定が必要です。")
+        return
 
-    if df_key in loaded_dataframes:
-        df = loaded_dataframes[df_key]
-    else:
+    # 前のファイルの読み込みが完了していなければキャンセルする
+    if current_load_task is not None:
+        current_load_task.cancel()
+        current_load_task = None
+
+    current_file_display_name = get_dataframe_display_name(file_path, sheet_name)
+
+    def show_load_error(e):
+        messagebox.showerror("エラー", f"ファイルの読み込み中にエラーが発生しました: {e}")
+        if dataframe_view_widget:
+            dataframe_view_widget.show_message(f"エラー: ファイルをロードできませんでした。\n{e}")
+        if current_file_label_widget:
+            current_file_label_widget.config(text="エラー: ファイルロード")
+
+    def show_loaded_dataframe(df, is_preview, is_stale=False):
+        global current_dataframe_path, current_dataframe_sheet, current_dataframe_is_preview
+        current_dataframe_path = file_path
+        current_dataframe_sheet = sheet_name
+        current_dataframe_is_preview = is_preview
+
+        if current_file_label_widget:
+            if is_preview:
+                status = f" [プレビュー: 先頭{len(df)}行]"
+            else:
+                status = f" [全データ: {len(df):,}行]"
+            if is_stale:
+                status += " (更新を検出: 再読み込み中…)"
+            current_file_label_widget.config(text=f"現在のファイル: {current_file_display_name}{status}")
+
+        if is_stale and dataframe_view_widget:
+            def on_reloaded(new_df):
+                # 再読み込みの間に別のファイルが選択されていなければ表示を更新する
+                if current_dataframe_path == file_path and current_dataframe_sheet == sheet_name:
+                    mark_current_dataframe_full(file_path, sheet_name, new_df, current_file_label_widget)
+                    dataframe_view_widget.show_dataframe(new_df)
+                if variable_listbox_widget:
+                    update_variable_list(variable_listbox_widget)
+            reload_dataframe_in_background(dataframe_view_widget, file_path, sheet_name, on_reloaded)
+
+        # エントリーをクリアし、デフォルトで全範囲を表示
+        if start_row_entry: start_row_entry.delete(0, tk.END)
+        if end_row_entry: end_row_entry.delete(0, tk.END)
+        if start_col_entry: start_col_entry.delete(0, tk.END)
+        if end_col_entry: end_col_entry.delete(0, tk.END)
+        if row_label_entry: row_label_entry.delete(0, tk.END)
+        if col_label_entry: col_label_entry.delete(0, tk.END)
+        if filter_expression_entry: filter_expression_entry.delete(0, tk.END) # Clear filter expression
+
+        # デフォルトで全行と全列を表示 (描画されるのは見えている範囲だけ)
+        if dataframe_view_widget:
+            dataframe_view_widget.show_dataframe(df)
+
+    df_key = get_dataframe_key(file_path, sheet_name)
+    df = loaded_dataframes.get(df_key)
+    if df is not None:
+        show_loaded_dataframe(df, is_preview=False,
+                              is_stale=loaded_dataframes.get_signature(df_key) != get_file_signature(file_path))
+        return
+
+    # 全データがない場合は、先頭の行だけを表示する。キャッシュになければワーカースレッドで読み込み、
+    # 遅いディスクやネットワーク上のファイルでもTkスレッドを止めない
+    # (ファイルが短くプレビューが全データだった場合は、全データとして扱う)
+    preview_df = get_cached_preview(file_path, sheet_name)
+    if preview_df is not None:
+        show_loaded_dataframe(preview_df, is_preview=df_key not in loaded_dataframes)
+        return
+    poll_widget = dataframe_view_widget or current_file_label_widget
+    if poll_widget is None: # 表示先がない
+        return
+
+    task = current_load_task = LoadTask(file_path, sheet_name) # 別のファイルが選択されたらキャンセルされる
+    if current_file_label_widget:
+        current_file_label_widget.config(text=f"現在のファイル: {current_file_display_name} [プレビューを読み込み中…]")
+    if dataframe_view_widget:
+        dataframe_view_widget.show_message("プレビューを読み込み中…")
+
+    def on_preview_loaded(done_future):
+        global current_load_task
+        if task.is_cancelled():
+            return
+        current_load_task = None
         try:
-            if file_path.lower().endswith('.csv'):
-                df = pd.read_csv(file_path)
-            elif file_path.lower().endswith(('.h5', '.hdf')):
-                df = pd.read_hdf(file_path)
-            elif file_path.lower().endswith(('.xlsx', '.xls')):
-                if not sheet_name:
-                    messagebox.showerror("エラー", "Excelファイルにはシート名の指定が必要です。")
-                    return
-                df = pd.read_excel(file_path, sheet_name=sheet_name)
-            loaded_dataframes[df_key] = df
+            loaded_preview_df = done_future.result()
         except Exception as e:
-            messagebox.showerror("エラー", f"ファイルの読み込み中にエラーが発生しました: {e}")
-            if dataframe_text_widget:
-                dataframe_text_widget.config(state="normal")
-                dataframe_text_widget.delete("1.0", tk.END)
-                dataframe_text_widget.insert(tk.END, f"エラー: ファイルをロードできませんでした。\n{e}")
-                dataframe_text_widget.config(state="disabled")
-            if current_file_label_widget:
-                current_file_label_widget.config(text="エラー: ファイルロード")
+            show_load_error(e)
             return
+        show_loaded_dataframe(loaded_preview_df, is_preview=df_key not in loaded_dataframes)
 
-    current_dataframe_path = file_path
-    current_dataframe_sheet = sheet_name
+    poll_future(poll_widget, background_executor.submit(get_or_load_preview, file_path, sheet_name), on_preview_loaded)
 
-    current_file_display_name = os.path.basename(file_path)
-    if sheet_name:
-        current_file_display_name += f" (シート: {sheet_name})"
-    if current_file_label_widget:
-        current_file_label_widget.config(text=f"現在のファイル: {current_file_display_name}")
-
-    # エントリーをクリアし、デフォルトで全範囲を表示
-    if start_row_entry: start_row_entry.delete(0, tk.END)
-    if end_row_entry: end_row_entry.delete(0, tk.END)
-    if start_col_entry: start_col_entry.delete(0, tk.END)
-    if end_col_entry: end_col_entry.delete(0, tk.END)
-    if row_label_entry: row_label_entry.delete(0, tk.END)
-    if col_label_entry: col_label_entry.delete(0, tk.END)
-    if filter_expression_entry: filter_expression_entry.delete(0, tk.END) # Clear filter expression
-
-    # デフォルトで最初の20行と全列を表示
-    display_df = df.iloc[:20, :]
-    if dataframe_text_widget:
-        dataframe_text_widget.config(state="normal")
-        dataframe_text_widget.delete("1.0", tk.END)
-        dataframe_text_widget.insert(tk.END, display_df.to_string())
-        dataframe_text_widget.config(state="disabled")
-
-def display_dataframe_content(dataframe_text_widget, current_file_label_widget, 
+# --- データフレームの表示 (仮想化テーブル) ---
+def format_table_cell(value):
+    """テーブルのセルに表示する文字列を作る。浮動小数点数は有効数字6桁で表示する。"""
+    if isinstance(value, (float, np.floating)):
+        return f"{value:.6g}"
+    return str(value)
+
+class DataFrameTableView(tk.Frame):
+    """
+    DataFrameを表形式で表示する仮想化テーブル。ビューポートに見えている行と列だけを
+    フォーマットしてCanvasに描画するため、描画のコストはデータフレームの行数によらない。
+    ヘッダー行とインデックス列は固定表示で、列幅は列ごとに内容の先頭の行から決める。
+    スクロールバーとはTextウィジェットと同じく xview/yview と *scrollcommand で接続する。
+    """
+    MIN_COLUMN_WIDTH = 40
+    MAX_COLUMN_WIDTH = 300
+    WIDTH_SAMPLE_ROWS = 50 # 列幅を決めるために測る行数
+    CELL_PADDING = 6
+    SCROLL_UNITS = 3 # マウスホイール1回でスクロールする行数
+
+    def __init__(self, parent, font=("Courier", 10), bg="#F8F8F8", fg="#333333",
+                 header_bg="#E4E7EB", stripe_bg="#EFF1F4", grid_color="#D5D8DC"):
+        super().__init__(parent, bg=bg)
+        self.fg = fg
+        self.header_bg = header_bg
+        self.stripe_bg = stripe_bg
+        self.grid_color = grid_color
+        self.font = tkfont.Font(font=font)
+        self.header_font = tkfont.Font(font=font)
+        self.header_font.configure(weight="bold")
+        self.char_width = max(1, self.font.measure("0"))
+        self.row_height = self.font.metrics("linespace") + 6
+
+        self.header_canvas = tk.Canvas(self, height=self.row_height, bg=header_bg, highlightthickness=0, bd=0)
+        self.header_canvas.grid(row=0, column=0, sticky="ew")
+        self.body_canvas = tk.Canvas(self, bg=bg, highlightthickness=0, bd=0, takefocus=1)
+        self.body_canvas.grid(row=1, column=0, sticky="nsew")
+        self.rowconfigure(1, weight=1)
+        self.columnconfigure(0, weight=1)
+
+        self.df = None
+        self.message = ""
+        self.first_row = 0
+        self.x_offset = 0
+        self.index_width = 0
+        self.column_widths = np.zeros(0, dtype=np.int64)
+        self.column_measured = np.zeros(0, dtype=bool)
+        self.column_offsets = np.zeros(1, dtype=np.int64)
+        self.numeric_columns = np.zeros(0, dtype=bool)
+        self.xscrollcommand = None
+        self.yscrollcommand = None
+
+        self.body_canvas.bind("<Configure>", lambda event: self.redraw())
+        for canvas in (self.header_canvas, self.body_canvas):
+            canvas.bind("<MouseWheel>", self.on_mouse_wheel)
+            canvas.bind("<Shift-MouseWheel>", lambda event: self.on_mouse_wheel(event, horizontal=True))
+            canvas.bind("<Button-4>", lambda event: self.yview("scroll", -self.SCROLL_UNITS, "units"))
+            canvas.bind("<Button-5>", lambda event: self.yview("scroll", self.SCROLL_UNITS, "units"))
+            canvas.bind("<Shift-Button-4>", lambda event: self.xview("scroll", -self.SCROLL_UNITS, "units"))
+            canvas.bind("<Shift-Button-5>", lambda event: self.xview("scroll", self.SCROLL_UNITS, "units"))
+        self.body_canvas.bind("<Button-1>", lambda event: self.body_canvas.focus_set())
+        self.body_canvas.bind("<Up>", lambda event: self.yview("scroll", -1, "units"))
+        self.body_canvas.bind("<Down>", lambda event: self.yview("scroll", 1, "units"))
+        self.body_canvas.bind("<Prior>", lambda event: self.yview("scroll", -1, "pages"))
+        self.body_canvas.bind("<Next>", lambda event: self.yview("scroll", 1, "pages"))
+        self.body_canvas.bind("<Home>", lambda event: self.yview("moveto", 0))
+        self.body_canvas.bind("<End>", lambda event: self.yview("moveto", 1))
+        self.body_canvas.bind("<Left>", lambda event: self.xview("scroll", -1, "units"))
+        self.body_canvas.bind("<Right>", lambda event: self.xview("scroll", 1, "units"))
+
+    def set_scroll_commands(self, xscrollcommand=None, yscrollcommand=None):
+        """スクロールバーのsetメソッドを登録する。"""
+        if xscrollcommand is not None:
+            self.xscrollcommand = xscrollcommand
+        if yscrollcommand is not None:
+            self.yscrollcommand = yscrollcommand
+        self.update_scrollbars()
+
+    def show_dataframe(self, df):
+        """データフレームを表示する。列幅は見積もりから始め、列が初めて見えたときに測り直す。"""
+        self.df = df
+        self.message = ""
+        self.first_row = 0
+        self.x_offset = 0
+        padding = 2 * self.CELL_PADDING
+        self.column_widths = np.array([len(str(col)) * self.char_width + padding for col in df.columns], dtype=np.int64)
+        self.column_widths = np.clip(self.column_widths, self.MIN_COLUMN_WIDTH, self.MAX_COLUMN_WIDTH)
+        self.column_measured = np.zeros(df.shape[1], dtype=bool)
+        self.numeric_columns = np.array([pd.api.types.is_numeric_dtype(dtype) for dtype in df.dtypes], dtype=bool)
+        index_labels = [str(df.index.name or "")] + [str(label) for label in df.index[:self.WIDTH_SAMPLE_ROWS]]
+        self.index_width = min(self.MAX_COLUMN_WIDTH,
+                               max(self.font.measure(label) for label in index_labels) + padding)
+        self.update_column_offsets()
+        self.redraw()
+
+    def show_message(self, text):
+        """データフレームの代わりにメッセージを表示する (エラーや空の結果など)。"""
+        self.df = None
+        self.message = text
+        self.first_row = 0
+        self.x_offset = 0
+        self.redraw()
+
+    def update_column_offsets(self):
+        self.column_offsets = np.concatenate(([0], np.cumsum(self.column_widths)))
+
+    def measure_columns(self, start_col, end_col):
+        """まだ測っていない列の幅を、ヘッダーと先頭の行の文字列の幅から決める。"""
+        changed = False
+        for col in range(start_col, end_col):
+            if self.column_measured[col]:
+                continue
+            sample = self.df.iloc[:self.WIDTH_SAMPLE_ROWS, col].tolist()
+            texts = [str(self.df.columns[col])] + [format_table_cell(value) for value in sample]
+            width = max(len(text) for text in texts) * self.char_width + 2 * self.CELL_PADDING
+            width = min(self.MAX_COLUMN_WIDTH, max(self.MIN_COLUMN_WIDTH, width))
+            if width != self.column_widths[col]:
+                self.column_widths[col] = width
+                changed = True
+            self.column_measured[col] = True
+        if changed:
+            self.update_column_offsets()
+
+    def visible_columns(self, view_width):
+        """x_offsetから幅view_widthの範囲に見えている列の範囲 (start, end) を返す。"""
+        start_col = max(0, int(np.searchsorted(self.column_offsets, self.x_offset, side="right")) - 1)
+        end_col = int(np.searchsorted(self.column_offsets, self.x_offset + view_width, side="left"))
+        return start_col, min(end_col, len(self.column_widths))
+
+    def page_rows(self):
+        return max(1, self.body_canvas.winfo_height() // self.row_height)
+
+    def data_view_width(self):
+        return max(1, self.body_canvas.winfo_width() - self.index_width)
+
+    def truncate_text(self, text, width):
+        """列幅に収まらない文字列を省略する (等幅フォントの文字幅で計算する)。"""
+        max_chars = max(1, (width - 2 * self.CELL_PADDING) // self.char_width)
+        return text if len(text) <= max_chars else text[:max_chars - 1] + "…"
+
+    def redraw(self):
+        """見えている範囲の行と列だけを描画し直す。"""
+        self.header_canvas.delete("all")
+        self.body_canvas.delete("all")
+        if self.df is None:
+            self.body_canvas.create_text(self.CELL_PADDING, self.CELL_PADDING, anchor="nw", text=self.message,
+                                         font=self.font, fill=self.fg)
+            self.update_scrollbars()
+            return
+
+        body_width = self.body_canvas.winfo_width()
+        nrows, ncols = self.df.shape
+        rh = self.row_height
+        self.first_row = max(0, min(self.first_row, nrows - self.page_rows()))
+        start_row = self.first_row
+        end_row = min(nrows, start_row + self.page_rows() + 1)
+
+        view_width = self.data_view_width()
+        start_col, end_col = self.visible_columns(view_width)
+        self.measure_columns(start_col, end_col)
+        self.x_offset = max(0, min(self.x_offset, int(self.column_offsets[-1]) - view_width))
+        start_col, end_col = self.visible_columns(view_width)
+        self.measure_columns(start_col, end_col)
+
+        # 縞模様の背景
+        for i in range(end_row - start_row):
+            if (start_row + i) % 2 == 1:
+                self.body_canvas.create_rectangle(0, i * rh, body_width, (i + 1) * rh, fill=self.stripe_bg, width=0)
+
+        # データのセル
+        block = self.df.iloc[start_row:end_row, start_col:end_col]
+        grid_bottom = (end_row - start_row) * rh
+        for k, col in enumerate(range(start_col, end_col)):
+            x = self.index_width + int(self.column_offsets[col]) - self.x_offset
+            width = int(self.column_widths[col])
+            numeric = self.numeric_columns[col]
+            text_x = x + width - self.CELL_PADDING if numeric else x + self.CELL_PADDING
+            anchor = "e" if numeric else "w"
+            self.header_canvas.create_text(text_x, rh / 2, anchor=anchor, font=self.header_font, fill=self.fg,
+                                           text=self.truncate_text(str(self.df.columns[col]), width))
+            for i, value in enumerate(block.iloc[:, k].tolist()):
+                self.body_canvas.create_text(text_x, i * rh + rh / 2, anchor=anchor, font=self.font, fill=self.fg,
+                                             text=self.truncate_text(format_table_cell(value), width))
+            self.header_canvas.create_line(x + width, 0, x + width, rh, fill=self.grid_color)
+            self.body_canvas.create_line(x + width, 0, x + width, grid_bottom, fill=self.grid_color)
+
+        # 固定表示のインデックス列 (データのセルの上に重ねて描画する)
+        self.header_canvas.create_rectangle(0, 0, self.index_width, rh, fill=self.header_bg, width=0)
+        self.header_canvas.create_text(self.CELL_PADDING, rh / 2, anchor="w", font=self.header_font, fill=self.fg,
+                                       text=self.truncate_text(str(self.df.index.name or ""), self.index_width))
+        self.body_canvas.create_rectangle(0, 0, self.index_width, grid_bottom, fill=self.header_bg, width=0)
+        for i, label in enumerate(self.df.index[start_row:end_row]):
+            self.body_canvas.create_text(self.CELL_PADDING, i * rh + rh / 2, anchor="w", font=self.font, fill=self.fg,
+                                         text=self.truncate_text(str(label), self.index_width))
+        self.header_canvas.create_line(0, rh - 1, body_width, rh - 1, fill=self.grid_color)
+        self.update_scrollbars()
+
+    def update_scrollbars(self):
+        """スクロールバーの位置を、表示している行と列の範囲に合わせる。"""
+        if self.df is None or len(self.df) == 0:
+            y_range = (0.0, 1.0)
+        else:
+            nrows = len(self.df)
+            y_range = (self.first_row / nrows, min(1.0, (self.first_row + self.page_rows()) / nrows))
+        total_width = int(self.column_offsets[-1]) if self.df is not None else 0
+        if total_width <= 0:
+            x_range = (0.0, 1.0)
+        else:
+            x_range = (self.x_offset / total_width, min(1.0, (self.x_offset + self.data_view_width()) / total_width))
+        if self.yscrollcommand:
+            self.yscrollcommand(*y_range)
+        if self.xscrollcommand:
+            self.xscrollcommand(*x_range)
+
+    def yview(self, *args):
+        """縦スクロール ("moveto", fraction) / ("scroll", n, "units"|"pages")。"""
+        if self.df is None or not args:
+            return
+        if args[0] == "moveto":
+            self.first_row = int(float(args[1]) * len(self.df))
+        elif args[0] == "scroll":
+            step = self.page_rows() if args[2] == "pages" else 1
+            self.first_row += int(args[1]) * step
+        self.redraw()
+
+    def xview(self, *args):
+        """横スクロール ("moveto", fraction) / ("scroll", n, "units"|"pages")。"""
+        if self.df is None or not args:
+            return
+        if args[0] == "moveto":
+            self.x_offset = int(float(args[1]) * int(self.column_offsets[-1]))
+        elif args[0] == "scroll":
+            step = self.data_view_width() if args[2] == "pages" else 4 * self.char_width
+            self.x_offset += int(args[1]) * step
+        self.redraw()
+
+    def on_mouse_wheel(self, event, horizontal=False):
+        direction = -1 if event.delta > 0 else 1
+        if horizontal:
+            self.xview("scroll", direction * self.SCROLL_UNITS, "units")
+        else:
+            self.yview("scroll", direction * self.SCROLL_UNITS, "units")
+
+class InvalidSelectionError(ValueError):
+    """行と列の選択の組み合わせが不正であることを示す例外。"""
+    pass
+
+def compute_filter_mask(df, filter_expr):
+    """
+    フィルタ式を評価して、行ごとの真偽値のマスクを返す (DataFrame.queryと同じ式が使える)。
+    queryと違いフィルタ後のデータフレームを作らないため、全列のコピーが発生しない。
+    """
+    mask = df.eval(filter_expr, engine=FILTER_ENGINE)
+    if not isinstance(mask, pd.Series) or len(mask) != len(df) or not pd.api.types.is_bool_dtype(mask):
+        raise ValueError("フィルタ式は行ごとの真偽値 (True/False) を返す必要があります。")
+    return mask.to_numpy(dtype=bool, na_value=False)
+
+def get_filter_mask(df, filter_expr, df_key=None, version=None):
+    """
+    フィルタ式のマスクをキャッシュから取得するか、評価してキャッシュに格納する。
+    df_keyを省略した場合はキャッシュを使わない。
+    """
+    if df_key is None:
+        return compute_filter_mask(df, filter_expr)
+    cache_key = (df_key, version, filter_expr)
+    mask = filter_masks.get(cache_key, df)
+    if mask is None:
+        mask = compute_filter_mask(df, filter_expr)
+        mask.flags.writeable = False # キャッシュしたマスクが書き換えられないようにする
+        filter_masks.put(cache_key, df, mask)
+    return mask
+
+def get_label_positions(labels, label):
+    """インデックスまたは列のラベルの位置 (重複していれば全ての位置) を返す。"""
+    positions = labels.get_indexer_for([label])
+    if (positions < 0).any():
+        raise KeyError(label)
+    return positions
+
+class RowLabelIndex:
+    """
+    行ラベルの検索用の構造。行ラベルを並べ替えた位置を一度だけ作っておき、
+    完全一致とラベルの範囲 ('開始:終了') を二分探索 O(log n) で答える。
+    並べ替えられないラベル (型の混在など) は、pandasのハッシュ表で完全一致だけを検索する。
+    """
+    def __init__(self, index):
+        self.index = index
+        self.order = None # 並べ替えた順の行の位置 (元々昇順ならNone)
+        self.sorted_index = None
+        if index.is_monotonic_increasing:
+            self.sorted_index = index
+        else:
+            try:
+                self.order = index.argsort(kind='stable')
+                self.sorted_index = index.take(self.order)
+            except TypeError:
+                pass # 並べ替えられないラベル
+
+    def coerce_label(self, text):
+        """入力された文字列を、インデックスの型 (日時、整数、浮動小数点数) のラベルに変換する。"""
+        if pd.api.types.is_datetime64_any_dtype(self.index.dtype):
+            label = pd.Timestamp(text)
+            tz = getattr(self.index, 'tz', None)
+            if tz is not None and label.tz is None:
+                label = label.tz_localize(tz)
+            return label
+        if pd.api.types.is_integer_dtype(self.index.dtype):
+            number = float(text)
+            return int(number) if number.is_integer() else number
+        if pd.api.types.is_float_dtype(self.index.dtype):
+            return float(text)
+        return text
+
+    def positions_for_label(self, label):
+        """ラベルに一致する行の位置を返す。見つからなければKeyError。"""
+        if self.sorted_index is None:
+            return get_label_positions(self.index, label)
+        try:
+            left = self.sorted_index.searchsorted(label, side='left')
+            right = self.sorted_index.searchsorted(label, side='right')
+        except TypeError:
+            raise KeyError(label)
+        if left == right:
+            raise KeyError(label)
+        return self.positions_between(left, right)
+
+    def positions_for_range(self, start, end):
+        """ラベルがstart以上end以下の行の位置を、元の行の順で返す (Noneは端まで)。"""
+        if self.sorted_index is None:
+            raise ValueError("行ラベルを並べ替えられないため、範囲で指定できません。")
+        left = 0 if start is None else self.sorted_index.searchsorted(start, side='left')
+        right = len(self.sorted_index) if end is None else self.sorted_index.searchsorted(end, side='right')
+        return self.positions_between(left, max(left, right))
+
+    def positions_between(self, left, right):
+        if self.order is None:
+            return np.arange(left, right)
+        return np.sort(self.order[left:right])
+
+    def lookup(self, text):
+        """
+        行ラベルの入力を行の位置の配列に変換する。入力全体が1つのラベルとして見つからなければ、
+        'a, b, c' はラベルのリスト、'開始:終了' はラベルの範囲として解釈する
+        (日時のラベルに含まれる ':' を考慮し、両側の長さが近い区切りから順に、
+        両側をラベルとして解釈できる位置で区切る)。
+        """
+        text = text.strip()
+        try:
+            return self.positions_for_label(self.coerce_label(text))
+        except (KeyError, ValueError, TypeError):
+            pass
+        if ',' in text:
+            return np.concatenate([self.lookup(part) for part in text.split(',') if part.strip()])
+        separators = sorted((match.start() for match in re.finditer(':', text)),
+                            key=lambda pos: abs(pos - (len(text) - 1 - pos)))
+        range_error = None
+        for separator in separators:
+            start_text, end_text = text[:separator].strip(), text[separator + 1:].strip()
+            try:
+                start = self.coerce_label(start_text) if start_text else None
+                end = self.coerce_label(end_text) if end_text else None
+                return self.positions_for_range(start, end)
+            except (ValueError, TypeError) as e:
+                range_error = e
+        if range_error is not None and self.sorted_index is None:
+            raise range_error
+        raise KeyError(text)
+
+def get_row_label_index(df, df_key=None, version=None):
+    """
+    データフレームの行ラベルの検索用の構造を、キャッシュから取得するか作成する。
+    キャッシュのエントリは同じDataFrameに対してだけ再利用する。
+    """
+    if df_key is None:
+        return RowLabelIndex(df.index)
+    cache_key = (df_key, version)
+    with row_label_indexes_lock:
+        entry = row_label_indexes.get(cache_key)
+        if entry is not None and entry['ref']() is df:
+            row_label_indexes.move_to_end(cache_key)
+            return entry['label_index']
+    label_index = RowLabelIndex(df.index)
+    with row_label_indexes_lock:
+        row_label_indexes[cache_key] = {'ref': weakref.ref(df), 'label_index': label_index}
+        row_label_indexes.move_to_end(cache_key)
+        while len(row_label_indexes) > ROW_LABEL_INDEX_CACHE_SIZE:
+            row_label_indexes.popitem(last=False)
+    return label_index
+
+def slice_dataframe(df, row_selection, col_selection, mask=None):
+    """
+    行と列の選択をデータフレームに適用する。行は位置のslice、ラベル文字列、または
+    行の位置の配列 (RowLabelIndex.lookupの結果)、列は位置のslice、ラベル文字列、
+    またはラベルのリストで指定する。
+    maskを指定すると、フィルタを通った行の中で行を選択する。
+    行と列の位置を先に決め、sliceはビューのまま、位置の配列は最後に一度だけ取り出すので、
+    コピーされるのは結果に含まれるセルだけになる。
+    """
+    # 行の位置
+    if mask is not None:
+        rows = np.flatnonzero(mask)
+        if isinstance(row_selection, str):
+            rows = rows[np.asarray(df.index[rows] == row_selection)]
+            if len(rows) == 0:
+                raise KeyError(row_selection)
+        elif isinstance(row_selection, slice):
+            rows = rows[row_selection]
+        elif isinstance(row_selection, np.ndarray):
+            rows = row_selection[mask[row_selection]]
+        else:
+            raise InvalidSelectionError("行と列の選択の組み合わせが不正です。")
+    elif isinstance(row_selection, str):
+        rows = get_label_positions(df.index, row_selection)
+    elif isinstance(row_selection, (slice, np.ndarray)):
+        rows = row_selection
+    else:
+        raise InvalidSelectionError("行と列の選択の組み合わせが不正です。")
+
+    # 列の位置
+    if isinstance(col_selection, str):
+        cols = get_label_positions(df.columns, col_selection)
+    elif isinstance(col_selection, list):
+        cols = np.concatenate([get_label_positions(df.columns, col) for col in col_selection]) if col_selection else []
+    elif isinstance(col_selection, slice):
+        cols = col_selection
+    else:
+        raise InvalidSelectionError("行と列の選択の組み合わせが不正です。")
+
+    # sliceの軸を先に適用してビューで絞り込み、位置の配列の軸は最後に取り出す
+    if isinstance(rows, slice):
+        return df.iloc[rows].iloc[:, cols]
+    if isinstance(cols, slice):
+        return df.iloc[:, cols].iloc[rows]
+    if len(rows) * df.shape[1] <= len(cols) * df.shape[0]:
+        return df.iloc[rows].iloc[:, cols]
+    return df.iloc[:, cols].iloc[rows]
+
+def parse_column_selection(col_label_input, start_col_idx_input, end_col_idx_input):
+    """
+    列ラベルまたは列の範囲の入力から列の選択 (ラベル文字列または位置のslice) を作る。
+    数値として解釈できない範囲はNoneを返す (エラーは表示処理側で報告する)。
+    """
+    if col_label_input:
+        return col_label_input
+    try:
+        start_col = int(start_col_idx_input) if start_col_idx_input else None
+        end_col = int(end_col_idx_input) if end_col_idx_input else None
+    except ValueError:
+        return None
+    return slice(start_col, end_col)
+
+def selection_fits_preview(preview_rows, filter_expr, row_label_input, end_row_idx_input):
+    """
+    指定された表示条件がプレビューの行だけで満たせるかどうかを判定する。
+    フィルタ、行ラベル、終了行の省略 (=全行) はいずれも全データを必要とする。
+    """
+    if filter_expr or row_label_input or not end_row_idx_input:
+        return False
+    try:
+        return int(end_row_idx_input) <= preview_rows
+    except ValueError:
+        return True # 入力エラーは表示処理側で報告する
+
+def display_dataframe_content(dataframe_view_widget, current_file_label_widget, 
                               start_row_entry, end_row_entry, start_col_entry, end_col_entry,
-                              row_label_entry, col_label_entry, filter_expression_entry):
+                              row_label_entry, col_label_entry, filter_expression_entry, full_df=None,
+                              streaming_filter_var=None, filtered_df=None, projection=None):
     """
     入力された行/列の範囲またはラベル、およびフィルタ式に基づいてデータフレームを表示する。
+    プレビュー表示中に全データが必要な条件が指定された場合は、全データを読み込んでから表示する。
+    full_dfは、その読み込みが完了した後の呼び出しで渡される全データ。
+    ストリーミングフィルタが有効で全データがメモリにない場合は、ファイルをチャンクごとに
+    フィルタした結果 (filtered_df) だけを読み込んで表示する。
+    全列のデータがメモリにない場合は、列の指定とフィルタ式から必要な列を求め (projection)、
+    その列だけを読み込む。
     """
-    global current_dataframe_path, current_dataframe_sheet, loaded_dataframes
+    global current_dataframe_path, current_dataframe_sheet, loaded_dataframes, last_display_memory
     if current_dataframe_path is None:
         messagebox.showwarning("警告", "表示するファイルが選択されていません。")
         return
 
-    df_key = current_dataframe_path
-    if current_dataframe_sheet:
-        df_key += f"_{current_dataframe_sheet}"
-
-    if df_key not in loaded_dataframes:
-        messagebox.showerror("エラー", "データフレームがロードされていません。")
+    filter_expr = filter_expression_entry.get().strip()
+    df_key = get_dataframe_key(current_dataframe_path, current_dataframe_sheet)
+    redisplay = lambda **kwargs: display_dataframe_content(dataframe_view_widget, current_file_label_widget,
+                                                           start_row_entry, end_row_entry, start_col_entry, end_col_entry,
+                                                           row_label_entry, col_label_entry, filter_expression_entry,
+                                                           streaming_filter_var=streaming_filter_var, **kwargs)
+    df = None
+    filter_applied = False
+    full_data_cached = full_df is None and df_key in loaded_dataframes
+    use_streaming = (filter_expr and streaming_filter_var is not None and streaming_filter_var.get()
+                     and full_df is None and not full_data_cached)
+    if filtered_df is None and full_df is None and not full_data_cached:
+        # 全列のデータがない場合は、表示に必要な列だけを読み込む
+        projection = resolve_column_projection(current_dataframe_path, current_dataframe_sheet,
+                                               parse_column_selection(col_label_entry.get().strip(),
+                                                                      start_col_entry.get().strip(),
+                                                                      end_col_entry.get().strip()),
+                                               filter_expr)
+    load_columns = projection['load_columns'] if projection else None
+    if filtered_df is not None:
+        df = filtered_df
+        filter_applied = True
+    elif use_streaming:
+        # 全データを読み込まず、チャンクごとにフィルタした結果だけを読み込む
+        request_filtered_dataframe(dataframe_view_widget, current_dataframe_path, current_dataframe_sheet, filter_expr,
+                                   lambda loaded_df: redisplay(filtered_df=loaded_df, projection=projection),
+                                   current_file_label_widget, columns=load_columns)
         return
+    elif current_dataframe_is_preview:
+        preview_df = get_cached_preview(current_dataframe_path, current_dataframe_sheet)
+        if preview_df is not None and selection_fits_preview(len(preview_df), filter_expr,
+                                                             row_label_entry.get().strip(), end_row_entry.get().strip()):
+            df = preview_df
+            projection = None # プレビューは全列を持っている
+    if df is None:
+        if full_df is None:
+            full_df = loaded_dataframes.get(df_key, signature=get_file_signature(current_dataframe_path))
+        if full_df is None:
+            # 全データが必要なので、バックグラウンドで読み込んでから改めて表示する
+            request_full_dataframe(dataframe_view_widget, current_dataframe_path, current_dataframe_sheet,
+                                   lambda loaded_df: redisplay(full_df=loaded_df, projection=projection),
+                                   current_file_label_widget, columns=load_columns)
+            return
+        if projection is None:
+            mark_current_dataframe_full(current_dataframe_path, current_dataframe_sheet, full_df, current_file_label_widget)
+        df = full_df # コピーせず、フィルタはマスクとして適用する
 
-    df = loaded_dataframes[df_key].copy() # フィルタリングのためにコピーを作成
+    display_memory = MemoryDeltaMeter().start()
 
-    # フィルタ式の適用
-    filter_expr = filter_expression_entry.get().strip()
+    # フィルタ式の適用 (ストリーミングフィルタの結果は適用済み)
+    mask = None
     if filter_expr:
         try:
-            df = df.query(filter_expr)
-            if df.empty:
+            if not filter_applied:
+                mask_key = df_key if projection is None else get_projected_dataframe_key(df_key, projection['load_columns'])
+                mask = get_filter_mask(df, filter_expr, mask_key, get_file_signature(current_dataframe_path))
+            if (df.empty if mask is None else not mask.any()):
                 messagebox.showinfo("情報", "フィルタリングの結果、データがありません。")
-                dataframe_text_widget.config(state="normal")
-                dataframe_text_widget.delete("1.0", tk.END)
-                dataframe_text_widget.insert(tk.END, "フィルタリングの結果、データがありません。")
-                dataframe_text_widget.config(state="disabled")
+                dataframe_view_widget.show_message("フィルタリングの結果、データがありません。")
                 return
         except Exception as e:
             messagebox.showerror("フィルタエラー", f"フィルタ式の適用中にエラーが発生しました: {e}\n式を確認してください。")
@@ -333,9 +3253,16 @@ def display_dataframe_content(dataframe_text_widget, current_file_label_widget,
         end_row_idx_input = end_row_entry.get().strip()
 
         if row_label_input:
-            if row_label_input in df.index:
-                row_selection = row_label_input
-            else:
+            # 行ラベル (単一、'開始:終了' の範囲、'a, b' のリスト) を行の位置に変換する
+            label_key = df_key if projection is None else get_projected_dataframe_key(df_key, projection['load_columns'])
+            label_index = get_row_label_index(df, label_key, get_file_signature(current_dataframe_path))
+            try:
+                row_selection = label_index.lookup(row_label_input)
+            except KeyError:
+                row_selection = np.array([], dtype=np.int64)
+            if mask is not None:
+                row_selection = row_selection[mask[row_selection]]
+            if len(row_selection) == 0:
                 messagebox.showwarning("警告", f"指定された行ラベル '{row_label_input}' は見つかりませんでした。")
                 return
         elif start_row_idx_input or end_row_idx_input:
@@ -366,6 +3293,10 @@ def display_dataframe_content(dataframe_text_widget, current_file_label_widget,
             end_col = int(end_col_idx_input) if end_col_idx_input else None
             col_selection = slice(start_col, end_col)
 
+        if projection is not None:
+            # 必要な列だけを読み込んだ場合は、列の位置が元のファイルと異なるため選択済みの列のラベルで指定する
+            col_selection = list(projection['display_columns'])
+
     except ValueError as e:
         messagebox.showerror("エラー", f"入力値が無効です: {e}\n行/列は数値インデックスまたはラベルを入力してください。")
         return
@@ -378,18 +3309,10 @@ def display_dataframe_content(dataframe_text_widget, current_file_label_widget,
 
     display_df = None
     try:
-        if isinstance(row_selection, slice) and isinstance(col_selection, slice):
-            display_df = df.iloc[row_selection, col_selection]
-        elif isinstance(row_selection, str) and isinstance(col_selection, slice):
-            display_df = df.loc[[row_selection], col_selection]
-        elif isinstance(row_selection, slice) and isinstance(col_selection, str):
-            display_df = df.loc[row_selection, [col_selection]]
-        elif isinstance(row_selection, str) and isinstance(col_selection, str):
-            display_df = df.loc[[row_selection], [col_selection]]
-        else:
-            messagebox.showerror("エラー", "行と列の選択の組み合わせが不正です。")
-            return
-
+        display_df = slice_dataframe(df, row_selection, col_selection, mask)
+    except InvalidSelectionError as e:
+        messagebox.showerror("エラー", str(e))
+        return
     except IndexError as e:
         messagebox.showerror("エラー", f"指定された行または列の範囲がデータフレームの範囲外です: {e}")
         return
@@ -397,10 +3320,8 @@ def display_dataframe_content(dataframe_text_widget, current_file_label_widget,
         messagebox.showerror("エラー", f"データフレームの表示中に予期せぬエラーが発生しました: {e}")
         return
 
-    dataframe_text_widget.config(state="normal")
-    dataframe_text_widget.delete("1.0", tk.END)
-    dataframe_text_widget.insert(tk.END, display_df.to_string())
-    dataframe_text_widget.config(state="disabled")
+    dataframe_view_widget.show_dataframe(display_df)
+    last_display_memory = display_memory.stop()
 
 def embed_variables_dialog(parent_window, df_to_embed, file_path, sheet_name, variable_listbox_widget):
     """
@@ -481,6 +3402,8 @@ def embed_variables_dialog(parent_window, df_to_embed, file_path, sheet_name, va
     def process_selected_variables():
         #nonlocal global_variables # グローバル変数を更新
         processed_count = 0
+        source_key = get_dataframe_key(file_path, sheet_name)
+        source_version = loaded_dataframes.get_signature(source_key)
         for item_id in var_tree.get_children():
             # item_statesから現在の状態を取得
             if item_states[item_id]['checkbox_var'].get(): # チェックボックスがONの場合
@@ -496,14 +3419,20 @@ def embed_variables_dialog(parent_window, df_to_embed, file_path, sheet_name, va
                         continue
 
                 global_variables[var_name] = {
-                    'value': df_to_embed[original_col],
+                    'value': LazyVariable(file_path, sheet_name, original_col,
+                                          value=df_to_embed[original_col].copy(), # キャッシュのデータフレームとメモリを共有しない
+                                          source_version=source_version),
                     'source_file': os.path.basename(file_path),
                     'source_sheet': sheet_name,
-                    'source_column': original_col
+                    'source_column': original_col,
+                    'source_key': source_key,
+                    'source_version': source_version,
+                    'stale': False
                 }
                 processed_count += 1
         
         if processed_count > 0:
+            enforce_variable_memory_budget()
             messagebox.showinfo("情報", f"{processed_count}個の変数を組み込みました。")
             update_variable_list(variable_listbox_widget) # メイン画面の変数リストを更新
             embed_dialog.destroy()
@@ -530,22 +3459,677 @@ def update_variable_list(variable_listbox_widget):
         if var_info['source_sheet']:
             source_info += f" - {var_info['source_sheet']}"
         source_info += f", Col: {var_info['source_column']})"
+        if var_info.get('stale'):
+            source_info += " [古い]" # 元ファイルが更新されている
         
-        # 変数のshapeを取得
-        shape_info = ""
-        if hasattr(var_info['value'], 'shape'):
-            shape_info = f" Shape: {var_info['value'].shape}"
-        elif isinstance(var_info['value'], (int, float, bool)):
-            shape_info = f" (Scalar)"
+        # 変数のshapeを取得 (LazyVariableは値を読み込まずに要約を使う)
+        shape_info = get_variable_summary(var_info)
+
+        variable_listbox_widget.insert(tk.END, f"{var_name} {source_info}{shape_info}")
+
+def get_embed_process_pool():
+    """複数ファイルの組み込みに使うプロセスプールを返す。初回呼び出し時に作成する。"""
+    global embed_process_pool
+    if embed_process_pool is None:
+        # Tkを保持したプロセスをforkしないよう、子プロセスはspawnで起動する
+        embed_process_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+    return embed_process_pool
+
+def discard_embed_process_pool(pool):
+    """
+    壊れたプロセスプール (子プロセスが異常終了した場合など) を終了し、次回のget_embed_process_poolで作り直す。
+    残っているジョブは取り消し、子プロセスの終了は待たない。
+    """
+    global embed_process_pool
+    pool.shutdown(wait=False, cancel_futures=True)
+    if embed_process_pool is pool: # 既に作り直されたプールは残す
+        embed_process_pool = None
+
+def process_file_for_embedding(file_path, sheet_name, filter_expr, row_selection, col_selection,
+                               df=None, disk_cache_settings=None, streaming=False, compaction_settings=None):
+    """
+    1つのファイルについて「読み込み → フィルタ → スライス」を行い、結果を辞書で返す。
+    プロセスプールのワーカーでも実行されるため、UI (messagebox等) には触れない。
+    dfを指定した場合はファイルを読み込まずにそれを使う。
+    streamingがTrueの場合は、チャンクごとにフィルタしながら読み込む。
+    ファイルを読み込む場合は、列の選択とフィルタ式に必要な列だけを読み込む。
+    disk_cache_settingsとcompaction_settings ({}で無効) はワーカープロセスに引き継ぐ設定。
+    """
+    global disk_cache_directory, disk_cache_max_bytes, dtype_compaction_settings
+    result = {'file_path': file_path, 'sheet_name': sheet_name, 'df_slice': None,
+              'signature': None, 'status': 'ok', 'message': ''}
+    filter_applied = False
+    projection = None
+    try:
+        if df is None:
+            # ワーカープロセスにはメインプロセスのディスクキャッシュ設定を引き継ぐ
+            if disk_cache_settings is not None:
+                disk_cache_directory, disk_cache_max_bytes = disk_cache_settings
+            if compaction_settings is not None:
+                dtype_compaction_settings = compaction_settings or None
+            result['signature'] = get_file_signature(file_path)
+            projection = resolve_column_projection(file_path, sheet_name, col_selection, filter_expr)
+            load_columns = projection['load_columns'] if projection else None
+            if streaming and filter_expr:
+                df = read_filtered_dataframe(file_path, sheet_name, filter_expr, columns=load_columns)
+                filter_applied = True
+            else:
+                df = read_dataframe_file(file_path, sheet_name, columns=load_columns)
+    except Exception as e:
+        result.update(status='error', message=f"読み込み中にエラーが発生しました: {e}")
+        return result
+
+    # フィルタ式を適用 (コピーせず、マスクとして行の選択に使う)
+    mask = None
+    if filter_expr:
+        try:
+            if not filter_applied:
+                mask_key = get_dataframe_key(file_path, sheet_name)
+                if projection is not None:
+                    mask_key = get_projected_dataframe_key(mask_key, projection['load_columns'])
+                mask = get_filter_mask(df, filter_expr, mask_key, get_file_signature(file_path))
+        except Exception as e:
+            result.update(status='error', message=f"フィルタ式の適用中にエラーが発生しました: {e}")
+            return result
+        if (df.empty if mask is None else not mask.any()):
+            result.update(status='empty', message="フィルタリングの結果、データがありません。")
+            return result
+    if projection is not None:
+        # 読み込んだ列の位置は元のファイルと異なるため、選択済みの列のラベルで指定する
+        col_selection = list(projection['display_columns'])
+
+    try:
+        if isinstance(row_selection, str):
+            # 行ラベル (単一、範囲、リスト) を行の位置に変換する
+            label_index = get_row_label_index(df, get_dataframe_key(file_path, sheet_name), get_file_signature(file_path))
+            try:
+                row_selection = label_index.lookup(row_selection)
+            except KeyError:
+                result.update(status='empty', message=f"指定された行ラベル '{row_selection}' は見つかりませんでした。")
+                return result
+        df_slice = slice_dataframe(df, row_selection, col_selection, mask)
+    except Exception as e:
+        result.update(status='error', message=f"データ処理中にエラーが発生しました: {e}")
+        return result
+    if df_slice.empty:
+        result.update(status='empty', message="指定範囲でデータが見つかりませんでした。")
+        return result
+
+    result['df_slice'] = df_slice
+    return result
+
+def process_workbook_for_embedding(file_path, sheet_names, filter_expr, row_selection, col_selection,
+                                   disk_cache_settings=None, compaction_settings=None):
+    """
+    同じExcelブックの複数のシートを1つのハンドルから読み込み、シートごとに
+    process_file_for_embeddingと同じ処理をして結果のリストを返す。
+    """
+    global disk_cache_directory, disk_cache_max_bytes, dtype_compaction_settings
+    if disk_cache_settings is not None:
+        disk_cache_directory, disk_cache_max_bytes = disk_cache_settings
+    if compaction_settings is not None:
+        dtype_compaction_settings = compaction_settings or None
+    signature = get_file_signature(file_path)
+    try:
+        dataframes = read_excel_sheets(file_path, sheet_names)
+    except Exception as e:
+        return [{'file_path': file_path, 'sheet_name': sheet_name, 'df_slice': None, 'signature': signature,
+                 'status': 'error', 'message': f"読み込み中にエラーが発生しました: {e}"} for sheet_name in sheet_names]
+    results = []
+    for sheet_name in sheet_names:
+        result = process_file_for_embedding(file_path, sheet_name, filter_expr, row_selection, col_selection,
+                                            df=dataframes[sheet_name])
+        result['signature'] = signature
+        results.append(result)
+    return results
+
+class StoredVariable:
+    """
+    変数の値と、その置き場所 (residency) を管理する。'memory' (メモリ上)、'mapped' (.npyをメモリマップ中)、
+    'disk' (.npyに退避済み)、'unloaded' (値がなく、作り直しが必要) のいずれか。
+    メモリの予算を超えると、最後に使われたのが古いものからevict()で退避または破棄する。
+    変数リストの表示用に、形状、dtype、最小/最大の要約を持つ。
+    """
+    def __init__(self, value=None):
+        self.summary = None # {'shape', 'dtype', 'min', 'max'}
+        self.last_access = 0.0
+        self.residency = 'unloaded'
+        self._value = None
+        self._spill_record = None
+        self._spill_finalizer = None
+        self._lock = threading.Lock()
+        if value is not None:
+            self._set_value(value)
+
+    @staticmethod
+    def summarize(value):
+        """値の形状、dtype、(数値なら) 最小値と最大値を返す。"""
+        summary = {'shape': tuple(value.shape), 'dtype': str(value.dtype), 'min': None, 'max': None}
+        if pd.api.types.is_numeric_dtype(value.dtype) and not pd.api.types.is_bool_dtype(value.dtype) and len(value):
+            try:
+                summary['min'], summary['max'] = value.min().item(), value.max().item()
+            except (TypeError, ValueError, AttributeError):
+                pass
+        return summary
+
+    def _set_value(self, value):
+        self._value = value
+        self.summary = self.summarize(value)
+        self.residency = 'memory'
+        self.last_access = time.monotonic()
+
+    @property
+    def is_loaded(self):
+        return self.residency in ('memory', 'mapped')
+
+    def nbytes(self):
+        """メモリ上に常駐している値のメモリ量 (メモリマップや未読み込みなら0)。"""
+        value = self._value
+        if value is None or self.residency != 'memory':
+            return 0
+        if isinstance(value, pd.Series):
+            return int(value.memory_usage(index=True, deep=False))
+        return int(value.nbytes)
+
+    def resident_value(self):
+        """メモリ上に常駐している値を返す (メモリマップ中・退避済み・未読み込みならNone)。読み込みは行わない。"""
+        value = self._value
+        return value if self.residency == 'memory' else None
+
+    def get(self):
+        """値を返す。退避済みならメモリマップで読み戻し、未読み込みなら作り直す。"""
+        with self._lock:
+            if self._value is None:
+                if self._spill_record is not None:
+                    self._value = variable_store.load(self._spill_record)
+                    self.residency = 'memory' if self._spill_record.get('format') == 'pickle' else 'mapped'
+                else:
+                    self._set_value(self.materialize())
+            self.last_access = time.monotonic()
+            value = self._value
+        enforce_variable_memory_budget(keep=self)
+        return value
+
+    def materialize(self):
+        raise ValueError("値が失われており、作り直すことができません。")
+
+    def can_rebuild(self):
+        return False
+
+    def evict(self):
+        """
+        メモリ上の値を手放す。書き出せる配列は.npyに退避し (次回はメモリマップで読む)、
+        書き出せないものは作り直せる場合だけ破棄する。退避済みのファイルから読み戻した値は、
+        その場で書き換えられていなければそのまま手放し、書き換えられていれば書き出し直す。
+        手放せたらTrueを返す。
+        """
+        with self._lock:
+            if self.residency not in ('memory', 'mapped'):
+                return False
+            if self._spill_record is not None:
+                if variable_store.matches_record(self._spill_record, self._value):
+                    # 書き出し済みのファイルと同じ値 (メモリマップ中の値、ワークスペースのpickle) は読み直せる
+                    self._value = None
+                    self.residency = 'disk'
+                    return True
+                self._discard_spill_record() # その場で書き換えられた値は、新しく書き出し直す
+                self.residency = 'memory'
+            if variable_store.can_spill(self._value):
+                try:
+                    self._spill_record = variable_store.spill(self._value)
+                except OSError as e:
+                    print(f"Error spilling variable to disk: {e}")
+                else:
+                    self._spill_finalizer = weakref.finalize(self, VariableStore.remove_files, list(self._spill_record['paths']))
+                    self._value = None
+                    self.residency = 'disk'
+                    return True
+            if self.can_rebuild():
+                self._value = None
+                self.residency = 'unloaded'
+                return True
+            return False
+
+    def _discard_spill_record(self):
+        """書き出し済みのファイルとの結び付きを外す (一時ディレクトリのファイルなら削除する)。"""
+        if self._spill_finalizer is not None:
+            self._spill_finalizer()
+        self._spill_record = None
+        self._spill_finalizer = None
+
+    def attach(self, record, summary):
+        """書き出し済みのファイル (ワークスペースの値) を、読み込まずに値の置き場所として結び付ける。"""
+        with self._lock:
+            self._value = None
+            self._spill_record = record
+            self.summary = summary
+            self.residency = 'disk' if record is not None else 'unloaded'
+
+    def export(self, base_path):
+        """
+        ワークスペースの保存用に、値をbase_pathで始まるファイルに書き出して記録を返す。退避済みのファイルは
+        コピーし、保存先と同じディレクトリにあるもの (同じワークスペースから復元した値) はそのまま使う。
+        値がなく、作り直すしかない場合はNoneを返す。
+        """
+        with self._lock:
+            record, value = self._spill_record, self._value
+            if record is not None and value is not None and not variable_store.matches_record(record, value):
+                record = None # その場で書き換えられた値は、元のファイルをコピーせずに値を書き出す
+        if record is not None:
+            if os.path.dirname(record['paths'][0]) == os.path.dirname(base_path):
+                return record
+            return variable_store.copy_record(record, base_path)
+        if value is None:
+            return None
+        if variable_store.can_spill(value):
+            return variable_store.spill(value, base_path)
+        return variable_store.write_pickle(value, base_path)
+
+class LazyVariable(StoredVariable):
+    """
+    ファイルから組み込んだ変数の値を、元データのレシピ (ファイル、シート、列、フィルタ式、行の選択) として持つ。
+    値はプロット・演算・表示で必要になったときにget()で読み込み、メモリの予算を超えたら退避または破棄して、
+    次に必要になったときに退避先またはレシピから作り直す。
+    """
+    def __init__(self, file_path, sheet_name, column, filter_expr="", row_selection=None, value=None, source_version=None):
+        self.file_path = file_path
+        self.source_version = source_version # 組み込んだときの元ファイルのシグネチャ (Noneなら確認しない)
+        self.sheet_name = sheet_name
+        self.column = column
+        self.filter_expr = filter_expr or ""
+        self.row_selection = row_selection if row_selection is not None else slice(None)
+        super().__init__(widen_integer_values(value) if value is not None else None)
+
+    def source_changed(self):
+        """元ファイルが組み込んだときから変更 (または削除) されているか。"""
+        return self.source_version is not None and get_file_signature(self.file_path) != tuple(self.source_version)
+
+    def can_rebuild(self):
+        # 元ファイルが変わっていたら作り直すと別の値になるので、値を破棄しない
+        return not self.source_changed()
+
+    def materialize(self):
+        """
+        レシピから値を作る。元ファイルがキャッシュにあればそれを使い、なければ必要な列だけを読み込む。
+        元ファイルが組み込んだときから変更されている場合や、作れない場合はValueErrorを送出する。
+        """
+        if self.source_changed():
+            raise ValueError(f"{get_dataframe_display_name(self.file_path, self.sheet_name)} が組み込んだ後に変更されたため、"
+                             f"列 '{self.column}' の値を作り直せません。変数を組み込み直してください。")
+        df_key = get_dataframe_key(self.file_path, self.sheet_name)
+        df = loaded_dataframes.get(df_key, signature=get_file_signature(self.file_path))
+        result = process_file_for_embedding(self.file_path, self.sheet_name, self.filter_expr, self.row_selection,
+                                            [self.column], df=df)
+        if result['status'] != 'ok':
+            raise ValueError(f"{get_dataframe_display_name(self.file_path, self.sheet_name)} の列 "
+                             f"'{self.column}' を読み込めません: {result['message']}")
+        return widen_integer_values(result['df_slice'][self.column].copy()) # キャッシュのデータフレームとメモリを共有しない
+
+def get_variable_value(var):
+    """
+    変数 (名前またはglobal_variablesのエントリ) の値を返す。StoredVariableなら必要に応じて読み込む。
+    変数がなければNoneを返す。
+    """
+    var_info = global_variables.get(var) if isinstance(var, str) else var
+    if var_info is None:
+        return None
+    value = var_info.get('value')
+    if isinstance(value, LazyVariable) and value.residency == 'unloaded' and value.source_changed():
+        var_info['stale'] = True # 作り直せない (get()がValueErrorを送出する)
+    return value.get() if isinstance(value, StoredVariable) else value
+
+def get_variable_summary(var_info):
+    """変数リストの表示用に、値を読み込まずに形状と置き場所を表す文字列を返す。"""
+    value = var_info['value']
+    if isinstance(value, StoredVariable):
+        summary = value.summary or {}
+        text = f" Shape: {summary.get('shape')}"
+        if summary.get('min') is not None:
+            text += f" [{summary['min']:.6g} .. {summary['max']:.6g}]"
+        residency_labels = {'mapped': " (ディスク・マップ中)", 'disk': " (ディスク)", 'unloaded': " (未読込)"}
+        return text + residency_labels.get(value.residency, "")
+    if hasattr(value, 'shape'):
+        return f" Shape: {value.shape}"
+    if isinstance(value, (int, float, bool)):
+        return f" (Scalar)"
+    return ""
+
+def enforce_variable_memory_budget(keep=None):
+    """
+    常駐している変数の値の合計が予算を超えたら (またはシステムの空きメモリが閾値を下回ったら)、
+    最後に使われたのが古いものから.npyに退避または破棄する。
+    """
+    stored = [info['value'] for info in list(global_variables.values())
+              if isinstance(info.get('value'), StoredVariable) and info['value'].residency == 'memory']
+    total_bytes = sum(value.nbytes() for value in stored)
+    target_bytes = variable_store.memory_budget_bytes
+    if psutil is not None:
+        shortage = variable_store.min_available_bytes - psutil.virtual_memory().available
+        if shortage > 0:
+            target_bytes = min(target_bytes, max(0, total_bytes - shortage))
+    for value in sorted(stored, key=lambda v: v.last_access):
+        if total_bytes <= target_bytes:
+            break
+        if value is keep:
+            continue
+        value_bytes = value.nbytes()
+        if value.evict():
+            total_bytes -= value_bytes
+
+def get_variable_memory_stats():
+    """変数の値の置き場所ごとの数と、常駐しているメモリ量を返す。"""
+    counts = {'memory': 0, 'mapped': 0, 'disk': 0, 'unloaded': 0, 'other': 0}
+    resident_bytes = 0
+    for info in list(global_variables.values()):
+        value = info.get('value')
+        if isinstance(value, StoredVariable):
+            counts[value.residency] += 1
+            resident_bytes += value.nbytes()
+        else:
+            counts['other'] += 1
+    return counts, resident_bytes
+
+# --- メモリの内訳 ---
+# メモリの内訳の表示を更新する間隔 (ミリ秒)
+MEMORY_PANEL_REFRESH_MS = 2000
+
+class MemoryAccountant:
+    """
+    キャッシュのデータフレームと変数の値について、メモリ量 (deep)、dtypeごとの内訳、データのバッファの
+    アドレス範囲を測定する。測定結果はオブジェクトの弱参照と一緒に覚えておき、次の集計では
+    新しく現れたオブジェクトだけを測定する (object型の列のdeepな測定は重いため)。
+    バックグラウンドのスレッドから呼ぶ。
+    """
+    def __init__(self):
+        self._measurements = {} # id(obj) -> {'ref': weakref, 'nbytes', 'dtypes', 'ranges'}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_buffer_ranges(obj):
+        """numpyのdtypeを持つ列 (または配列) のバッファの (開始, 終了) アドレスのリストを返す。"""
+        if isinstance(obj, pd.DataFrame):
+            columns = [obj.iloc[:, i] for i in range(obj.shape[1])]
+        else:
+            columns = [obj]
+        ranges = []
+        for column in columns:
+            if not isinstance(column.dtype, np.dtype) or column.dtype.kind == 'O':
+                continue
+            array = column.to_numpy() if isinstance(column, pd.Series) else column
+            if array.size:
+                ranges.append(byte_bounds(array))
+        return ranges
+
+    @staticmethod
+    def get_dtype_breakdown(obj):
+        """dtypeごとのメモリ量 (deep) と、インデックスのメモリ量を {dtype名: バイト数} で返す。"""
+        breakdown = {}
+        if isinstance(obj, pd.DataFrame):
+            usage = obj.memory_usage(deep=True, index=False)
+            for column_bytes, dtype in zip(usage.to_numpy(), obj.dtypes):
+                breakdown[str(dtype)] = breakdown.get(str(dtype), 0) + int(column_bytes)
+        elif isinstance(obj, pd.Series):
+            breakdown[str(obj.dtype)] = int(obj.memory_usage(deep=True, index=False))
+        else:
+            breakdown[str(obj.dtype)] = int(obj.nbytes)
+        if isinstance(obj, (pd.DataFrame, pd.Series)):
+            breakdown['index'] = int(obj.index.memory_usage(deep=True))
+        return breakdown
+
+    def measure(self, obj):
+        """オブジェクトの {'nbytes', 'dtypes', 'ranges'} を返す。測定済みならそれを使う。"""
+        with self._lock:
+            measurement = self._measurements.get(id(obj))
+            if measurement is not None and measurement['ref']() is obj:
+                return measurement
+        dtypes = self.get_dtype_breakdown(obj)
+        measurement = {'ref': weakref.ref(obj), 'nbytes': sum(dtypes.values()), 'dtypes': dtypes,
+                       'ranges': self.get_buffer_ranges(obj)}
+        with self._lock:
+            self._measurements[id(obj)] = measurement
+        return measurement
+
+    def prune(self):
+        """解放されたオブジェクトの測定結果を捨てる。"""
+        with self._lock:
+            for key in [key for key, measurement in self._measurements.items() if measurement['ref']() is None]:
+                del self._measurements[key]
+
+def count_shared_bytes(ranges, claimed):
+    """
+    rangesのうち、先に数えたオブジェクトのバッファ (claimed: (名前, 開始, 終了) のリスト) と重なるバイト数と、
+    重なった相手の名前の集合を返す。
+    """
+    shared_bytes = 0
+    owners = set()
+    for low, high in ranges:
+        for owner, claimed_low, claimed_high in claimed:
+            overlap = min(high, claimed_high) - max(low, claimed_low)
+            if overlap > 0:
+                shared_bytes += overlap
+                owners.add(owner)
+    return min(shared_bytes, sum(high - low for low, high in ranges)), owners
+
+def collect_memory_report(accountant):
+    """
+    キャッシュのデータフレーム、プレビュー、フィルタのマスク、変数の値のメモリの内訳を集計する。
+    先に数えたデータフレームや変数とバッファを共有している分 (全データを読み込んだ短いファイルのプレビュー、
+    演算ページでほかの変数のビューとして作った変数など) は、'shared_bytes' として合計から差し引く。
+    {'rows': [...], 'totals': {...}} を返す。
+    """
+    rows = []
+    claimed = []
+
+    def add_row(kind, key, label, obj, state, last_access):
+        measurement = accountant.measure(obj)
+        shared_bytes, owners = count_shared_bytes(measurement['ranges'], claimed)
+        claimed.extend((label, low, high) for low, high in measurement['ranges'])
+        rows.append({'kind': kind, 'key': key, 'label': label, 'nbytes': measurement['nbytes'],
+                     'shared_bytes': shared_bytes, 'shared_with': sorted(owners), 'dtypes': measurement['dtypes'],
+                     'state': state, 'last_access': last_access})
+
+    for df_key, df, _, last_access in loaded_dataframes.snapshot():
+        add_row('frame', df_key, df_key, df, "キャッシュ", last_access)
+    with preview_dataframes_lock: # 測定は時間がかかるので、一覧だけを取ってロックを放す
+        previews = [(df_key, entry['df']) for df_key, entry in preview_dataframes.items()]
+    for df_key, preview_df in previews:
+        add_row('preview', df_key, f"{df_key} (プレビュー)", preview_df, "プレビュー", None)
+    now_wall, now_monotonic = time.time(), time.monotonic()
+    for var_name, var_info in list(global_variables.items()):
+        value = var_info.get('value')
+        if isinstance(value, StoredVariable):
+            last_access = now_wall - (now_monotonic - value.last_access) if value.last_access else None
+            resident = value.resident_value()
+            if resident is None: # メモリマップ中・退避済み・未読み込みの値はメモリを使っていない
+                summary = value.summary or {}
+                rows.append({'kind': 'variable', 'key': var_name, 'label': var_name, 'nbytes': 0, 'shared_bytes': 0,
+                             'shared_with': [], 'dtypes': {summary.get('dtype', "?"): 0},
+                             'state': value.residency, 'last_access': last_access})
+                continue
+            add_row('variable', var_name, var_name, resident, value.residency, last_access)
+        elif isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+            add_row('variable', var_name, var_name, value, 'memory', None)
+    accountant.prune()
+
+    frames_bytes = sum(row['nbytes'] for row in rows if row['kind'] in ('frame', 'preview'))
+    variables_bytes = sum(row['nbytes'] for row in rows if row['kind'] == 'variable')
+    shared_bytes = sum(row['shared_bytes'] for row in rows)
+    totals = {'frames_bytes': frames_bytes, 'variables_bytes': variables_bytes, 'shared_bytes': shared_bytes,
+              'mask_bytes': filter_masks.total_bytes,
+              'total_bytes': frames_bytes + variables_bytes - shared_bytes + filter_masks.total_bytes,
+              'budget_bytes': loaded_dataframes.budget_bytes + variable_store.memory_budget_bytes,
+              'rss_bytes': get_process_rss_bytes()}
+    return {'rows': rows, 'totals': totals}
+
+# --- ワークスペースの保存と復元 ---
+def serialize_row_selection(row_selection):
+    """LazyVariableの行の選択 (slice、ラベル文字列、位置の配列) をJSONに書ける形にする。"""
+    if isinstance(row_selection, slice):
+        return {'slice': [row_selection.start, row_selection.stop, row_selection.step]}
+    if isinstance(row_selection, np.ndarray):
+        return {'positions': row_selection.tolist()}
+    return {'label': row_selection}
+
+def deserialize_row_selection(data):
+    if 'slice' in data:
+        return slice(*data['slice'])
+    if 'positions' in data:
+        return np.asarray(data['positions'], dtype=np.int64)
+    return data['label']
+
+def get_workspace_data_paths(directory):
+    """
+    directoryの既存のマニフェストが参照している値のファイルのパス (正規化済み) の集合を返す。
+    マニフェストがない、または読めない場合は空の集合を返す。
+    """
+    try:
+        with open(os.path.join(directory, WORKSPACE_MANIFEST_NAME), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return set()
+    return {os.path.normcase(os.path.join(directory, path))
+            for entry in manifest.get('variables', []) if entry.get('data') for path in entry['data'].get('paths', [])}
+
+def to_manifest_json(value):
+    """
+    ワークスペースのマニフェストを書き出すjson.dumpsのdefault。numpyのスカラーはPythonの値にする。
+    それ以外のJSONにできない値 (配列、Timestampなど) は、文字列にして黙って別の値にせずTypeErrorを送出する。
+    """
+    if isinstance(value, np.generic) and not isinstance(value, (np.datetime64, np.timedelta64)):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} の値はワークスペースに保存できません")
 
-        variable_listbox_widget.insert(tk.END, f"{var_name} {source_info}{shape_info}")
+def save_workspace(directory):
+    """
+    変数、ルートディレクトリ、プロットのレイヤーをdirectoryに保存する。配列の値は1変数ごとに
+    .npy (書き出せないものはpickle) で保存し、出所 (ファイル、シート、列、読み込みのレシピ) と
+    形状などの要約はマニフェスト (JSON) にまとめる。退避済みの値はファイルのコピーで済ませ、
+    作り直せる未読み込みの値はレシピだけを保存する。保存した変数の数を返す。
+    プロットのレイヤーにJSONにできない値があれば、ファイルを書く前にValueErrorを送出する。
+    """
+    layers = [dict(layer) for layer in plot_layers]
+    for layer in layers:
+        try:
+            json.dumps(layer, default=to_manifest_json)
+        except TypeError as e:
+            raise ValueError(f"プロット '{layer.get('id')}' を保存できません: {e}") from e
+    data_directory = os.path.join(directory, WORKSPACE_DATA_DIRECTORY)
+    os.makedirs(data_directory, exist_ok=True)
+    previous_paths = get_workspace_data_paths(directory) # 前回の保存で書いたファイル (これ以外は削除しない)
+    token = f"{time.time_ns():x}" # 同じワークスペースに上書き保存しても、使用中のファイルと名前が衝突しない
+    entries = []
+    for i, (var_name, var_info) in enumerate(list(global_variables.items())):
+        value = var_info.get('value')
+        source_version = var_info.get('source_version')
+        entry = {'name': var_name, 'source_file': var_info.get('source_file'), 'source_sheet': var_info.get('source_sheet'),
+                 'source_column': var_info.get('source_column'), 'source_key': var_info.get('source_key'),
+                 'source_path': get_file_path_from_key(var_info.get('source_key') or ""),
+                 'source_version': list(source_version) if source_version is not None else None,
+                 'stale': bool(var_info.get('stale'))}
+        base_path = os.path.join(data_directory, f"{token}_{i}")
+        if isinstance(value, StoredVariable):
+            record = value.export(base_path)
+            entry['data'] = VariableStore.record_to_manifest(record, directory) if record is not None else None
+            entry['summary'] = value.summary
+            if isinstance(value, LazyVariable):
+                entry['recipe'] = {'file_path': value.file_path, 'sheet_name': value.sheet_name, 'column': value.column,
+                                   'filter_expr': value.filter_expr,
+                                   'row_selection': serialize_row_selection(value.row_selection)}
+        elif value is None or isinstance(value, (bool, int, float, str, np.number, np.bool_)):
+            entry['scalar'] = value.item() if isinstance(value, np.generic) else value
+        else:
+            entry['data'] = VariableStore.record_to_manifest(VariableStore.write_pickle(value, base_path), directory)
+        entries.append(entry)
+
+    manifest = {'format_version': WORKSPACE_FORMAT_VERSION, 'saved_at': time.time(),
+                'root_directories': list(global_root_directories),
+                'plot_layers': layers, 'variables': entries}
+    manifest_path = os.path.join(directory, WORKSPACE_MANIFEST_NAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, default=to_manifest_json)
+    os.replace(tmp_path, manifest_path)
+
+    # 前回の保存で書いたファイルのうち、新しいマニフェストから参照されないものだけを削除する
+    referenced = get_workspace_data_paths(directory)
+    data_directory = os.path.normcase(data_directory)
+    VariableStore.remove_files([path for path in previous_paths - referenced
+                                if os.path.dirname(path) == data_directory])
+    return len(entries)
+
+def load_workspace(directory):
+    """
+    directoryのマニフェストを読み、(変数の辞書, ルートディレクトリのリスト, プロットのレイヤーのリスト) を返す。
+    配列の値はまだ読まず、最初に使われたときにメモリマップで読む (ファイルがなければレシピから作り直す)。
+    マニフェストが読めない場合はValueErrorを送出する。
+    """
+    manifest_path = os.path.join(directory, WORKSPACE_MANIFEST_NAME)
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        raise ValueError(f"ワークスペースのファイル ({WORKSPACE_MANIFEST_NAME}) が見つかりません。")
+    except (OSError, json.JSONDecodeError) as e:
+        raise ValueError(f"ワークスペースを読み込めません: {e}")
+    if manifest.get('format_version') != WORKSPACE_FORMAT_VERSION:
+        raise ValueError(f"対応していないワークスペースの形式です (version {manifest.get('format_version')})。")
+
+    variables = {}
+    skipped = []
+    for entry in manifest.get('variables', []):
+        data, recipe = entry.get('data'), entry.get('recipe')
+        record = VariableStore.record_from_manifest(data, directory) if data else None
+        if record is not None and not all(os.path.exists(path) for path in record['paths']):
+            record = None # 値のファイルが失われている (レシピがあれば元ファイルから作り直す)
+        summary = entry.get('summary')
+        if summary is not None:
+            summary = dict(summary, shape=tuple(summary['shape']))
+            if not isinstance(summary.get('min'), (int, float)): # 複素数などは文字列で保存されている
+                summary.update(min=None, max=None)
+        source_version = tuple(entry['source_version']) if entry.get('source_version') is not None else None
+        if entry.get('source_key') and entry.get('source_path'):
+            dataframe_key_paths[entry['source_key']] = entry['source_path'] # ファイルの変更の監視に使う
+        if 'scalar' in entry:
+            value = entry['scalar']
+        elif recipe is not None:
+            value = LazyVariable(recipe['file_path'], recipe['sheet_name'], recipe['column'], recipe['filter_expr'],
+                                 deserialize_row_selection(recipe['row_selection']), source_version=source_version)
+            value.attach(record, summary)
+        elif record is None:
+            skipped.append(entry['name'])
+            continue
+        elif summary is None:
+            value = variable_store.load(record) # 配列でない値 (DataFrameなど) はそのまま読む
+        else:
+            value = StoredVariable()
+            value.attach(record, summary)
+        stale = entry.get('stale', False)
+        if recipe is not None and not stale and source_version is not None:
+            stale = get_file_signature(recipe['file_path']) != source_version # 保存後に元ファイルが更新された
+        variables[entry['name']] = {
+            'value': value,
+            'source_file': entry.get('source_file'),
+            'source_sheet': entry.get('source_sheet'),
+            'source_column': entry.get('source_column'),
+            'source_key': entry.get('source_key'),
+            'source_version': source_version,
+            'stale': stale
+        }
+    if skipped:
+        print(f"Variables without data in workspace {directory}: {', '.join(skipped)}")
+    layers = [layer for layer in manifest.get('plot_layers', [])
+              if all(layer.get(key) in variables for key in ('x_var', 'y_var', 'z_var', 'u_var', 'v_var') if layer.get(key))]
+    return variables, manifest.get('root_directories', []), layers
 
 def embed_multiple_variables_from_selection(parent_window, file_tree_widget, 
                                             start_row_entry, end_row_entry, start_col_entry, end_col_entry,
                                             row_label_entry, col_label_entry, filter_expression_entry, 
-                                            variable_listbox_widget):
+                                            variable_listbox_widget, streaming_filter_var=None):
     """
     Treeviewで選択された複数のファイルから、指定範囲のデータを変数に一括で組み込む。
+    各ファイルの「読み込み → フィルタ → スライス」はプロセスプールで並列に実行し
+    (キャッシュ済みのファイルはスレッドで処理する)、結果とエラーは最後にまとめて表示する。
     """
     global loaded_dataframes, global_variables
 
@@ -563,118 +4147,364 @@ def embed_multiple_variables_from_selection(parent_window, file_tree_widget,
     start_col_idx_input = start_col_entry.get().strip()
     end_col_idx_input = end_col_entry.get().strip()
     filter_expr = filter_expression_entry.get().strip() # フィルタ式も取得
+    streaming = bool(streaming_filter_var is not None and streaming_filter_var.get())
+
+    try:
+        # 行の選択
+        row_selection = slice(None)
+        if row_label_input: row_selection = row_label_input
+        elif start_row_idx_input or end_row_idx_input:
+            start_row = int(start_row_idx_input) if start_row_idx_input else 0
+            end_row = int(end_row_idx_input) if end_row_idx_input else None
+            row_selection = slice(start_row, end_row)
 
-    processed_files_count = 0
-    processed_vars_count = 0
+        # 列の選択
+        col_selection = slice(None)
+        if col_label_input: col_selection = col_label_input
+        elif start_col_idx_input or end_col_idx_input:
+            start_col = int(start_col_idx_input) if start_col_idx_input else 0
+            end_col = int(end_col_idx_input) if end_col_idx_input else None
+            col_selection = slice(start_col, end_col)
+    except ValueError as e:
+        messagebox.showerror("エラー", f"入力値が無効です: {e}\n行/列は数値インデックスまたはラベルを入力してください。")
+        return
 
+    # 対象ファイルを集める (Excelのシート選択は処理開始前にまとめて行う)
+    targets = []
     for item_id in selected_item_ids:
         item_tags = file_tree_widget.item(item_id, "tags")
-        if "file" in item_tags:
+        if "hdf_key" in item_tags or "excel_sheet" in item_tags:
+            file_path, dataset = file_tree_widget.item(item_id, "values")
+            targets.append((file_path, dataset))
+        elif "file" in item_tags:
             file_path = file_tree_widget.item(item_id, "values")[0]
-            sheet_name = None
             if file_path.lower().endswith(('.xlsx', '.xls')):
-                sheet_name = prompt_for_excel_sheet(parent_window, file_path)
-                if sheet_name is None:
+                sheet_names = prompt_for_excel_sheet(parent_window, file_path, multiple=True)
+                if sheet_names is None:
                     continue # ユーザーがシート選択をキャンセルした場合
-            
-            df_key = file_path
-            if sheet_name:
-                df_key += f"_{sheet_name}"
+                targets.extend((file_path, sheet_name) for sheet_name in sheet_names)
+            else:
+                targets.append((file_path, None))
 
-            df = loaded_dataframes.get(df_key)
-            if df is None:
-                try:
-                    if file_path.lower().endswith('.csv'):
-                        df = pd.read_csv(file_path)
-                    elif file_path.lower().endswith(('.h5', '.hdf')):
-                        df = pd.read_hdf(file_path)
-                    elif file_path.lower().endswith(('.xlsx', '.xls')):
-                        df = pd.read_excel(file_path, sheet_name=sheet_name)
-                    loaded_dataframes[df_key] = df
-                except Exception as e:
-                    messagebox.showerror("エラー", f"ファイル '{os.path.basename(file_path)}' の読み込み中にエラーが発生しました: {e}")
-                    continue
+    if not targets:
+        messagebox.showinfo("情報", "選択されたファイルから変数は組み込まれませんでした。")
+        return
 
-            df_processed = df.copy() # 処理用のコピー
+    # キャッシュ済みのファイルはスレッドで、それ以外はプロセスプールで処理する
+    # (同じExcelブックの複数のシートは、ブックを1回だけ開く1つのジョブにまとめる)
+    futures = []
+    disk_cache_settings = (disk_cache_directory, disk_cache_max_bytes)
+    compaction_settings = dtype_compaction_settings or {}
+    workbook_sheets = OrderedDict()
+    pool = get_embed_process_pool() # 子プロセスは最初のsubmitで起動する
+    try:
+        for file_path, sheet_name in targets:
+            df_key = get_dataframe_key(file_path, sheet_name)
+            df = loaded_dataframes.get(df_key, signature=get_file_signature(file_path))
+            if df is None and file_path.lower().endswith(('.xlsx', '.xls')):
+                workbook_sheets.setdefault(file_path, []).append(sheet_name)
+                continue
+            if df is not None:
+                future = background_executor.submit(process_file_for_embedding, file_path, sheet_name,
+                                                    filter_expr, row_selection, col_selection, df=df)
+                cached_signature = loaded_dataframes.get_signature(df_key)
+            else:
+                future = pool.submit(process_file_for_embedding, file_path, sheet_name,
+                                     filter_expr, row_selection, col_selection,
+                                     disk_cache_settings=disk_cache_settings, streaming=streaming,
+                                     compaction_settings=compaction_settings)
+                cached_signature = None
+            futures.append((file_path, sheet_name, future, cached_signature))
+        for file_path, sheet_names in workbook_sheets.items():
+            if len(sheet_names) == 1:
+                future = pool.submit(process_file_for_embedding, file_path, sheet_names[0],
+                                     filter_expr, row_selection, col_selection,
+                                     disk_cache_settings=disk_cache_settings, streaming=streaming,
+                                     compaction_settings=compaction_settings)
+                futures.append((file_path, sheet_names[0], future, None))
+            else:
+                future = pool.submit(process_workbook_for_embedding, file_path, sheet_names,
+                                     filter_expr, row_selection, col_selection,
+                                     disk_cache_settings=disk_cache_settings,
+                                     compaction_settings=compaction_settings)
+                futures.append((file_path, sheet_names, future, None))
+    except Exception as e:
+        if isinstance(e, BrokenProcessPool):
+            discard_embed_process_pool(pool)
+        messagebox.showerror("エラー", f"並列処理の開始中にエラーが発生しました: {e}")
+        for _, _, future, _ in futures:
+            future.cancel()
+        return
 
-            # フィルタ式を適用
-            if filter_expr:
-                try:
-                    df_processed = df_processed.query(filter_expr)
-                    if df_processed.empty:
-                        messagebox.showwarning("情報", f"ファイル '{os.path.basename(file_path)}' はフィルタリングの結果、データがありません。")
-                        continue
-                except Exception as e:
-                    messagebox.showerror("フィルタエラー", f"ファイル '{os.path.basename(file_path)}' のフィルタ式の適用中にエラーが発生しました: {e}\n式を確認してください。")
-                    continue
+    # 進捗ダイアログ
+    progress_dialog = tk.Toplevel(parent_window)
+    progress_dialog.title("複数ファイルを変数に組み込む")
+    progress_dialog.geometry("360x120")
+    progress_dialog.transient(parent_window)
+    progress_dialog.configure(bg="#F0F2F5")
+    progress_label = ttk.Label(progress_dialog, text="", style='SubHeader.TLabel', background="#F0F2F5")
+    progress_label.pack(pady=15)
+    cancelled = [False]
+
+    def cancel_processing():
+        cancelled[0] = True
+        for _, _, future, _ in futures:
+            future.cancel()
+
+    ttk.Button(progress_dialog, text="キャンセル", command=cancel_processing, style='Gray.TButton', cursor="hand2").pack(pady=5)
+    progress_dialog.protocol("WM_DELETE_WINDOW", cancel_processing)
+
+    def check_progress():
+        if not progress_dialog.winfo_exists():
+            return
+        done_count = sum(1 for _, _, future, _ in futures if future.done())
+        progress_label.config(text=f"処理中: {done_count} / {len(futures)} ファイル")
+        if done_count < len(futures):
+            progress_dialog.after(200, check_progress)
+            return
+        progress_dialog.destroy()
+        finish_embedding()
 
-            try:
-                # 行の選択を適用
-                row_selection = slice(None)
-                if row_label_input: row_selection = row_label_input
-                elif start_row_idx_input or end_row_idx_input:
-                    start_row = int(start_row_idx_input) if start_row_idx_input else 0
-                    end_row = int(end_row_idx_input) if end_row_idx_input else None
-                    row_selection = slice(start_row, end_row)
-
-                # 列の選択を適用
-                col_selection = slice(None)
-                if col_label_input: col_selection = col_label_input
-                elif start_col_idx_input or end_col_idx_input:
-                    start_col = int(start_col_idx_input) if start_col_idx_input else 0
-                    end_col = int(end_col_idx_input) if end_col_idx_input else None
-                    col_selection = slice(start_col, end_col)
-
-                # 実際にスライスを適用
-                if isinstance(row_selection, slice) and isinstance(col_selection, slice):
-                    df_slice = df_processed.iloc[row_selection, col_selection]
-                elif isinstance(row_selection, str) and isinstance(col_selection, slice):
-                    df_slice = df_processed.loc[[row_selection], col_selection]
-                elif isinstance(row_selection, slice) and isinstance(col_selection, str):
-                    df_slice = df_processed.loc[row_selection, [col_selection]]
-                elif isinstance(row_selection, str) and isinstance(col_selection, str):
-                    df_slice = df_processed.loc[[row_selection], [col_selection]]
-                else:
-                    messagebox.showerror("エラー", "行と列の選択の組み合わせが不正です。")
-                    continue
+    def finish_embedding():
+        results = []
+        for file_path, sheet_name, future, cached_signature in futures:
+            if future.cancelled():
+                continue
+            error = future.exception()
+            if error is not None:
+                if isinstance(error, BrokenProcessPool):
+                    discard_embed_process_pool(pool)
+                for failed_sheet in (sheet_name if isinstance(sheet_name, list) else [sheet_name]):
+                    results.append({'file_path': file_path, 'sheet_name': failed_sheet, 'df_slice': None,
+                                    'status': 'error', 'message': f"並列処理中にエラーが発生しました: {error}"})
+                continue
+            result = future.result()
+            if isinstance(result, list): # Excelブックの複数シートをまとめたジョブ
+                results.extend(result)
+                continue
+            if cached_signature is not None:
+                result['signature'] = cached_signature
+            results.append(result)
+
+        succeeded = [result for result in results if result['status'] == 'ok']
+        failed = [result for result in results if result['status'] != 'ok']
+
+        # ファイルごとの問題を1つの要約にまとめる
+        summary_lines = []
+        for result in failed[:20]:
+            summary_lines.append(f"・{get_dataframe_display_name(result['file_path'], result['sheet_name'])}: {result['message']}")
+        if len(failed) > 20:
+            summary_lines.append(f"…ほか{len(failed) - 20}件")
+        if cancelled[0]:
+            summary_lines.append("※ 処理はキャンセルされました。")
+        summary_text = "\n".join(summary_lines)
+
+        if not succeeded:
+            messagebox.showinfo("情報", "選択されたファイルから変数は組み込まれませんでした。" + (f"\n\n{summary_text}" if summary_text else ""))
+            return
 
-                if df_slice.empty:
-                    messagebox.showwarning("警告", f"ファイル '{os.path.basename(file_path)}' の指定範囲でデータが見つかりませんでした。")
-                    continue
+        new_variables = []
+        for result in succeeded:
+            for col_name in result['df_slice'].columns:
+                var_name = generate_variable_name(col_name, result['file_path'], result['sheet_name'])
+                new_variables.append((var_name, col_name, result))
+        duplicate_names = {var_name for var_name, _, _ in new_variables if var_name in global_variables}
+
+        confirm_text = f"{len(succeeded)}個のファイルから {len(new_variables)} 列を変数に組み込みますか？\n（変数名は自動生成されます）"
+        if summary_text:
+            confirm_text += f"\n\n処理できなかったファイル ({len(failed)}件):\n{summary_text}"
+        if duplicate_names:
+            confirm_text += f"\n\n{len(duplicate_names)}個の変数名が既に存在します。\nはい: 上書きする / いいえ: 既存の変数はスキップ / キャンセル: 中止"
+            answer = messagebox.askyesnocancel("一括組み込み確認", confirm_text)
+            if answer is None:
+                return
+            overwrite = answer
+        else:
+            if not messagebox.askyesno("一括組み込み確認", confirm_text):
+                return
+            overwrite = True
+
+        processed_files = set()
+        processed_vars_count = 0
+        for var_name, col_name, result in new_variables:
+            if var_name in duplicate_names and not overwrite:
+                continue
+            file_path = result['file_path']
+            sheet_name = result['sheet_name']
+            global_variables[var_name] = {
+                'value': LazyVariable(file_path, sheet_name, col_name, filter_expr, row_selection,
+                                      value=result['df_slice'][col_name].copy(), # キャッシュのデータフレームとメモリを共有しない
+                                      source_version=result['signature']),
+                'source_file': os.path.basename(file_path),
+                'source_sheet': sheet_name,
+                'source_column': col_name,
+                'source_key': get_dataframe_key(file_path, sheet_name),
+                'source_version': result['signature'],
+                'stale': False
+            }
+            processed_vars_count += 1
+            processed_files.add((file_path, sheet_name))
 
-                source_filename_base = os.path.splitext(os.path.basename(file_path))[0]
+        if processed_vars_count > 0:
+            enforce_variable_memory_budget() # 使われていない列の値は破棄し、必要になったら読み直す
+            update_variable_list(variable_listbox_widget)
+            messagebox.showinfo("情報", f"{len(processed_files)}個のファイルから合計{processed_vars_count}個の変数を組み込みました。")
+        else:
+            messagebox.showinfo("情報", "選択されたファイルから変数は組み込まれませんでした。")
 
-                # 各列を変数に組み込むためのダイアログ (一括処理のため、ここでは自動命名のみ)
-                # ユーザーに確認ダイアログを表示し、一括で組み込むか尋ねる
-                if not messagebox.askyesno("一括組み込み確認", 
-                                            f"ファイル '{os.path.basename(file_path)}' から {len(df_slice.columns)} 列を変数に組み込みますか？\n（変数名は自動生成されます）"):
-                    continue
+    check_progress()
 
-                for col_name in df_slice.columns:
-                    var_name = generate_variable_name(col_name, file_path, sheet_name)
-                    
-                    if var_name in global_variables:
-                        if not messagebox.askyesno("警告", f"変数名 '{var_name}' は既に存在します。上書きしますか？"):
-                            continue
-
-                    global_variables[var_name] = {
-                        'value': df_slice[col_name],
-                        'source_file': os.path.basename(file_path),
-                        'source_sheet': sheet_name,
-                        'source_column': col_name
-                    }
-                    processed_vars_count += 1
-                processed_files_count += 1
+# --- メモリの内訳のページ ---
+def show_memory_page(parent_window, on_change=None):
+    """
+    キャッシュのデータフレームと変数の値ごとのメモリ量、dtypeの内訳、最終アクセス時刻を一覧する
+    ウィンドウを表示する。集計はバックグラウンドで定期的に行い (測定済みのオブジェクトは測り直さない)、
+    一覧は変わった行だけを更新する。選択した行のキャッシュからの追い出し、変数の退避・削除ができる。
+    on_changeは、キャッシュや変数を変更したときに呼ぶ (呼び出し元の表示の更新用)。
+    """
+    memory_window = tk.Toplevel(parent_window)
+    memory_window.title("メモリの内訳")
+    memory_window.geometry("1000x600")
+    memory_window.configure(bg="#F0F2F5")
+    memory_window.columnconfigure(0, weight=1)
+    memory_window.rowconfigure(1, weight=1)
+
+    totals_label = ttk.Label(memory_window, text="集計中…", style='SubHeader.TLabel', background="#F0F2F5")
+    totals_label.grid(row=0, column=0, sticky="w", padx=10, pady=(10, 5))
+
+    tree_frame = ttk.Frame(memory_window, style='White.TFrame')
+    tree_frame.grid(row=1, column=0, sticky="nsew", padx=10, pady=5)
+    tree_frame.columnconfigure(0, weight=1)
+    tree_frame.rowconfigure(0, weight=1)
+    columns = ('kind', 'size', 'shared', 'dtypes', 'state', 'last_access')
+    memory_tree = ttk.Treeview(tree_frame, columns=columns, show='tree headings', selectmode='extended')
+    memory_tree.heading('#0', text='名前')
+    memory_tree.column('#0', width=260)
+    for column, text, width in (('kind', '種類', 70), ('size', 'サイズ', 90), ('shared', '共有', 150),
+                                ('dtypes', 'dtypeの内訳', 260), ('state', '状態', 80), ('last_access', '最終アクセス', 90)):
+        memory_tree.heading(column, text=text)
+        memory_tree.column(column, width=width)
+    memory_tree.grid(row=0, column=0, sticky="nsew")
+    tree_scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=memory_tree.yview)
+    tree_scrollbar.grid(row=0, column=1, sticky="ns")
+    memory_tree.configure(yscrollcommand=tree_scrollbar.set)
+
+    accountant = MemoryAccountant()
+    rows_by_iid = {}
+    refresh_state = {'running': False}
+    kind_labels = {'frame': "キャッシュ", 'preview': "プレビュー", 'variable': "変数"}
+
+    def format_row(row):
+        dtypes_text = ", ".join(f"{dtype} {format_bytes(nbytes)}" if nbytes else dtype
+                                for dtype, nbytes in sorted(row['dtypes'].items(), key=lambda item: -item[1]))
+        shared_text = ""
+        if row['shared_bytes']:
+            shared_text = f"{format_bytes(row['shared_bytes'])} ({', '.join(row['shared_with'])})"
+        last_access = time.strftime("%H:%M:%S", time.localtime(row['last_access'])) if row['last_access'] else "-"
+        return (kind_labels[row['kind']], format_bytes(row['nbytes']), shared_text, dtypes_text, row['state'], last_access)
+
+    def apply_report(report):
+        """集計結果で一覧を更新する (変わった行だけを書き換え、消えた行を削除する)。"""
+        new_rows = {f"{row['kind']}:{row['key']}": row for row in report['rows']}
+        for iid in list(rows_by_iid):
+            if iid not in new_rows:
+                memory_tree.delete(iid)
+                del rows_by_iid[iid]
+        for iid, row in new_rows.items():
+            values = format_row(row)
+            if iid not in rows_by_iid:
+                memory_tree.insert('', 'end', iid=iid, text=row['label'], values=values)
+            elif format_row(rows_by_iid[iid]) != values:
+                memory_tree.item(iid, values=values)
+            rows_by_iid[iid] = row
+        totals = report['totals']
+        text = (f"合計 {format_bytes(totals['total_bytes'])} / 予算 {format_bytes(totals['budget_bytes'])}  "
+                f"(キャッシュ {format_bytes(totals['frames_bytes'])}, 変数 {format_bytes(totals['variables_bytes'])}, "
+                f"共有分 -{format_bytes(totals['shared_bytes'])}, フィルタのマスク {format_bytes(totals['mask_bytes'])})")
+        if totals['rss_bytes'] is not None:
+            text += f"  RSS: {format_bytes(totals['rss_bytes'])}"
+        totals_label.config(text=text)
+
+    def refresh_report():
+        """バックグラウンドで集計し、終わったら一覧を更新する (集計中なら何もしない)。"""
+        if refresh_state['running'] or not memory_window.winfo_exists():
+            return
+        refresh_state['running'] = True
+        future = background_executor.submit(collect_memory_report, accountant)
 
+        def on_done(future):
+            refresh_state['running'] = False
+            if not memory_window.winfo_exists():
+                return
+            try:
+                report = future.result()
             except Exception as e:
-                messagebox.showerror("エラー", f"ファイル '{os.path.basename(file_path)}' のデータ処理中にエラーが発生しました: {e}")
+                totals_label.config(text=f"集計中にエラーが発生しました: {e}")
+                return
+            apply_report(report)
+        poll_future(memory_window, future, on_done)
+
+    def schedule_refresh():
+        if not memory_window.winfo_exists():
+            return
+        refresh_report()
+        memory_window.after(MEMORY_PANEL_REFRESH_MS, schedule_refresh)
+
+    def notify_change():
+        if on_change is not None:
+            on_change()
+        refresh_report()
+
+    def release_selected():
+        """選択したキャッシュ (プレビュー) を追い出し、変数の値を.npyに退避する (作り直せるものは破棄する)。"""
+        released, kept = 0, []
+        for iid in memory_tree.selection():
+            row = rows_by_iid.get(iid)
+            if row is None:
                 continue
-    
-    if processed_vars_count > 0:
-        update_variable_list(variable_listbox_widget)
-        messagebox.showinfo("情報", f"{processed_files_count}個のファイルから合計{processed_vars_count}個の変数を組み込みました。")
-    else:
-        messagebox.showinfo("情報", "選択されたファイルから変数は組み込まれませんでした。")
+            if row['kind'] == 'frame':
+                released += loaded_dataframes.pop(row['key']) is not None
+            elif row['kind'] == 'preview':
+                with preview_dataframes_lock:
+                    released += preview_dataframes.pop(row['key'], None) is not None
+            else:
+                value = global_variables.get(row['key'], {}).get('value')
+                if isinstance(value, StoredVariable) and value.evict():
+                    released += 1
+                else:
+                    kept.append(row['label'])
+        if kept:
+            messagebox.showinfo("情報", f"次の変数はメモリから手放せませんでした: {', '.join(kept)}", parent=memory_window)
+        if released:
+            notify_change()
+
+    def delete_selected_variables():
+        """選択した変数を削除する。その変数を使うプロットも削除する。"""
+        names = [rows_by_iid[iid]['key'] for iid in memory_tree.selection()
+                 if iid in rows_by_iid and rows_by_iid[iid]['kind'] == 'variable']
+        if not names:
+            messagebox.showinfo("情報", "削除する変数を選択してください。", parent=memory_window)
+            return
+        if not messagebox.askyesno("確認", f"{len(names)}個の変数を削除しますか？\n{', '.join(names)}", parent=memory_window):
+            return
+        for name in names:
+            global_variables.pop(name, None)
+        plot_layers[:] = [layer for layer in plot_layers
+                          if not any(layer.get(key) in names for key in ('x_var', 'y_var', 'z_var', 'u_var', 'v_var'))]
+        notify_change()
+
+    buttons_frame = ttk.Frame(memory_window, style='LightGray.TFrame')
+    buttons_frame.grid(row=2, column=0, sticky="ew", padx=10, pady=10)
+    for column, (text, command, style) in enumerate((
+            ("追い出す / 退避", release_selected, 'TButton'),
+            ("変数を削除", delete_selected_variables, 'Red.TButton'),
+            ("キャッシュの予算", lambda: ask_cache_budget(memory_window) and notify_change(), 'Gray.TButton'),
+            ("変数の予算", lambda: ask_variable_memory_settings(memory_window) and notify_change(), 'Gray.TButton'))):
+        ttk.Button(buttons_frame, text=text, command=command, style=style, cursor="hand2").grid(
+            row=0, column=column, sticky="w", padx=5)
+
+    schedule_refresh()
+
 
 # --- プロット機能 ---
 # プロットのレイヤーを管理するリスト
@@ -902,14 +4732,17 @@ def show_plot_page(parent_window):
             'style': {} # ここに将来的にスタイルオプションを追加
         }
         plot_layers.append(plot_info)
-        
-        var_display = f"X:{x_var_name}, Y:{y_var_name}"
-        if z_var_name and '3D' in plot_type: var_display += f", Z:{z_var_name}"
-        if u_var_name and v_var_name: var_display += f", U:{u_var_name}, V:{v_var_name}"
-        
-        plot_list_tree.insert('', 'end', iid=layer_id, values=(plot_type, var_display))
+        insert_plot_list_item(plot_info)
         redraw_plot_figure()
 
+    def insert_plot_list_item(layer):
+        """プロットリストにレイヤーの行を追加する。"""
+        var_display = f"X:{layer['x_var']}, Y:{layer['y_var']}"
+        if layer['z_var'] and '3D' in layer['type']: var_display += f", Z:{layer['z_var']}"
+        if layer['u_var'] and layer['v_var']: var_display += f", U:{layer['u_var']}, V:{layer['v_var']}"
+        if not plot_list_tree.exists(layer['id']):
+            plot_list_tree.insert('', 'end', iid=layer['id'], values=(layer['type'], var_display))
+
 
     def redraw_plot_figure():
         """
@@ -943,11 +4776,11 @@ def show_plot_page(parent_window):
             v_var_name = layer['v_var']
 
             try:
-                x_data = global_variables.get(x_var_name, {}).get('value')
-                y_data = global_variables.get(y_var_name, {}).get('value')
-                z_data = global_variables.get(z_var_name, {}).get('value')
-                u_data = global_variables.get(u_var_name, {}).get('value')
-                v_data = global_variables.get(v_var_name, {}).get('value')
+                x_data = get_variable_value(x_var_name) if x_var_name else None
+                y_data = get_variable_value(y_var_name) if y_var_name else None
+                z_data = get_variable_value(z_var_name) if z_var_name else None
+                u_data = get_variable_value(u_var_name) if u_var_name else None
+                v_data = get_variable_value(v_var_name) if v_var_name else None
 
                 # データがSeriesの場合、NumPy配列に変換 (特にcontourfなどで必要)
                 if isinstance(x_data, pd.Series): x_data = x_data.to_numpy()
@@ -1039,6 +4872,12 @@ def show_plot_page(parent_window):
 
         current_figure = fig # グローバル変数に新しいFigureを保存
 
+    # 既存のレイヤー (前回開いたときやワークスペースから復元したもの) を表示する
+    for layer in plot_layers:
+        insert_plot_list_item(layer)
+    if plot_layers:
+        redraw_plot_figure()
+
 
 def show_calculation_page(parent_window):
     """
@@ -1103,14 +4942,22 @@ def show_calculation_page(parent_window):
         if not code:
             return
 
-        # 実行環境を準備
+        # 実行環境を準備 (コードに現れる変数だけを読み込む)
+        # 変数名は日本語の列名から始まることがあるため、\wの連なりで拾って識別子として有効なものだけを使う
+        code_names = set(re.findall(r"\w+", code))
+        try:
+            user_variables = {name: get_variable_value(var_info) for name, var_info in global_variables.items()
+                              if name in code_names and name.isidentifier()}
+        except ValueError as e:
+            messagebox.showerror("エラー", f"変数を読み込めませんでした: {e}", parent=calc_window)
+            return
         exec_globals = {
             'pd': pd,
             'np': np,
             'messagebox': messagebox,
             'os': os,
             'loaded_dataframes': loaded_dataframes,
-            **{name: var_info['value'] for name, var_info in global_variables.items()} # ユーザー変数を展開
+            **user_variables # ユーザー変数を展開
         }
         exec_locals = {} # ローカル変数は空
 
@@ -1167,13 +5014,16 @@ def show_calculation_page(parent_window):
                 if not messagebox.askyesno("警告", f"変数名 '{var_name}' は既に存在します。上書きしますか？"):
                     return
             
-            # 変数情報を保存
+            # 変数情報を保存 (配列はメモリが足りなくなったら.npyに退避できるようにする)
+            if isinstance(val, (pd.Series, np.ndarray)):
+                val = StoredVariable(val)
             global_variables[var_name] = {
                 'value': val,
                 'source_file': 'Calculation',
                 'source_sheet': None,
                 'source_column': var_name
             }
+            enforce_variable_memory_budget()
             # 計算後、ファイル処理ページに戻ったときに変数リストを再描画する
             # メッセージボックスで通知し、ユーザーが戻ったときに更新されることを期待
             messagebox.showinfo("成功", f"変数 '{var_name}' が追加されました。ファイル処理ページの変数リストを更新してください。")
@@ -1217,6 +5067,7 @@ def show_file_processing_page(initial_directory_paths=None):
     ファイルリストとデータフレーム表示機能を持つページを表示する関数。
     複数の初期ディレクトリパスをリストとして受け取る。
     """
+    global directory_watcher
     file_processing_page = tk.Tk()
     file_processing_page.title(f"データ分析 - ファイル処理")
     file_processing_page.geometry("1200x800")
@@ -1238,11 +5089,13 @@ def show_file_processing_page(initial_directory_paths=None):
     top_controls_frame.columnconfigure(2, weight=0) # ディレクトリ追加ボタン
     top_controls_frame.columnconfigure(3, weight=0) # 拡張子フィルター
     top_controls_frame.columnconfigure(4, weight=0) # 検索オプション
+    top_controls_frame.columnconfigure(5, weight=0) # 索引の更新ボタン
 
     # 検索エントリーとボタン
     search_entry = ttk.Entry(top_controls_frame, width=50, style='TEntry')
     search_entry.grid(row=0, column=0, sticky="ew", padx=5, pady=5)
     search_entry.bind("<Return>", lambda event: filter_treeview())
+    search_entry.bind("<KeyRelease>", lambda event: schedule_live_search(event))
 
     search_button = ttk.Button(
         top_controls_frame,
@@ -1264,6 +5117,7 @@ def show_file_processing_page(initial_directory_paths=None):
             if new_dir not in global_root_directories:
                 global_root_directories.append(new_dir)
                 filter_treeview() # 新しいディレクトリを追加したらツリーを再構築
+                update_file_index() # 新しいルートを索引に追加する
             else:
                 messagebox.showinfo("情報", "このディレクトリは既にリストに追加されています。")
 
@@ -1276,6 +5130,86 @@ def show_file_processing_page(initial_directory_paths=None):
     )
     add_dir_button.grid(row=0, column=2, sticky="e", padx=5, pady=5)
 
+    # ファイルシステムの索引の状態と更新ボタン
+    index_status_label = ttk.Label(top_controls_frame, text="索引: 未作成", style='Note.TLabel')
+    index_status_label.grid(row=1, column=0, columnspan=5, sticky="w", padx=5)
+
+    def refresh_index_status_label():
+        stats = file_system_index.stats()
+        catalog_text = f"列カタログ: {column_catalog.stats()['files']:,}件"
+        if column_catalog_state['running']:
+            progress = column_catalog.progress
+            catalog_text += f" (更新中 {progress['done']:,}/{progress['total']:,})"
+        index_status_label.config(
+            text=f"索引: ファイル {stats['files']:,}件 / ディレクトリ {stats['directories']:,}件 "
+                 f"(更新 {file_system_index.last_update_seconds:.1f}秒)  {catalog_text}")
+
+    # 列カタログの更新の状態 (実行中に再度要求されたら、終わってからもう一度更新する)
+    column_catalog_state = {'running': False, 'pending': False}
+
+    def update_column_catalog():
+        """索引にあるファイルのうち、カタログにないか変更されたファイルの列名をバックグラウンドで読む。"""
+        if not file_system_index.ready:
+            return
+        if column_catalog_state['running']:
+            column_catalog_state['pending'] = True
+            return
+        column_catalog_state.update(running=True, pending=False)
+        roots = list(global_root_directories)
+
+        def run_update():
+            files = file_system_index.files()
+            if not column_catalog.loaded:
+                column_catalog.load()
+            column_catalog.prune({path for path, _, _ in files}, roots)
+            return column_catalog.update(files)
+        future = background_executor.submit(run_update)
+
+        def on_done(future):
+            column_catalog_state['running'] = False
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error updating column catalog: {e}")
+            refresh_index_status_label()
+            if column_catalog_state['pending']:
+                update_column_catalog()
+        poll_future(index_status_label, future, on_done, interval_ms=500, on_poll=refresh_index_status_label)
+
+    def update_file_index(rebuild=False):
+        """
+        ファイルシステムの索引をバックグラウンドで作成 (rebuild) または更新する。
+        更新でディレクトリの変化が見つかった場合はツリーを再構築する。
+        """
+        status_text = "索引: 作成中…" if rebuild else "索引: 更新中…"
+        index_status_label.config(text=status_text)
+        roots = list(global_root_directories)
+        future = background_executor.submit(file_system_index.build if rebuild else file_system_index.refresh, roots)
+
+        def on_poll():
+            index_status_label.config(text=f"{status_text} (ディレクトリ {file_system_index.scanned_count:,}件)")
+
+        def on_done(future):
+            try:
+                changed = future.result()
+            except Exception as e:
+                index_status_label.config(text=f"索引: エラー ({e})")
+                return
+            refresh_index_status_label()
+            if not rebuild and changed:
+                filter_treeview()
+            update_column_catalog()
+        poll_future(index_status_label, future, on_done, interval_ms=200, on_poll=on_poll)
+
+    index_refresh_button = ttk.Button(
+        top_controls_frame,
+        text="索引を更新",
+        command=lambda: update_file_index(),
+        style='Gray.TButton',
+        cursor="hand2"
+    )
+    index_refresh_button.grid(row=0, column=5, sticky="e", padx=5, pady=5)
+
     # 拡張子フィルターチェックボックス
     extension_filter_frame = ttk.Frame(top_controls_frame, style='LightGray.TFrame')
     extension_filter_frame.grid(row=0, column=3, sticky="ew", padx=10, pady=5)
@@ -1292,17 +5226,21 @@ def show_file_processing_page(initial_directory_paths=None):
     search_options_frame = ttk.Frame(top_controls_frame, style='LightGray.TFrame')
     search_options_frame.grid(row=0, column=4, sticky="ew", padx=10, pady=5)
 
-    search_scope_var = tk.StringVar(value="all") # all, directories, files
-    search_type_var = tk.StringVar(value="partial") # partial, full
+    search_scope_var = tk.StringVar(value="all") # all, directories, files, columns (列名で検索)
+    search_type_var = tk.StringVar(value="partial") # partial, full, fuzzy, glob, regex
 
     ttk.Label(search_options_frame, text="範囲:", style='TLabel').pack(side="left", padx=5)
     ttk.Radiobutton(search_options_frame, text="全て", variable=search_scope_var, value="all", command=lambda: filter_treeview(), style='TRadiobutton').pack(side="left")
     ttk.Radiobutton(search_options_frame, text="Dir", variable=search_scope_var, value="directories", command=lambda: filter_treeview(), style='TRadiobutton').pack(side="left")
     ttk.Radiobutton(search_options_frame, text="File", variable=search_scope_var, value="files", command=lambda: filter_treeview(), style='TRadiobutton').pack(side="left")
+    ttk.Radiobutton(search_options_frame, text="列", variable=search_scope_var, value="columns", command=lambda: filter_treeview(), style='TRadiobutton').pack(side="left")
 
     ttk.Label(search_options_frame, text="タイプ:", style='TLabel').pack(side="left", padx=10)
     ttk.Radiobutton(search_options_frame, text="部分", variable=search_type_var, value="partial", command=lambda: filter_treeview(), style='TRadiobutton').pack(side="left")
     ttk.Radiobutton(search_options_frame, text="完全", variable=search_type_var, value="full", command=lambda: filter_treeview(), style='TRadiobutton').pack(side="left")
+    ttk.Radiobutton(search_options_frame, text="曖昧", variable=search_type_var, value="fuzzy", command=lambda: filter_treeview(), style='TRadiobutton').pack(side="left")
+    ttk.Radiobutton(search_options_frame, text="glob", variable=search_type_var, value="glob", command=lambda: filter_treeview(), style='TRadiobutton').pack(side="left")
+    ttk.Radiobutton(search_options_frame, text="正規表現", variable=search_type_var, value="regex", command=lambda: filter_treeview(), style='TRadiobutton').pack(side="left")
 
 
     # --- 左パネル: ファイルツリーと変数リスト ---
@@ -1339,72 +5277,291 @@ def show_file_processing_page(initial_directory_paths=None):
     var_list_scrollbar_y.grid(row=1, column=1, sticky="ns", pady=(30,5))
     variable_listbox.config(yscrollcommand=var_list_scrollbar_y.set)
 
-    def add_files_to_treeview(tree, current_dir, parent_iid, search_term="", active_extensions=None, search_scope="all", search_type="partial"):
-        """Treeviewにファイルとサブディレクトリを再帰的に追加する。"""
+    # 現在の検索条件とフィルター。ディレクトリが展開されたときに子を追加する際にも使う
+    # visible_pathsは、曖昧/glob/正規表現の検索で索引から求めた、表示するパス (一致したエントリとその親) の集合
+    tree_filter_state = {'search_term': "", 'active_extensions': {'.csv', '.h5', '.hdf', '.xlsx', '.xls'},
+                         'search_scope': "all", 'search_type': "partial", 'visible_paths': None}
+
+    def add_files_to_treeview(tree, current_dir, parent_iid, search_term="", active_extensions=None, search_scope="all", search_type="partial",
+                              visible_paths=None, listing=None):
+        """
+        Treeviewにディレクトリ直下のファイルとサブディレクトリを追加する (1階層だけ)。
+        サブディレクトリには仮の子を入れて展開可能に表示し、中身は展開されたときに追加する。
+        listing (サブディレクトリ名のリスト, ファイルのリスト) を渡さない場合は、ファイルシステムの
+        索引から (索引になければディスクから) 読む。
+        """
         if active_extensions is None:
             active_extensions = {'.csv', '.h5', '.hdf', '.xlsx', '.xls'}
 
         try:
-            items = sorted(os.listdir(current_dir), key=lambda s: (not os.path.isdir(os.path.join(current_dir, s)), s.lower()))
-            for item_name in items:
-                path = os.path.join(current_dir, item_name)
-                
-                is_dir = os.path.isdir(path)
-                is_file = os.path.isfile(path)
-                
-                match_name = False
-                if search_type == "partial":
-                    match_name = search_term in item_name.lower()
-                else:
-                    match_name = search_term == item_name.lower()
-
-                if is_dir:
-                    if (search_scope == "all" or search_scope == "directories") and (match_name or not search_term):
-                        display_name = get_relative_path(path, global_current_working_directory)
-                        dir_iid = tree.insert(parent_iid, "end", text=display_name, open=False, tags=("directory",))
-                        add_files_to_treeview(tree, path, dir_iid, search_term, active_extensions, search_scope, search_type)
-                elif is_file:
-                    file_ext = os.path.splitext(item_name)[1].lower()
-                    if file_ext in active_extensions:
-                        if (search_scope == "all" or search_scope == "files") and (match_name or not search_term):
-                            display_name = get_relative_path(path, global_current_working_directory)
-                            tree.insert(parent_iid, "end", text=display_name, values=(path,), tags=("file",))
+            if listing is None:
+                listing = file_system_index.list_directory(current_dir)
+            if listing is None:
+                info = FileSystemIndex.scan_directory(current_dir)
+                listing = (info['subdirs'], info['files'])
+            subdirs, files = listing
+            entries = ([(name, os.path.join(current_dir, name), True, False) for name in subdirs] +
+                       [(name, os.path.join(current_dir, name), False, True) for name, _, _ in files])
+            for item_name, path, is_dir, is_file in entries:
+                if tree_entry_matches(path, is_dir, is_file, search_term, active_extensions, search_scope, search_type, visible_paths):
+                    insert_tree_entry(tree, parent_iid, path, is_dir)
         except PermissionError:
             print(f"Permission denied: {current_dir}")
         except Exception as e:
             print(f"Error listing directory {current_dir}: {e}")
 
+    # パス -> Treeviewのアイテム (変更イベントをツリーに反映するときに使う)
+    tree_items_by_path = {}
+
+    def tree_entry_matches(path, is_dir, is_file, search_term="", active_extensions=None, search_scope="all", search_type="partial",
+                           visible_paths=None):
+        """
+        ディレクトリ直下のエントリが検索条件とフィルターに合うかどうか。
+        visible_pathsがあれば名前ではなく、その集合に含まれるかどうかで判定する (一致したファイルの親ディレクトリも表示する)。
+        """
+        if active_extensions is None:
+            active_extensions = {'.csv', '.h5', '.hdf', '.xlsx', '.xls'}
+        item_name = os.path.basename(path)
+        if visible_paths is not None:
+            match_name = path in visible_paths
+            if is_dir:
+                return match_name
+        else:
+            match_name = match_entry_name(item_name, search_term, search_type)
+        if is_dir:
+            return (search_scope == "all" or search_scope == "directories") and (match_name or not search_term)
+        if is_file:
+            file_ext = os.path.splitext(item_name)[1].lower()
+            return (file_ext in active_extensions and search_scope in ("all", "files", "columns")
+                    and (match_name or not search_term))
+        return False
+
+    def insert_tree_entry(tree, parent_iid, path, is_dir, index="end", register=True):
+        """
+        ディレクトリまたはファイルのノードをTreeviewに追加する。展開して中身を読むノードには仮の子を入れる。
+        registerがFalseの場合 (検索結果のノード) は、パスからアイテムを引く対応表に登録しない。
+        """
+        display_name = get_relative_path(path, global_current_working_directory)
+        if is_dir:
+            item_iid = tree.insert(parent_iid, index, text=display_name, values=(path,), open=False, tags=("directory",))
+            tree.insert(item_iid, "end", text="読み込み中…", tags=("placeholder",))
+        elif os.path.splitext(path)[1].lower() in ('.h5', '.hdf'):
+            # HDF5ファイルは展開されたときにキーの一覧を読み込む
+            item_iid = tree.insert(parent_iid, index, text=display_name, values=(path,), tags=("file", "hdf_file"))
+            tree.insert(item_iid, "end", text="読み込み中…", tags=("placeholder",))
+        else:
+            item_iid = tree.insert(parent_iid, index, text=display_name, values=(path,), tags=("file",))
+        if register:
+            tree_items_by_path[path] = item_iid
+        return item_iid
+
+    def find_tree_item(path):
+        """パスに対応する、Treeviewに存在するアイテムを返す。"""
+        item_id = tree_items_by_path.get(path)
+        if item_id is not None and file_tree.exists(item_id):
+            return item_id
+        tree_items_by_path.pop(path, None)
+        return None
+
+    def has_placeholder_child(item_id):
+        """アイテムの子がまだ読み込まれていない (仮の子だけを持つ) かどうか。"""
+        children = file_tree.get_children(item_id)
+        return len(children) == 1 and "placeholder" in file_tree.item(children[0], "tags")
+
+    # 読み込み中のディレクトリのノード (同じディレクトリを重ねて読まない)
+    pending_directory_items = set()
+
+    def populate_directory_item(item_id):
+        """
+        ディレクトリのノードの仮の子を、現在の検索条件に合うファイルとサブディレクトリで置き換える。
+        索引にあるディレクトリはすぐに追加し、ないもの (索引の作成中など) はバックグラウンドのスレッドで
+        読んで、読み終えたものから順に追加する (ネットワークドライブでもTkスレッドを止めない)。
+        """
+        if not has_placeholder_child(item_id) or item_id in pending_directory_items:
+            return # 展開済みか読み込み中
+        dir_path = file_tree.item(item_id, "values")[0]
+        listing = file_system_index.list_directory(dir_path)
+        if listing is not None:
+            file_tree.delete(file_tree.get_children(item_id)[0])
+            add_files_to_treeview(file_tree, dir_path, item_id, listing=listing, **tree_filter_state)
+            return
+        pending_directory_items.add(item_id)
+        future = directory_scan_executor.submit(FileSystemIndex.scan_directory, dir_path)
+
+        def on_done(future):
+            pending_directory_items.discard(item_id)
+            if not file_tree.exists(item_id) or not has_placeholder_child(item_id):
+                return # ツリーが作り直された
+            placeholder = file_tree.get_children(item_id)[0]
+            try:
+                info = future.result()
+            except OSError as e:
+                file_tree.item(placeholder, text=f"読み込めません: {e}")
+                return
+            file_tree.delete(placeholder)
+            add_files_to_treeview(file_tree, dir_path, item_id, listing=(info['subdirs'], info['files']), **tree_filter_state)
+        poll_future(file_tree, future, on_done, interval_ms=30)
+
     def filter_treeview():
-        """検索条件とフィルターに基づいてTreeviewを再構築する。"""
-        search_term = search_entry.get().lower()
-        
-        active_extensions = set()
-        if csv_var.get(): active_extensions.update(['.csv'])
-        if h5_var.get(): active_extensions.update(['.h5', '.hdf'])
-        if excel_var.get(): active_extensions.update(['.xlsx', '.xls'])
+        """
+        検索条件とフィルターに基づいてTreeviewを再構築する。
+        ルートの直下だけを追加し、より深い階層はディレクトリが展開されたときに同じ条件で追加する。
+        """
+        search_term, active_extensions, search_scope_val, search_type_val = get_search_options()
+        if search_term and search_type_val in ("glob", "regex"):
+            try:
+                compile_search_pattern(search_term, search_type_val)
+            except re.error as e:
+                messagebox.showerror("検索エラー", f"検索パターンが不正です: {e}")
+                return
 
-        search_scope_val = search_scope_var.get()
-        search_type_val = search_type_var.get()
+        visible_paths = None
+        if search_scope_val == "columns" and not search_term:
+            search_scope_val = "all" # 列名の検索語がなければ、すべて表示する
+        if search_scope_val == "columns":
+            # 列カタログで一致したファイルと、ルートまでのその親ディレクトリを表示する
+            matched_paths = [path for path, _, _ in column_catalog.search(search_term, search_type_val, active_extensions)[0]]
+        elif search_term and (search_type_val in ("fuzzy", "glob", "regex") or "/" in search_term) and file_system_index.ready:
+            # 索引で一致したエントリと、ルートまでのその親ディレクトリを表示する
+            matched_paths = [path for path, _ in file_system_index.search(search_term, active_extensions,
+                                                                          search_scope_val, search_type_val)]
+        else:
+            matched_paths = None
+        if matched_paths is not None:
+            visible_paths = set()
+            for path in matched_paths:
+                while path not in visible_paths:
+                    visible_paths.add(path)
+                    parent_path = os.path.dirname(path)
+                    if parent_path == path:
+                        break
+                    path = parent_path
+        tree_filter_state.update(search_term=search_term, active_extensions=active_extensions,
+                                 search_scope=search_scope_val, search_type=search_type_val, visible_paths=visible_paths)
 
         # Treeviewの現在の内容をクリアする前に、選択をクリア
         file_tree.selection_remove(file_tree.selection())
         for item in file_tree.get_children():
             file_tree.delete(item)
+        tree_items_by_path.clear()
 
         for root_path in global_root_directories:
             root_name = os.path.basename(root_path)
-            root_match = False
-            if search_type_val == "partial":
-                root_match = search_term in root_name.lower()
-            else:
-                root_match = search_term == root_name.lower()
+            root_match = match_entry_name(root_name, search_term, search_type_val)
 
             if search_scope_val == "directories" and not (root_match or not search_term):
                 continue 
 
             display_root_name = get_relative_path(root_path, global_current_working_directory)
-            root_item_id = file_tree.insert("", "end", text=display_root_name, open=True, tags=("directory",))
-            add_files_to_treeview(file_tree, root_path, root_item_id, search_term, active_extensions, search_scope_val, search_type_val)
+            if search_scope_val == "columns":
+                # 列カタログで、このルートの下で列名が一致するデータセット (ファイル/シート/キー) の数を数える
+                match_count = column_catalog.search(search_term, search_type_val, active_extensions, root=root_path)[1]
+                display_root_name += f"  (列が一致: {match_count:,}件)"
+            elif search_term and file_system_index.ready:
+                # 索引で、このルートの下 (未展開の階層を含む) に一致するエントリの数を数える
+                match_count = len(file_system_index.search(search_term, active_extensions, search_scope_val,
+                                                           search_type_val, root=root_path))
+                display_root_name += f"  (一致: {match_count:,}件)"
+            root_item_id = file_tree.insert("", "end", text=display_root_name, values=(root_path,), open=True, tags=("directory",))
+            file_tree.insert(root_item_id, "end", text="読み込み中…", tags=("placeholder",))
+            tree_items_by_path[root_path] = root_item_id
+            populate_directory_item(root_item_id)
+        run_live_search() # 検索結果のノードも作り直す
+
+    def get_search_options():
+        """検索エントリーとフィルターから、(検索語, 拡張子の集合, 範囲, タイプ) を返す。"""
+        active_extensions = set()
+        if csv_var.get(): active_extensions.update(['.csv'])
+        if h5_var.get(): active_extensions.update(['.h5', '.hdf'])
+        if excel_var.get(): active_extensions.update(['.xlsx', '.xls'])
+        search_type_val = search_type_var.get()
+        search_term = search_entry.get().strip()
+        if search_type_val != "regex": # 正規表現は大文字の記号 (\Dなど) を保つ (大文字小文字は区別しない)
+            search_term = search_term.lower()
+        return search_term, active_extensions, search_scope_var.get(), search_type_val
+
+    # 入力中の検索の状態 (遅延実行のafter ID、古い結果を捨てるための世代、結果のノード)
+    live_search_state = {'after_id': None, 'generation': 0, 'results_item': None}
+
+    def schedule_live_search(event=None):
+        """入力が止まってからSEARCH_DEBOUNCE_MSミリ秒後に、索引で検索する (Enterはツリー全体の絞り込み)。"""
+        if event is not None and event.keysym in ("Return", "KP_Enter"):
+            return
+        if live_search_state['after_id'] is not None:
+            file_processing_page.after_cancel(live_search_state['after_id'])
+        live_search_state['after_id'] = file_processing_page.after(SEARCH_DEBOUNCE_MS, run_live_search)
+
+    def run_live_search():
+        """索引をバックグラウンドで検索し、一致度の高い上位の結果をツリーの先頭の検索結果のノードに表示する。"""
+        live_search_state['after_id'] = None
+        live_search_state['generation'] += 1
+        generation = live_search_state['generation']
+        search_term, active_extensions, search_scope_val, search_type_val = get_search_options()
+        column_search = search_scope_val == "columns"
+        if not search_term or not (file_system_index.ready or column_search):
+            show_search_results(None)
+            return
+        if column_search:
+            future = background_executor.submit(column_catalog.search, search_term, search_type_val, active_extensions,
+                                                None, SEARCH_RESULT_LIMIT)
+        else:
+            future = background_executor.submit(file_system_index.search_ranked, search_term, active_extensions,
+                                                search_scope_val, search_type_val, None, SEARCH_RESULT_LIMIT)
+
+        def on_done(future):
+            if generation != live_search_state['generation']:
+                return # 入力が変わった
+            try:
+                results, total = future.result()
+            except re.error as e:
+                show_search_results(search_term, error=f"検索パターンが不正です: {e}")
+                return
+            show_search_results(search_term, results, total, column_hits=column_search)
+        poll_future(file_tree, future, on_done, interval_ms=30)
+
+    def show_search_results(search_term, results=(), total=0, error=None, column_hits=False):
+        """
+        検索結果のノードを作り直す。search_termがNoneならノードを取り除く。
+        column_hitsがTrueの場合、resultsは列カタログの (パス, シート/キー, 一致した列名) のリスト。
+        """
+        results_item = live_search_state['results_item']
+        if results_item is not None and file_tree.exists(results_item):
+            file_tree.delete(results_item)
+        live_search_state['results_item'] = None
+        if search_term is None:
+            return
+        if error is not None:
+            text = f"検索結果: {error}"
+        elif column_hits and total > len(results):
+            text = f"列の検索結果: 「{search_term}」 {len(results):,}件を表示 (全{total:,}件)"
+        elif column_hits:
+            text = f"列の検索結果: 「{search_term}」 {total:,}件"
+        elif total > len(results):
+            text = f"検索結果: 「{search_term}」 上位{len(results):,}件 (全{total:,}件)"
+        else:
+            text = f"検索結果: 「{search_term}」 {total:,}件"
+        results_item = file_tree.insert("", 0, text=text, open=True, tags=("search_results",))
+        live_search_state['results_item'] = results_item
+        if column_hits:
+            for path, dataset, columns in results:
+                insert_column_hit(results_item, path, dataset, columns)
+            return
+        for path, is_dir in results:
+            insert_tree_entry(file_tree, results_item, path, is_dir, register=False)
+
+    def insert_column_hit(parent_iid, path, dataset, columns):
+        """
+        列の検索結果を1件追加する。シート/キーがあれば、そのデータセットを直接選択できるノードにする
+        (複数選択して一括で変数に組み込める)。
+        """
+        display_name = get_relative_path(path, global_current_working_directory)
+        columns_text = ", ".join(columns[:5]) + (f" ほか{len(columns) - 5}列" if len(columns) > 5 else "")
+        if dataset is None:
+            return file_tree.insert(parent_iid, "end", text=f"{display_name}  — 列: {columns_text}",
+                                    values=(path,), tags=("file",))
+        tag = "hdf_key" if path.lower().endswith(('.h5', '.hdf')) else "excel_sheet"
+        return file_tree.insert(parent_iid, "end", text=f"{display_name} [{dataset}]  — 列: {columns_text}",
+                                values=(path, dataset), tags=(tag,))
 
     # 初期ディレクトリの追加 (初回起動時のみ)
     if initial_directory_paths:
@@ -1414,17 +5571,20 @@ def show_file_processing_page(initial_directory_paths=None):
     
     filter_treeview()
     update_variable_list(variable_listbox)
+    # ファイルシステムの索引を作成する (前回のページで作成済みなら変更だけを読み直す)
+    update_file_index(rebuild=not file_system_index.ready)
 
     # --- 右パネル: データフレーム表示と操作 ---
     right_frame = ttk.Frame(file_processing_page, style='White.TFrame')
     right_frame.grid(row=1, column=1, sticky="nsew", padx=10, pady=10)
     right_frame.rowconfigure(0, weight=0) # 現在のファイルラベル
-    right_frame.rowconfigure(1, weight=1) # データフレームテキスト表示
+    right_frame.rowconfigure(1, weight=1) # データフレームのテーブル表示
     right_frame.rowconfigure(2, weight=0) # スクロールバー
     right_frame.rowconfigure(3, weight=0) # 範囲入力フレーム
     right_frame.rowconfigure(4, weight=0) # フィルタ式入力
     right_frame.rowconfigure(5, weight=0) # 注意書き
     right_frame.rowconfigure(6, weight=0) # 新しい機能ボタン行
+    right_frame.rowconfigure(7, weight=0) # キャッシュ状態
     right_frame.columnconfigure(0, weight=1)
 
     current_file_label = ttk.Label(
@@ -1434,24 +5594,21 @@ def show_file_processing_page(initial_directory_paths=None):
     )
     current_file_label.grid(row=0, column=0, sticky="ew", pady=10)
 
-    dataframe_text = tk.Text(
+    dataframe_view = DataFrameTableView(
         right_frame,
-        wrap="none",
-        bg="#F8F8F8",
-        fg="#333333",
         font=("Courier", 10),
-        relief="flat", bd=0,
-        state="disabled"
+        bg="#F8F8F8",
+        fg="#333333"
     )
-    dataframe_text.grid(row=1, column=0, sticky="nsew", padx=5, pady=5)
+    dataframe_view.grid(row=1, column=0, sticky="nsew", padx=5, pady=5)
 
-    dataframe_scrollbar_y = ttk.Scrollbar(right_frame, orient="vertical", command=dataframe_text.yview, style='TScrollbar')
+    dataframe_scrollbar_y = ttk.Scrollbar(right_frame, orient="vertical", command=dataframe_view.yview, style='TScrollbar')
     dataframe_scrollbar_y.grid(row=1, column=1, sticky="ns")
-    dataframe_text.config(yscrollcommand=dataframe_scrollbar_y.set)
+    dataframe_view.set_scroll_commands(yscrollcommand=dataframe_scrollbar_y.set)
 
-    dataframe_scrollbar_x = ttk.Scrollbar(right_frame, orient="horizontal", command=dataframe_text.xview, style='TScrollbar')
+    dataframe_scrollbar_x = ttk.Scrollbar(right_frame, orient="horizontal", command=dataframe_view.xview, style='TScrollbar')
     dataframe_scrollbar_x.grid(row=2, column=0, sticky="ew")
-    dataframe_text.config(xscrollcommand=dataframe_scrollbar_x.set)
+    dataframe_view.set_scroll_commands(xscrollcommand=dataframe_scrollbar_x.set)
 
     # 行/列範囲入力フレーム
     range_frame = ttk.Frame(right_frame, style='White.TFrame')
@@ -1484,10 +5641,11 @@ def show_file_processing_page(initial_directory_paths=None):
     display_button = ttk.Button(
         range_frame,
         text="表示",
-        command=lambda: display_dataframe_content(dataframe_text, current_file_label, 
+        command=lambda: display_dataframe_content(dataframe_view, current_file_label, 
                                                  start_row_entry, end_row_entry, 
                                                  start_col_entry, end_col_entry,
-                                                 row_label_entry, col_label_entry, filter_expression_entry),
+                                                 row_label_entry, col_label_entry, filter_expression_entry,
+                                                 streaming_filter_var=streaming_filter_var),
         style='TButton',
         cursor="hand2"
     )
@@ -1501,12 +5659,15 @@ def show_file_processing_page(initial_directory_paths=None):
     filter_expression_entry = ttk.Entry(filter_frame, width=50, style='TEntry')
     filter_expression_entry.grid(row=0, column=1, sticky="ew", padx=5)
     ttk.Label(filter_frame, text="例: `col_A > 10 and col_B == 'value'`", style='Note.TLabel').grid(row=1, column=1, sticky="w", padx=5)
+    # 全データを読み込まず、チャンクごとにフィルタを適用して一致した行だけを保持する
+    streaming_filter_var = tk.BooleanVar(value=False)
+    ttk.Checkbutton(filter_frame, text="ストリーミング", variable=streaming_filter_var, style='TCheckbutton').grid(row=0, column=2, sticky="e", padx=5)
 
 
     # DataFrameの行/列選択に関する注意書き
     ttk.Label(
         right_frame,
-        text="注: 行/列のドラッグ選択はTextウィジェットでは直接サポートされていません。\n数値インデックスまたはラベル、または '開始:終了' 形式で範囲指定して表示してください。",
+        text="注: 数値インデックスまたはラベル、または '開始:終了' 形式で範囲指定して表示してください。\n行ラベルは '開始:終了' の範囲や 'a, b, c' のリストでも指定できます (日時・数値のラベルにも対応)。",
         style='Note.TLabel'
     ).grid(row=5, column=0, sticky="ew", pady=5)
 
@@ -1517,10 +5678,21 @@ def show_file_processing_page(initial_directory_paths=None):
     feature_buttons_frame.columnconfigure(1, weight=1)
     feature_buttons_frame.columnconfigure(2, weight=1)
 
+    def embed_current_dataframe():
+        """現在表示中のデータフレームの列を変数に組み込む。"""
+        if current_dataframe_path is None:
+            messagebox.showwarning("警告", "変数に組み込むファイルが選択されていません。")
+            return
+        file_path, sheet_name = current_dataframe_path, current_dataframe_sheet
+        # 組み込みには全データが必要 (プレビュー中ならバックグラウンドで読み込む)
+        request_full_dataframe(dataframe_view, file_path, sheet_name,
+                               lambda df: embed_variables_dialog(file_processing_page, df, file_path, sheet_name, variable_listbox),
+                               current_file_label)
+
     embed_var_button = ttk.Button(
         feature_buttons_frame,
         text="変数に組み込む",
-        command=lambda: embed_variables_dialog(file_processing_page, loaded_dataframes.get(current_dataframe_path + (f"_{current_dataframe_sheet}" if current_dataframe_sheet else "")), current_dataframe_path, current_dataframe_sheet, variable_listbox),
+        command=lambda: embed_current_dataframe(),
         style='TButton',
         cursor="hand2"
     )
@@ -1532,7 +5704,8 @@ def show_file_processing_page(initial_directory_paths=None):
         command=lambda: embed_multiple_variables_from_selection(file_processing_page, file_tree,
                                                                  start_row_entry, end_row_entry, 
                                                                  start_col_entry, end_col_entry,
-                                                                 row_label_entry, col_label_entry, filter_expression_entry, variable_listbox),
+                                                                 row_label_entry, col_label_entry, filter_expression_entry, variable_listbox,
+                                                                 streaming_filter_var),
         style='TButton',
         cursor="hand2"
     )
@@ -1556,6 +5729,255 @@ def show_file_processing_page(initial_directory_paths=None):
     )
     calculate_button.grid(row=1, column=0, columnspan=3, sticky="ew", padx=5, pady=5)
 
+    def save_workspace_action():
+        """変数、ルートディレクトリ、プロットを選択したディレクトリにバックグラウンドで保存する。"""
+        directory = filedialog.askdirectory(title="ワークスペースの保存先", parent=file_processing_page)
+        if not directory:
+            return
+        manifest_path = os.path.join(directory, WORKSPACE_MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            if not messagebox.askyesno("確認", "このディレクトリのワークスペースを上書きしますか？", parent=file_processing_page):
+                return
+        elif os.listdir(directory):
+            if not messagebox.askyesno(
+                    "確認", f"このディレクトリは空ではありません。\n{WORKSPACE_MANIFEST_NAME} と "
+                    f"{WORKSPACE_DATA_DIRECTORY}/ を追加してワークスペースを保存しますか？\n(既存のファイルは変更しません)",
+                    parent=file_processing_page):
+                return
+        save_workspace_button.config(state="disabled", text="保存中…")
+        future = background_executor.submit(save_workspace, directory)
+
+        def on_done(future):
+            save_workspace_button.config(state="normal", text="ワークスペースを保存")
+            try:
+                count = future.result()
+            except Exception as e:
+                messagebox.showerror("エラー", f"ワークスペースの保存中にエラーが発生しました: {e}")
+                return
+            messagebox.showinfo("情報", f"{count}個の変数をワークスペースに保存しました。\n{directory}")
+        poll_future(save_workspace_button, future, on_done)
+
+    def open_workspace_action():
+        """
+        保存したワークスペースを開き、変数とプロットを置き換え、ルートディレクトリを追加する。
+        配列の値は使われたときに読み込む。
+        """
+        directory = filedialog.askdirectory(title="ワークスペースを開く", parent=file_processing_page)
+        if not directory:
+            return
+        try:
+            variables, roots, layers = load_workspace(directory)
+        except ValueError as e:
+            messagebox.showerror("エラー", str(e))
+            return
+        if (global_variables or plot_layers) and not messagebox.askyesno(
+                "確認", "現在の変数とプロットをワークスペースの内容で置き換えますか？", parent=file_processing_page):
+            return
+        global_variables.clear()
+        global_variables.update(variables)
+        plot_layers[:] = layers
+        update_variable_list(variable_listbox)
+        new_roots = [path for path in roots if path not in global_root_directories and os.path.isdir(path)]
+        if new_roots:
+            global_root_directories.extend(new_roots)
+            filter_treeview()
+            update_file_index()
+        messagebox.showinfo("情報", f"{len(variables)}個の変数と{len(layers)}個のプロットを復元しました。")
+
+    save_workspace_button = ttk.Button(
+        feature_buttons_frame,
+        text="ワークスペースを保存",
+        command=save_workspace_action,
+        style='TButton',
+        cursor="hand2"
+    )
+    save_workspace_button.grid(row=2, column=0, sticky="ew", padx=5, pady=5)
+
+    open_workspace_button = ttk.Button(
+        feature_buttons_frame,
+        text="ワークスペースを開く",
+        command=open_workspace_action,
+        style='TButton',
+        cursor="hand2"
+    )
+    open_workspace_button.grid(row=2, column=1, columnspan=2, sticky="ew", padx=5, pady=5)
+
+    # キャッシュ状態の表示と設定
+    cache_frame = ttk.Frame(right_frame, style='White.TFrame')
+    cache_frame.grid(row=7, column=0, sticky="ew", padx=10, pady=(0, 10))
+    cache_frame.columnconfigure(0, weight=1)
+
+    cache_status_label = ttk.Label(cache_frame, text="", style='Note.TLabel')
+    cache_status_label.grid(row=0, column=0, sticky="w", padx=5)
+
+    def configure_cache_budget():
+        """キャッシュのメモリ予算 (GB) をユーザーに入力してもらい、反映する。"""
+        if ask_cache_budget(file_processing_page):
+            update_cache_status_label(cache_status_label)
+
+    cache_settings_button = ttk.Button(
+        cache_frame,
+        text="キャッシュ設定",
+        command=configure_cache_budget,
+        style='Gray.TButton',
+        cursor="hand2"
+    )
+    cache_settings_button.grid(row=0, column=1, sticky="e", padx=5)
+
+    def configure_variable_memory():
+        """変数の値をメモリに常駐させる上限と、ディスクに退避し始める空きメモリの閾値 (GB) を設定する。"""
+        if ask_variable_memory_settings(file_processing_page):
+            update_variable_list(variable_listbox)
+
+    def show_memory_panel():
+        """メモリの内訳のウィンドウを開く。変更があったら変数リストとキャッシュの表示を更新する。"""
+        show_memory_page(file_processing_page,
+                         on_change=lambda: [update_variable_list(variable_listbox), update_cache_status_label(cache_status_label)])
+
+    variable_memory_button = ttk.Button(
+        cache_frame,
+        text="変数のメモリ",
+        command=configure_variable_memory,
+        style='Gray.TButton',
+        cursor="hand2"
+    )
+    variable_memory_button.grid(row=0, column=4, sticky="e", padx=5)
+
+    memory_panel_button = ttk.Button(
+        cache_frame,
+        text="メモリの内訳",
+        command=show_memory_panel,
+        style='Gray.TButton',
+        cursor="hand2"
+    )
+    memory_panel_button.grid(row=0, column=5, sticky="e", padx=5)
+
+    def configure_disk_cache():
+        """ディスクキャッシュのディレクトリとサイズ上限を設定する。"""
+        global disk_cache_directory, disk_cache_max_bytes
+        if pa_feather is None:
+            messagebox.showerror("エラー", "ディスクキャッシュにはpyarrowが必要です。\n`pip install pyarrow` でインストールしてください。")
+            return
+        new_dir = filedialog.askdirectory(title="ディスクキャッシュのディレクトリを選択 (キャンセルで無効化)")
+        if not new_dir:
+            if disk_cache_directory and messagebox.askyesno("確認", "ディスクキャッシュを無効にしますか？"):
+                disk_cache_directory = None
+            return
+        max_gb = simpledialog.askfloat("ディスクキャッシュ設定", "ディスクキャッシュの最大サイズ (GB) を入力してください。",
+                                       initialvalue=round(disk_cache_max_bytes / 1024 ** 3, 2), minvalue=0.01, parent=file_processing_page)
+        if max_gb:
+            disk_cache_max_bytes = int(max_gb * 1024 ** 3)
+        disk_cache_directory = new_dir
+        evict_disk_cache()
+        messagebox.showinfo("情報", f"ディスクキャッシュを有効にしました: {disk_cache_directory}\n最大サイズ: {format_bytes(disk_cache_max_bytes)}")
+
+    def clear_disk_cache_action():
+        """ディスクキャッシュのファイルをすべて削除する。"""
+        if disk_cache_directory is None:
+            messagebox.showinfo("情報", "ディスクキャッシュは有効になっていません。")
+            return
+        if not messagebox.askyesno("確認", f"ディスクキャッシュ '{disk_cache_directory}' を削除しますか？"):
+            return
+        removed_count, removed_bytes = clear_disk_cache()
+        messagebox.showinfo("情報", f"{removed_count}個のキャッシュファイル ({format_bytes(removed_bytes)}) を削除しました。")
+
+    disk_cache_button = ttk.Button(
+        cache_frame,
+        text="ディスクキャッシュ",
+        command=configure_disk_cache,
+        style='Gray.TButton',
+        cursor="hand2"
+    )
+    disk_cache_button.grid(row=0, column=2, sticky="e", padx=5)
+
+    clear_disk_cache_button = ttk.Button(
+        cache_frame,
+        text="キャッシュをクリア",
+        command=clear_disk_cache_action,
+        style='Red.TButton',
+        cursor="hand2"
+    )
+    clear_disk_cache_button.grid(row=0, column=3, sticky="e", padx=5)
+
+    def configure_dtype_compaction():
+        """読み込み時の型の最適化 (整数・floatの縮小、category、日付) の有効/無効と許容誤差を設定する。"""
+        global dtype_compaction_settings
+        enable = messagebox.askyesnocancel(
+            "型の最適化", "CSV/Excelの読み込み時に列の型を小さくしますか？\n"
+            "64ビットの整数は値が収まればint32に、float64はfloat32に、種類の少ない文字列はcategoryに、"
+            "日付の文字列はdatetime64にします。\n"
+            "(変数に組み込む整数はint64に戻します)", parent=file_processing_page)
+        if enable is None:
+            return
+        if not enable:
+            dtype_compaction_settings = None
+            return
+        settings = dict(DTYPE_COMPACTION_DEFAULTS, **(dtype_compaction_settings or {}))
+        tolerance = simpledialog.askfloat("型の最適化", "float32にする際に許す相対誤差を入力してください。\n"
+                                          "(0なら値が変わらない列だけ。センサー値なら1e-6程度)",
+                                          initialvalue=settings['float_tolerance'], minvalue=0.0, parent=file_processing_page)
+        if tolerance is None:
+            return
+        ratio = simpledialog.askfloat("型の最適化", "種類数が行数のこの割合以下の文字列の列をcategoryにします。",
+                                      initialvalue=settings['category_max_ratio'], minvalue=0.0, maxvalue=1.0,
+                                      parent=file_processing_page)
+        if ratio is None:
+            return
+        dtype_compaction_settings = dict(settings, float_tolerance=tolerance, category_max_ratio=ratio)
+        if len(loaded_dataframes) and messagebox.askyesno(
+                "確認", "読み込み済みのデータは元の型のままです。キャッシュを破棄して、次回から最適化して読み込みますか？",
+                parent=file_processing_page):
+            loaded_dataframes.clear()
+            filter_masks.clear()
+            update_cache_status_label(cache_status_label)
+
+    dtype_compaction_button = ttk.Button(
+        cache_frame,
+        text="型の最適化",
+        command=configure_dtype_compaction,
+        style='Gray.TButton',
+        cursor="hand2"
+    )
+    dtype_compaction_button.grid(row=0, column=6, sticky="e", padx=5)
+
+    def refresh_cache_status():
+        """キャッシュ状態のラベルを定期的に更新する。"""
+        if not cache_status_label.winfo_exists():
+            return
+        update_cache_status_label(cache_status_label)
+        file_processing_page.after(1000, refresh_cache_status)
+
+    refresh_cache_status()
+
+
+    def expand_hdf_file_item(item_id):
+        """HDF5ファイルのノードの仮の子を、キー (データセット) のノードに置き換える。"""
+        if not has_placeholder_child(item_id):
+            return # 展開済み
+        children = file_tree.get_children(item_id)
+        file_path = file_tree.item(item_id, "values")[0]
+        try:
+            datasets = list_hdf_datasets(file_path)
+        except Exception as e:
+            file_tree.item(children[0], text=f"キーを読み込めませんでした: {e}")
+            return
+        file_tree.delete(children[0])
+        for info in datasets:
+            file_tree.insert(item_id, "end", text=format_hdf_dataset_label(info),
+                             values=(file_path, info['key']), tags=("hdf_key",))
+
+    def on_tree_open(event):
+        """Treeviewのノードが展開されたときのイベントハンドラ。"""
+        item_id = file_tree.focus()
+        if not item_id:
+            return
+        item_tags = file_tree.item(item_id, "tags")
+        if "hdf_file" in item_tags:
+            expand_hdf_file_item(item_id)
+        elif "directory" in item_tags:
+            populate_directory_item(item_id)
+
+    file_tree.bind("<<TreeviewOpen>>", on_tree_open)
 
     def on_tree_select(event):
         """Treeviewでアイテムが選択されたときのイベントハンドラ。"""
@@ -1576,7 +5998,14 @@ def show_file_processing_page(initial_directory_paths=None):
 
         item_tags = file_tree.item(selected_item_id, "tags")
         
-        if "file" in item_tags:
+        if "hdf_key" in item_tags or "excel_sheet" in item_tags:
+            # HDF5のキー、または列の検索結果のExcelのシート
+            file_path, dataset_name = file_tree.item(selected_item_id, "values")
+            load_and_display_dataframe(file_path, dataset_name, dataframe_view, current_file_label,
+                                       start_row_entry, end_row_entry, start_col_entry, end_col_entry,
+                                       row_label_entry, col_label_entry, filter_expression_entry,
+                                       variable_listbox)
+        elif "file" in item_tags:
             file_path = file_tree.item(selected_item_id, "values")[0] # valuesには絶対パスが格納されている
             sheet_name = None
             if file_path.lower().endswith(('.xlsx', '.xls')):
@@ -1584,17 +6013,106 @@ def show_file_processing_page(initial_directory_paths=None):
                 if sheet_name is None:
                     file_tree.selection_remove(selected_item_id)
                     return
-            load_and_display_dataframe(file_path, sheet_name, dataframe_text, current_file_label, 
+            elif "hdf_file" in item_tags:
+                # キーが1つだけならそのまま表示し、複数あればキーの一覧を展開して選択を促す
+                expand_hdf_file_item(selected_item_id)
+                key_items = file_tree.get_children(selected_item_id)
+                if len(key_items) != 1 or "hdf_key" not in file_tree.item(key_items[0], "tags"):
+                    file_tree.item(selected_item_id, open=True)
+                    current_file_label.config(text=f"キーを選択してください: {os.path.basename(file_path)}")
+                    return
+                sheet_name = file_tree.item(key_items[0], "values")[1]
+            load_and_display_dataframe(file_path, sheet_name, dataframe_view, current_file_label, 
                                        start_row_entry, end_row_entry, start_col_entry, end_col_entry,
-                                       row_label_entry, col_label_entry, filter_expression_entry)
+                                       row_label_entry, col_label_entry, filter_expression_entry,
+                                       variable_listbox)
         elif "directory" in item_tags:
             if file_tree.item(selected_item_id, "open"):
                 file_tree.item(selected_item_id, open=False)
             else:
+                populate_directory_item(selected_item_id) # プログラムから開く場合は<<TreeviewOpen>>が発生しない
                 file_tree.item(selected_item_id, open=True)
 
     file_tree.bind("<<TreeviewSelect>>", on_tree_select)
 
+    def apply_tree_change(kind, path, is_dir):
+        """変更イベントを1件、展開済みの階層のツリーに反映する。"""
+        if kind == 'removed':
+            item_id = find_tree_item(path)
+            if item_id is not None and file_tree.parent(item_id):
+                file_tree.delete(item_id)
+            return
+        if kind == 'modified':
+            item_id = find_tree_item(path)
+            if item_id is not None and "hdf_file" in file_tree.item(item_id, "tags") and not has_placeholder_child(item_id):
+                # キーの一覧を読み直すよう、展開前の状態に戻す
+                file_tree.delete(*file_tree.get_children(item_id))
+                file_tree.insert(item_id, "end", text="読み込み中…", tags=("placeholder",))
+                file_tree.item(item_id, open=False)
+            return
+        parent_id = find_tree_item(os.path.dirname(path))
+        if parent_id is None or has_placeholder_child(parent_id) or find_tree_item(path) is not None:
+            return # 未展開の階層は、展開したときに索引から読み込む
+        if not tree_entry_matches(path, is_dir, not is_dir, **tree_filter_state):
+            return
+        # ディレクトリを先に、名前順に並ぶ位置に挿入する
+        sort_key = (not is_dir, os.path.basename(path).lower())
+        index = 0
+        for child in file_tree.get_children(parent_id):
+            child_values = file_tree.item(child, "values")
+            if not child_values:
+                continue
+            child_key = ("directory" not in file_tree.item(child, "tags"), os.path.basename(child_values[0]).lower())
+            if child_key > sort_key:
+                break
+            index += 1
+        insert_tree_entry(file_tree, parent_id, path, is_dir, index=index)
+
+    def process_file_change_events():
+        """
+        監視スレッドの変更イベントを少しずつ取り出して、ツリーとキャッシュに反映する。
+        1回に処理するのはFILE_EVENT_BATCH_SIZE件までで、残りは次の呼び出しで処理する。
+        """
+        if directory_watcher is None:
+            return
+        processed = 0
+        changed_files = set()
+        catalog_outdated = False
+        while processed < FILE_EVENT_BATCH_SIZE:
+            try:
+                kind, path, is_dir = directory_watcher.events.get_nowait()
+            except queue.Empty:
+                break
+            processed += 1
+            try:
+                apply_tree_change(kind, path, is_dir)
+            except tk.TclError:
+                pass
+            if not is_dir and kind in ('modified', 'removed'):
+                changed_files.add(path)
+            if kind != 'removed':
+                catalog_outdated = True
+        variables_marked = False
+        for path in changed_files:
+            variables_marked = invalidate_file_caches(path) or variables_marked
+        if variables_marked:
+            update_variable_list(variable_listbox)
+        if current_dataframe_path in changed_files:
+            file_name = os.path.basename(current_dataframe_path)
+            status = "削除されました" if get_file_signature(current_dataframe_path) is None else "更新されました"
+            current_file_label.config(text=f"{file_name} はディスク上で{status} (再選択で読み直し)")
+        if processed:
+            refresh_index_status_label()
+            update_cache_status_label(cache_status_label)
+        if catalog_outdated:
+            update_column_catalog() # 追加・変更されたファイルの列名を読む
+        file_processing_page.after(50 if processed >= FILE_EVENT_BATCH_SIZE else 500, process_file_change_events)
+
+    # ルートディレクトリの変更の監視を開始する (ページをまたいで同じスレッドを使う)
+    if directory_watcher is None or not directory_watcher.is_alive():
+        directory_watcher = DirectoryWatcher(file_system_index, global_root_directories, get_watched_files).start()
+    file_processing_page.after(500, process_file_change_events)
+
     # --- 戻るボタン ---
     back_button = ttk.Button(
         file_processing_page,
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+# analytic_app.py はパッケージではないので、HALLAL/ を import パスに追加する
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "HALLAL"))
+os.environ.setdefault("MPLBACKEND", "Agg") # 画面のない環境でもmatplotlibを読み込めるように
+
+import analytic_app as app # noqa: E402
+
+
+@pytest.fixture
+def clean_globals():
+    """変数、プロット、ルートディレクトリ、キャッシュのグローバルな状態を空にし、テスト後に元に戻す。"""
+    saved = (dict(app.global_variables), list(app.plot_layers), list(app.global_root_directories),
+             app.dtype_compaction_settings)
+    app.global_variables.clear()
+    app.plot_layers.clear()
+    app.global_root_directories.clear()
+    app.loaded_dataframes.clear()
+    app.preview_dataframes.clear()
+    yield app
+    app.global_variables.clear()
+    app.global_variables.update(saved[0])
+    app.plot_layers[:] = saved[1]
+    app.global_root_directories[:] = saved[2]
+    app.dtype_compaction_settings = saved[3]
+    app.loaded_dataframes.clear()
+    app.preview_dataframes.clear()
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+import analytic_app as app
+
+
+def write_sensor_csv(path, rows):
+    pd.DataFrame({
+        'count': np.arange(rows) % 100,
+        'reading': np.arange(rows) * 0.5,
+        'status': ['OK', 'WARN'] * (rows // 2),
+    }).to_csv(path, index=False)
+
+
+def test_short_file_is_compacted_like_a_full_load(clean_globals, tmp_path):
+    app.dtype_compaction_settings = dict(app.DTYPE_COMPACTION_DEFAULTS)
+    short_path, long_path = str(tmp_path / "short.csv"), str(tmp_path / "long.csv")
+    write_sensor_csv(short_path, 10) # プレビュー行数未満 (プレビューが全データになる)
+    write_sensor_csv(long_path, 1000)
+
+    app.get_or_load_preview(short_path)
+    short_full = app.loaded_dataframes.get(app.get_dataframe_key(short_path))
+    long_full = app.parse_dataframe_file(long_path)
+    assert short_full.dtypes.to_dict() == long_full.dtypes.to_dict()
+    assert short_full.attrs.get('compaction')
+
+
+def assert_streaming_matches_full_load(path, expr):
+    full = app.parse_dataframe_file(path).query(expr)
+    streamed = app.read_filtered_dataframe(path, None, expr, chunk_rows=7)
+    pd.testing.assert_frame_equal(streamed, full, check_categorical=False)
+    return streamed
+
+
+def test_streaming_filter_sees_compacted_dtypes(clean_globals, tmp_path):
+    app.dtype_compaction_settings = dict(app.DTYPE_COMPACTION_DEFAULTS)
+    path = str(tmp_path / "big.csv")
+    pd.DataFrame({
+        'count': np.arange(40) * 10_000_000,          # int32に収まるが、1000倍すると桁あふれする
+        'stamp': [f"2024-01-{day:02d}" for day in range(1, 41) if day <= 28] + ["2024-02-01"] * 12,
+    }).to_csv(path, index=False)
+
+    streamed = assert_streaming_matches_full_load(path, "count * 1000 > 0 and stamp < '2024-01-20'")
+    assert streamed['count'].dtype == np.int32
+    assert streamed['stamp'].dtype.kind == 'M'
+
+
+def test_streaming_drops_columns_that_only_fit_in_early_chunks(clean_globals, tmp_path):
+    app.dtype_compaction_settings = dict(app.DTYPE_COMPACTION_DEFAULTS)
+    path = str(tmp_path / "late.csv")
+    values = np.arange(30, dtype=np.int64)
+    values[-1] = 2**40 # 最後のチャンクだけint32に収まらない
+    pd.DataFrame({'value': values, 'reading': [0.5] * 29 + [0.1]}).to_csv(path, index=False)
+
+    streamed = assert_streaming_matches_full_load(path, "value >= 0")
+    assert streamed['value'].dtype == np.int64
+    assert streamed['reading'].dtype == np.float64
+
+
+def test_only_narrowed_integer_columns_are_widened():
+    df = pd.DataFrame({'narrowed': np.arange(5, dtype=np.int64), 'native': np.arange(5, dtype=np.int32)})
+    compacted = app.compact_dataframe(df, app.DTYPE_COMPACTION_DEFAULTS)
+    assert compacted.attrs['compaction']['narrowed_ints'] == ['narrowed']
+
+    assert app.widen_integer_values(compacted['narrowed']).dtype == np.int64
+    assert app.widen_integer_values(compacted['native']).dtype == np.int32
+    assert app.widen_integer_values(df['native']).dtype == np.int32 # 最適化していないデータ (HDF5など)
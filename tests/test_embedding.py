@@ -0,0 +1,26 @@
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import analytic_app as app
+
+
+def test_broken_pool_is_shut_down_and_replaced(monkeypatch):
+    monkeypatch.setattr(app, "embed_process_pool", None)
+    pool = app.get_embed_process_pool()
+    with pytest.raises(BrokenProcessPool):
+        pool.submit(os._exit, 1).result(timeout=60) # 子プロセスが異常終了する
+
+    shutdown_calls = []
+    shutdown = pool.shutdown
+    monkeypatch.setattr(pool, "shutdown", lambda **kwargs: (shutdown_calls.append(kwargs), shutdown(**kwargs)))
+    app.discard_embed_process_pool(pool)
+    assert shutdown_calls[0] == {'wait': False, 'cancel_futures': True}
+    replacement = app.get_embed_process_pool()
+    try:
+        assert replacement is not pool
+        app.discard_embed_process_pool(pool) # 古いプールを再び捨てても、新しいプールは残る
+        assert app.embed_process_pool is replacement
+    finally:
+        replacement.shutdown()
@@ -0,0 +1,37 @@
+import os
+
+import analytic_app as app
+
+
+def make_tree(root, names):
+    for name in names:
+        path = os.path.join(os.fsencode(root), name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"a\n1\n")
+
+
+def test_build_and_search_plain_names(tmp_path):
+    make_tree(str(tmp_path), [b"sensors/run1.csv", b"sensors/run2.csv", b"other/notes.xlsx"])
+    index = app.FileSystemIndex()
+    index.build([str(tmp_path)])
+    found = {os.path.basename(path) for path, is_dir in index.search("run", search_type="partial")}
+    assert found == {"run1.csv", "run2.csv"}
+    fuzzy = {os.path.basename(path) for path, _ in index.search("run1.cvs", search_type="fuzzy")}
+    assert "run1.csv" in fuzzy
+
+
+def test_build_with_undecodable_names(tmp_path):
+    # Shift_JISの「テスト/runあ.csv」(UTF-8としては不正なバイト列)
+    make_tree(str(tmp_path), [b"\x83e\x83X\x83g/run\x82\xa0.csv", b"plain/run3.csv"])
+    index = app.FileSystemIndex()
+    index.build([str(tmp_path)])
+    assert index.ready
+    found = {os.fsencode(os.path.basename(path)) for path, _ in index.search("run", search_type="partial")}
+    assert found == {b"run\x82\xa0.csv", b"run3.csv"}
+    assert index.search("run3", search_type="fuzzy")
+
+
+def test_trigram_keys_accept_surrogates():
+    keys, owners = app.get_trigram_keys(["ab\udc83cd", "xyz"])
+    assert len(keys) == len(owners) > 0
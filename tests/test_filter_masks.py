@@ -0,0 +1,17 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import analytic_app as app
+
+
+def test_filter_masks_are_reused_only_for_the_same_frame():
+    df = pd.DataFrame({'x': np.arange(10)})
+    first = app.get_filter_mask(df, 'x > 4', df_key='k', version=1)
+    assert first.sum() == 5 and not first.flags.writeable
+    assert app.get_filter_mask(df, 'x > 4', df_key='k', version=1) is first
+
+    reloaded = df.copy()
+    assert app.get_filter_mask(reloaded, 'x > 4', df_key='k', version=1) is not first
+    with pytest.raises(ValueError):
+        app.compute_filter_mask(df, 'x + 1')
@@ -0,0 +1,64 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+import analytic_app as app
+
+
+def test_cache_evicts_least_recently_used_frames():
+    frame_bytes = app.get_dataframe_nbytes(pd.DataFrame({'x': np.zeros(100)}))
+    cache = app.DataFrameCache(budget_bytes=3 * frame_bytes)
+    for name in ("a", "b", "c"):
+        cache.put(name, pd.DataFrame({'x': np.zeros(100)}))
+    cache.get("a") # 最近使ったので、次に追い出されるのはb
+    cache.put("d", pd.DataFrame({'x': np.zeros(100)}))
+    assert cache.keys() == ["c", "a", "d"]
+    assert cache.stats()['evictions'] == 1
+
+
+def test_report_counts_short_file_preview_once(clean_globals, tmp_path):
+    path = str(tmp_path / "short.csv")
+    pd.DataFrame({'x': np.arange(10.0)}).to_csv(path, index=False)
+    app.get_or_load_preview(path) # 全データなのでプレビューとキャッシュで同じデータフレームを持つ
+
+    report = app.collect_memory_report(app.MemoryAccountant())
+    preview_row = next(row for row in report['rows'] if row['kind'] == 'preview')
+    assert preview_row['shared_with'] == [app.get_dataframe_key(path)]
+    assert preview_row['shared_bytes'] >= 10 * 8 # 列のデータ
+    assert report['totals']['shared_bytes'] == preview_row['shared_bytes']
+
+
+def test_report_subtracts_variables_that_view_other_variables(clean_globals):
+    base = np.arange(1000.0)
+    app.global_variables['a'] = {'value': base}
+    app.global_variables['b'] = {'value': base[:500]}
+
+    report = app.collect_memory_report(app.MemoryAccountant())
+    row_b = next(row for row in report['rows'] if row['key'] == 'b')
+    assert row_b['shared_bytes'] == base[:500].nbytes and row_b['shared_with'] == ['a']
+
+
+def test_cache_can_be_used_like_a_dict():
+    cache = app.DataFrameCache(budget_bytes=10**9)
+    first, second = pd.DataFrame({'x': [1]}), pd.DataFrame({'y': [2]})
+    cache["a"], cache["b"] = first, second
+
+    assert list(cache) == ["a", "b"] and "a" in cache and len(cache) == 2
+    assert dict(cache.items()) == {"a": first, "b": second}
+    assert cache.values() == [first, second]
+    assert {key: cache[key] for key in cache}["b"] is second
+    del cache["a"]
+    assert list(cache) == ["b"] and cache.total_bytes == app.get_dataframe_nbytes(second)
+
+
+def test_report_reads_previews_under_the_preview_lock(clean_globals):
+    app.preview_dataframes['k'] = {'df': pd.DataFrame({'x': [1.0]}), 'signature': None}
+    reports = []
+    with app.preview_dataframes_lock: # ワーカースレッドがプレビューを書き換えている間
+        worker = threading.Thread(target=lambda: reports.append(app.collect_memory_report(app.MemoryAccountant())))
+        worker.start()
+        worker.join(timeout=0.2)
+        assert not reports
+    worker.join(timeout=5)
+    assert [row['key'] for row in reports[0]['rows'] if row['kind'] == 'preview'] == ['k']
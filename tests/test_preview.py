@@ -0,0 +1,59 @@
+import threading
+import time
+
+import pandas as pd
+
+import analytic_app as app
+
+
+class FakeView:
+    """after()のコールバックを手動で実行する、表示先ウィジェットの代わり。"""
+    def __init__(self):
+        self.callbacks = []
+        self.shown = None
+        self.message = None
+
+    def winfo_exists(self):
+        return True
+
+    def after(self, interval_ms, callback):
+        self.callbacks.append(callback)
+
+    def show_message(self, text):
+        self.message = text
+
+    def show_dataframe(self, df):
+        self.shown = df
+
+    def run_pending(self, timeout=5):
+        deadline = time.monotonic() + timeout
+        while self.shown is None and time.monotonic() < deadline:
+            callbacks, self.callbacks = self.callbacks, []
+            for callback in callbacks:
+                callback()
+            time.sleep(0.01)
+
+
+def test_preview_is_read_off_the_tk_thread(clean_globals, tmp_path, monkeypatch):
+    path = str(tmp_path / "slow.csv")
+    pd.DataFrame({'x': range(100)}).to_csv(path, index=False)
+    release = threading.Event()
+    reader_threads = []
+    read_preview = app.read_dataframe_preview
+
+    def slow_read_preview(*args, **kwargs):
+        reader_threads.append(threading.current_thread())
+        release.wait(timeout=5) # 遅いディスク
+        return read_preview(*args, **kwargs)
+
+    monkeypatch.setattr(app, "read_dataframe_preview", slow_read_preview)
+    for name in ("current_load_task", "current_dataframe_path", "current_dataframe_sheet", "current_dataframe_is_preview"):
+        monkeypatch.setattr(app, name, getattr(app, name)) # テスト後に元に戻す
+    view = FakeView()
+    app.load_and_display_dataframe(path, dataframe_view_widget=view)
+    assert view.shown is None and view.message # 読み込みを待たずに戻る
+
+    release.set()
+    view.run_pending()
+    assert len(view.shown) == app.PREVIEW_ROWS and app.current_dataframe_is_preview
+    assert reader_threads and reader_threads[0] is not threading.current_thread()
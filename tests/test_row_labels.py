@@ -0,0 +1,27 @@
+import pandas as pd
+import pytest
+
+import analytic_app as app
+
+
+def test_row_labels_resolve_exact_lists_and_ranges():
+    index = app.RowLabelIndex(pd.Index(['c', 'a', 'b', 'a']))
+    assert index.lookup('a').tolist() == [1, 3]
+    assert index.lookup('c, b').tolist() == [0, 2]
+    assert index.lookup('a:b').tolist() == [1, 2, 3] # 元の行の順
+    with pytest.raises(KeyError):
+        index.lookup('z')
+
+
+def test_datetime_row_labels_split_ranges_on_the_right_colon():
+    times = pd.date_range('2024-01-01 00:00', periods=4, freq='h')
+    index = app.RowLabelIndex(pd.DatetimeIndex(times))
+    assert index.lookup('2024-01-01 01:00:00').tolist() == [1]
+    assert index.lookup('2024-01-01 01:00:2024-01-01 02:00').tolist() == [1, 2]
+
+
+def test_unsortable_row_labels_still_match_exactly():
+    index = app.RowLabelIndex(pd.Index(['a', 1, 'b'], dtype=object))
+    assert index.lookup('b').tolist() == [2]
+    with pytest.raises(ValueError):
+        index.positions_for_range('a', 'b')
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import analytic_app as app
+
+
+def write_csv(path, values):
+    pd.DataFrame({'x': values}).to_csv(path, index=False)
+
+
+def test_lazy_variable_rebuilds_compacted_columns_as_int64(clean_globals, tmp_path):
+    app.dtype_compaction_settings = dict(app.DTYPE_COMPACTION_DEFAULTS)
+    path = str(tmp_path / "data.csv")
+    write_csv(path, np.arange(5))
+    var_info = {'value': app.LazyVariable(path, None, 'x', source_version=app.get_file_signature(path))}
+
+    value = app.get_variable_value(var_info)
+    assert value.tolist() == [0, 1, 2, 3, 4] and value.dtype == np.int64
+    assert not var_info.get('stale')
+
+
+def test_lazy_variable_refuses_to_rebuild_from_a_changed_file(clean_globals, tmp_path):
+    path = str(tmp_path / "data.csv")
+    write_csv(path, np.arange(5))
+    var_info = {'value': app.LazyVariable(path, None, 'x', source_version=app.get_file_signature(path))}
+    write_csv(path, np.arange(50))
+
+    with pytest.raises(ValueError):
+        app.get_variable_value(var_info)
+    assert var_info['stale']
+    assert not var_info['value'].can_rebuild()
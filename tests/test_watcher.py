@@ -0,0 +1,40 @@
+import time
+
+import analytic_app as app
+
+
+class StaticIndex:
+    """変更のない索引 (DirectoryWatcherのテスト用)。"""
+    ready = True
+    last_update_seconds = 0.0
+
+    def refresh(self, roots, only_dirs=None):
+        return []
+
+    def directories(self):
+        return []
+
+
+def test_polling_survives_errors_in_watched_file_checks(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "inotify_simple", None)
+    monkeypatch.setattr(app, "WATCH_POLL_INTERVAL_SECONDS", 0.01)
+    path = tmp_path / "data.csv"
+    path.write_text("a\n1\n")
+    calls = []
+
+    def watched_files():
+        calls.append(None)
+        if len(calls) == 2:
+            raise RuntimeError("loaded_dataframes changed during iteration")
+        return [str(path)]
+
+    watcher = app.DirectoryWatcher(StaticIndex(), [], watched_files).start()
+    try:
+        deadline = time.monotonic() + 5
+        while len(calls) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert watcher.is_alive() and len(calls) >= 3
+        path.write_text("a\n1\n2\n")
+        assert watcher.events.get(timeout=5) == ('modified', str(path), False)
+    finally:
+        watcher.stop()
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import analytic_app as app
+
+
+def add_variable(name, value):
+    app.global_variables[name] = {'value': value, 'source_file': 'Calculation', 'source_sheet': None,
+                                  'source_column': None, 'source_key': None, 'source_version': None, 'stale': False}
+
+
+def test_round_trip_restores_values_lazily(clean_globals, tmp_path):
+    add_variable('x', app.StoredVariable(pd.Series([1.5, 2.5], index=['a', 'b'], name='x')))
+    add_variable('n', app.StoredVariable(np.arange(4)))
+    add_variable('s', 3)
+    app.save_workspace(str(tmp_path))
+
+    variables, roots, layers = app.load_workspace(str(tmp_path))
+    assert variables['x']['value'].residency == 'disk' # 値はまだ読まれていない
+    assert app.get_variable_value(variables['x']).tolist() == [1.5, 2.5]
+    assert app.get_variable_value(variables['x']).index.tolist() == ['a', 'b']
+    assert app.get_variable_value(variables['n']).tolist() == [0, 1, 2, 3]
+    assert variables['s']['value'] == 3
+
+
+def test_save_keeps_unrelated_files(clean_globals, tmp_path):
+    data_directory = tmp_path / app.WORKSPACE_DATA_DIRECTORY
+    data_directory.mkdir()
+    unrelated = data_directory / "notes.txt"
+    unrelated.write_text("user data")
+    add_variable('a', app.StoredVariable(np.arange(3.0)))
+    add_variable('b', app.StoredVariable(np.arange(5.0)))
+    app.save_workspace(str(tmp_path))
+    first_files = set(p.name for p in data_directory.iterdir())
+
+    del app.global_variables['b']
+    app.save_workspace(str(tmp_path))
+    remaining = set(p.name for p in data_directory.iterdir())
+    assert unrelated.exists()
+    assert "notes.txt" in first_files - (first_files - remaining) # ツールが書いていないファイルは消さない
+    assert len(remaining - {"notes.txt"}) == 1 # 残るのは新しいマニフェストが参照する a のファイルだけ
+
+
+def test_plot_layers_keep_their_values_or_refuse_to_save(clean_globals, tmp_path):
+    add_variable('x', app.StoredVariable(np.arange(3.0)))
+    add_variable('t', np.datetime64('2024-01-02'))
+    app.plot_layers.append({'id': 'p1', 'type': 'scatter', 'x_var': 'x', 'y_var': 'x', 'z_var': None,
+                            'u_var': None, 'v_var': None, 'alpha': np.float32(0.5), 'bins': np.int64(30)})
+    app.save_workspace(str(tmp_path))
+    variables, _, layers = app.load_workspace(str(tmp_path))
+    assert layers[0]['alpha'] == 0.5 and layers[0]['bins'] == 30
+    assert app.get_variable_value(variables['t']) == np.datetime64('2024-01-02') # 文字列にならない
+
+    app.plot_layers[0]['limits'] = np.array([0.0, 1.0])
+    manifest_before = (tmp_path / app.WORKSPACE_MANIFEST_NAME).read_text(encoding="utf-8")
+    files_before = set((tmp_path / app.WORKSPACE_DATA_DIRECTORY).iterdir())
+    with pytest.raises(ValueError, match="p1"):
+        app.save_workspace(str(tmp_path))
+    assert (tmp_path / app.WORKSPACE_MANIFEST_NAME).read_text(encoding="utf-8") == manifest_before
+    assert set((tmp_path / app.WORKSPACE_DATA_DIRECTORY).iterdir()) == files_before